@@ -0,0 +1,203 @@
+"""
+Priority admission control for the API routes.
+
+Requests are classified by path into routes with a priority. A request runs
+once a global slot (admission_max_concurrent) and a slot of its route
+(admission_route_limits) are free. Waiting requests are admitted highest
+priority first, so /syncuser (RADIUS authorization path) overtakes webhooks,
+and webhooks overtake background and debug calls. Background and debug routes
+are shed with 429 and Retry-After instead of queueing behind a backlog.
+Queue wait time is recorded per route as the admission.wait.<route> timing.
+The route and priority are also the ISE ERS budget caller of the request (see
+ers_budget).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+import ers_budget
+import fastjson
+import metrics
+from config import get_config
+
+PRIORITY_AUTH = ers_budget.HIGH
+PRIORITY_WEBHOOK = ers_budget.NORMAL
+PRIORITY_BACKGROUND = ers_budget.LOW
+
+# (path prefix, route, priority), first match wins. Other paths (/health,
+# /metrics, /stats) are cheap and not admission controlled.
+ROUTES = (
+    ("/syncuser/", "syncuser", PRIORITY_AUTH),
+    ("/connected", "webhook", PRIORITY_WEBHOOK),
+    ("/disconnected", "webhook", PRIORITY_WEBHOOK),
+    ("/events/", "events", PRIORITY_WEBHOOK),
+    ("/debug/", "debug", PRIORITY_BACKGROUND),
+    ("/audit/", "audit", PRIORITY_BACKGROUND),
+)
+EXACT_ROUTES = {
+    "/sync": ("sync", PRIORITY_BACKGROUND),
+}
+
+
+class Rejected(Exception):
+    def __init__(self, route: str, retry_after: int):
+        super().__init__(f"Route {route} is overloaded")
+        self.route = route
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Global and per-route concurrency limits with a priority ordered wait queue.
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.route_active = {}
+        self.route_waiting = {}
+        # Average service time per route (EWMA, seconds), for Retry-After
+        self.service_time = {}
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def _route_limit(self, route: str) -> int:
+        config = get_config()
+        return config["admission_route_limits"].get(route, config["admission_max_concurrent"])
+
+    def _can_run(self, route: str) -> bool:
+        return self.active < get_config()["admission_max_concurrent"] \
+            and self.route_active.get(route, 0) < self._route_limit(route)
+
+    def _start(self, route: str):
+        self.active += 1
+        self.route_active[route] = self.route_active.get(route, 0) + 1
+
+    def retry_after(self, route: str) -> int:
+        waiting = self.route_waiting.get(route, 0) + 1
+        per_slot = self.service_time.get(route, 1.0) / max(1, self._route_limit(route))
+        return min(60, max(1, math.ceil(waiting * per_slot)))
+
+    async def acquire(self, route: str, priority: int) -> float:
+        """
+        Waits for a slot of route. Returns the queue wait in seconds.
+
+        Raises:
+        - Rejected: A background route that would have to queue behind a backlog.
+        """
+        if not self._waiters and self._can_run(route):
+            self._start(route)
+            return 0.0
+        config = get_config()
+        # Background / debug requests are rejected when this many requests are
+        # waiting in total, or when their own route already has this many waiting
+        if priority >= PRIORITY_BACKGROUND and (
+                len(self._waiters) >= config["admission_shed_queue_depth"]
+                or self.route_waiting.get(route, 0) >= config["admission_background_queue"]):
+            raise Rejected(route, self.retry_after(route))
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), route, future))
+        self.route_waiting[route] = self.route_waiting.get(route, 0) + 1
+        # Waiters ahead may be blocked by their route limit only
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just before the cancellation, hand it on
+                self.release(route, 0)
+            else:
+                self._remove_waiter(future, route)
+            raise
+        return time.monotonic() - start
+
+    def _remove_waiter(self, future, route: str):
+        self._waiters = [w for w in self._waiters if w[3] is not future]
+        heapq.heapify(self._waiters)
+        self.route_waiting[route] -= 1
+
+    def release(self, route: str, elapsed: float):
+        self.active -= 1
+        self.route_active[route] -= 1
+        if elapsed:
+            self.service_time[route] = 0.8 * self.service_time.get(route, elapsed) + 0.2 * elapsed
+        self._grant()
+
+    def _grant(self):
+        # Admit waiters in priority order, skipping those whose route is full
+        skipped = []
+        while self._waiters and self.active < get_config()["admission_max_concurrent"]:
+            waiter = heapq.heappop(self._waiters)
+            _, _, route, future = waiter
+            if future.done():
+                continue
+            if not self._can_run(route):
+                skipped.append(waiter)
+                continue
+            self.route_waiting[route] -= 1
+            self._start(route)
+            future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self._waiters, waiter)
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "routes": {route: {"active": self.route_active.get(route, 0),
+                               "waiting": self.route_waiting.get(route, 0)}
+                       for route in set(self.route_active) | set(self.route_waiting)},
+        }
+
+
+controller = AdmissionController()
+metrics.register_gauge("admission", controller.snapshot)
+
+
+def classify(path: str) -> tuple:
+    """
+    Returns (route, priority) for a request path, None if it is not admission controlled.
+    """
+    if path in EXACT_ROUTES:
+        return EXACT_ROUTES[path]
+    for prefix, route, priority in ROUTES:
+        if path.startswith(prefix):
+            return route, priority
+    return None
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware holding an admission slot for the whole request (including
+    streamed bodies and background tasks).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            return await self.app(scope, receive, send)
+        route, priority = route_class
+        try:
+            wait = await controller.acquire(route, priority)
+        except Rejected as e:
+            metrics.incr(f"admission.rejected.{route}")
+            body = fastjson.dumpb({"detail": f"Server busy, retry in {e.retry_after}s."})
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(e.retry_after).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        metrics.observe(f"admission.wait.{route}", wait)
+        start = time.monotonic()
+        try:
+            with ers_budget.caller_scope(route, priority):
+                await self.app(scope, receive, send)
+        finally:
+            controller.release(route, time.monotonic() - start)
@@ -1,18 +1,33 @@
+import admission
 import asyncio
+import audit_store
+import cache_dump
 import cisco_ise
 import pan_fw
-import json
+import prewarm
 import datetime
+import fastjson
 import os
 import secrets
+import time
 from argon2 import PasswordHasher
 from config import get_config
-from fastapi import Request, Depends, FastAPI, HTTPException, status
+from fastapi import BackgroundTasks, Request, Depends, FastAPI, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from logger import init_logging, logger
+import deadline
+import ers_budget
+import event_processor
+import gp_events
 import mailsender
+import metrics
+import resilience
+import session_stats
+import webhook_dedup
+import write_queue
 
-app = FastAPI(debug=False)
+app = FastAPI(debug=False, default_response_class=fastjson.JSONBytesResponse)
+app.add_middleware(admission.AdmissionMiddleware)
 # Setup Logging config
 init_logging()
 # Setup Security
@@ -45,34 +60,218 @@ def tsv_log(tsv_dir="./logs"):
     return tsv_path
 
 
-config = get_config()
-ise_token = config['ise_credentials']['token']
+# Config and credentials are loaded once in the startup hook (see load_settings)
+config = None
+ise_token = None
+fw_api_key = None
+# GP event syslog listener (transport / server), if enabled
+syslog_listener = None
+user_refresh_task = None
+digest_task = None
+prewarm_task = None
+replay_task = None
+compact_task = None
+flush_task = None
 
-try:
-    fw_api_key = config['fw_credentials']['api_key']
-except Exception:
-    fw_api_key = None
 
-if fw_api_key is None:
-    logger.error(
-        "PAN-OS API Key is empty. Please ensure valid key is initialized in config (use config.py to regenerate). API Disabled.")
-    exit(1)
+def load_settings():
+    """
+    Loads the (shared) config and the upstream credentials into the module globals.
+    """
+    global config
+    global ise_token
+    global fw_api_key
+    config = get_config()
+    ise_token = config['ise_credentials']['token']
+    try:
+        fw_api_key = config['fw_credentials']['api_key']
+    except Exception:
+        fw_api_key = None
 
 
 @app.on_event('shutdown')
 async def shutdown_event():
     print('Shutting down...!')
+    if syslog_listener is not None:
+        syslog_listener.close()
+    if user_refresh_task is not None:
+        user_refresh_task.cancel()
+    if digest_task is not None:
+        digest_task.cancel()
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    if replay_task is not None:
+        replay_task.cancel()
+    if compact_task is not None:
+        compact_task.cancel()
+    if flush_task is not None:
+        flush_task.cancel()
+    try:
+        cisco_ise.flush_user_data()
+    except Exception as e:
+        logger.error(f"Saving the ISE user cache failed. Error {e}")
 
 
 @app.on_event('startup')
 async def startup_event():
     global config
+    load_settings()
+    if fw_api_key is None:
+        logger.error(
+            "PAN-OS API Key is empty. Please ensure valid key is initialized in config (use config.py to regenerate). API Disabled.")
+        exit(1)
+    # Load the on-disk caches once per process
+    cisco_ise.init_user_cache()
+    pan_fw.init_fw_cache()
     logger.info("Starting GP API Server: Performing initial sync.")
     try:
-        syncresults = sync_gp_session_state(config, initial=True)
-        logger.debug(f"Sync Results: {syncresults}")
+        with ers_budget.caller_scope("initial_sync"):
+            syncresults = sync_gp_session_state(config, initial=True)
+        logger.opt(lazy=True).debug("Sync Results: {}", lambda: syncresults)
     except Exception:
         exit(1)
+    # Later syncs run their per-user writes in the users' event chains
+    event_processor.start()
+    global user_refresh_task
+    user_refresh_task = asyncio.create_task(refresh_user_list())
+    global replay_task
+    replay_task = asyncio.create_task(replay_queued_writes())
+    global compact_task
+    compact_task = asyncio.create_task(compact_session_log())
+    global flush_task
+    flush_task = asyncio.create_task(flush_user_cache())
+    if config['prewarm_interval']:
+        global prewarm_task
+        prewarm_task = asyncio.create_task(prewarm_user_cache())
+    if config['email_enabled']:
+        global digest_task
+        digest_task = asyncio.create_task(send_alert_digests())
+    if config.get('gp_syslog_port'):
+        global syslog_listener
+        syslog_listener = await gp_events.start_syslog_listener(
+            config['gp_syslog_host'],
+            config['gp_syslog_port'],
+            config['gp_syslog_protocol'])
+
+
+def refresh_ise_users():
+    """
+    Walks the full ISE user list and saves it to the cache (single user misses
+    are looked up by name, so this only runs in the background).
+    """
+    cisco_ise.ise_get_all_users(
+        cisco_ise.ise_get_pan_active(ise_token), ise_token)
+    cisco_ise.save_user_data()
+
+
+async def refresh_user_list():
+    """
+    Background task refreshing the ISE user list every ise_all_user_refresh_ttl seconds.
+    """
+    while True:
+        await asyncio.sleep(config['ise_all_user_refresh_ttl'])
+        try:
+            with ers_budget.caller_scope("refresh", ers_budget.LOW):
+                await asyncio.to_thread(refresh_ise_users)
+        except Exception as e:
+            logger.error(f"Background ISE user list refresh failed. Error {e}")
+
+
+async def replay_ise_writes() -> dict:
+    """
+    Replays the ISE updates queued during an outage, once the active ISE node is reachable.
+    """
+    ise_ip = await asyncio.to_thread(cisco_ise.ise_get_pan_last_known, ise_token)
+    if resilience.get_breaker(f"ise:{ise_ip}").is_open():
+        return {}
+    return await write_queue.replay(
+        lambda username, custom_attributes: cisco_ise.ise_update_user(
+            ise_ip, ise_token, username, custom_attributes, queue_on_failure=False))
+
+
+async def replay_queued_writes():
+    """
+    Background task draining the ISE write queue every write_queue_interval seconds.
+    """
+    while True:
+        await asyncio.sleep(config['write_queue_interval'])
+        if not write_queue.has_pending():
+            continue
+        try:
+            with ers_budget.caller_scope("replay"):
+                await replay_ise_writes()
+        except Exception as e:
+            logger.error(f"ISE write queue replay failed. Error {e}")
+
+
+async def compact_session_log():
+    """
+    Background task writing a FW data snapshot whenever the session delta log is
+    due for compaction, checked every fw_session_log_compact_interval seconds.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(pan_fw.compact_sessions)
+        except Exception as e:
+            logger.error(f"FW session log compaction failed. Error {e}")
+        await asyncio.sleep(config['fw_session_log_compact_interval'])
+
+
+async def flush_user_cache():
+    """
+    Background task saving the ISE user cache every ise_user_cache_flush_interval
+    seconds if it changed (request paths don't pickle it themselves).
+    """
+    while True:
+        await asyncio.sleep(config['ise_user_cache_flush_interval'])
+        try:
+            await asyncio.to_thread(cisco_ise.flush_user_data)
+        except Exception as e:
+            logger.error(f"Saving the ISE user cache failed. Error {e}")
+
+
+def prewarm_start():
+    """
+    Loads the learned login windows, bootstrapping them from the audit store on first run.
+    """
+    if os.path.isfile(prewarm.DATA_FILE):
+        prewarm.load()
+    else:
+        prewarm.learn_from_audit()
+
+
+async def prewarm_user_cache():
+    """
+    Background task pre-warming the ISE records of users about to log in, every
+    prewarm_interval seconds (see prewarm).
+    """
+    try:
+        await asyncio.to_thread(prewarm_start)
+    except Exception as e:
+        logger.error(f"Pre-warm: Loading login history failed. Error {e}")
+    while True:
+        await asyncio.sleep(config['prewarm_interval'])
+        try:
+            with ers_budget.caller_scope("prewarm", ers_budget.LOW):
+                await asyncio.to_thread(
+                    lambda: prewarm.run_once(cisco_ise.ise_get_pan_active(ise_token), ise_token))
+            await asyncio.to_thread(prewarm.save)
+        except Exception as e:
+            logger.error(f"Pre-warm run failed. Error {e}")
+
+
+async def send_alert_digests():
+    """
+    Background task mailing the digest of suppressed duplicate alerts every
+    mail_digest_interval seconds.
+    """
+    while True:
+        interval_start = time.time()
+        await asyncio.sleep(config['mail_digest_interval'])
+        try:
+            await asyncio.to_thread(mailsender.flush_digest, config, interval_start)
+        except Exception as e:
+            logger.error(f"Sending duplicate alert digest failed. Error {e}")
 
 
 async def exit_app():
@@ -118,46 +317,50 @@ async def root(auth_result: bool = Depends(check_auth)):
 @app.get("/health")
 async def root(request: Request) -> dict:
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
-    return {"message": "Health Check OK."}
+    return {
+        "message": "Health Check OK.",
+        "breakers": resilience.breaker_states(),
+        "gateways": pan_fw.gateway_status,
+    }
 
 
 @app.post("/connected")
 async def connected_event(request: Request, auth_result: bool = Depends(check_auth)) -> dict:
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
     try:
-        data = await request.json()
-        logger.debug(f"POST Data Received: {json.dumps(data, indent=2)}")
-        if 'customAttributes' in data['InternalUser'].keys():
-            res = update_user(data['InternalUser']['name'],
-                              data['InternalUser']['customAttributes'])
-        else:
-            res = update_user(data['InternalUser']['name'], {
-                'PaloAlto-GlobalProtect-Client-Version': "Unknown"})
-        logger.warning(
-            f"User {data['InternalUser']['name']} connected to GP. Attributes updated in ISE.")
-
+        data = fastjson.loads(await request.body())
+        logger.opt(lazy=True).debug(
+            "POST Data Received: {}", lambda: fastjson.dumps_pretty(data))
+        key = webhook_dedup.delivery_key("connected", data, request.headers)
+        return await webhook_dedup.deduplicate(
+            key, lambda: event_processor.submit(data['InternalUser']['name'], connect_user, data))
+    except event_processor.Overloaded as e:
+        raise overloaded(e)
     except Exception:
         logger.error(f"Malformed request received for /connected endpoint.")
         logger.debug(f"Request: {await request.body()}")
         return
-    logger.debug(f"POST Data: {json.dumps(data, indent=2)}")
-    try:
-        return res.json()
-    except AttributeError:
-        return {"message": "User not found in ISE. Skipping update."}
-    except Exception as e:
-        return {f"message": "Unknown error occurred. Error: {e}"}
 
 
 @ app.post("/disconnected")
 async def disconnected_event(request: Request, auth_result: str = Depends(check_auth)) -> dict:
-    global config
-    global fw_api_key
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
-    data = await request.json()
-    fw_ip = pan_fw.get_active_fw(
-        config['fw_ip'], config['fw_ha_ip'], fw_api_key)
-    if fw_ip is None:
+    data = fastjson.loads(await request.body())
+    key = webhook_dedup.delivery_key("disconnected", data, request.headers)
+
+    async def process():
+        result = await event_processor.submit(
+            data['InternalUser']['name'], disconnect_user, data)
+        if isinstance(result, dict) and "info" in result:
+            # Fleet-wide, so outside the user's event chain
+            await asyncio.to_thread(sync_gp_session_state, config)
+        return result
+
+    try:
+        return await webhook_dedup.deduplicate(key, process)
+    except event_processor.Overloaded as e:
+        raise overloaded(e)
+    except pan_fw.GatewayUnavailable:
         logger.error(
             "Unable to determine active PAN-OS device. Please check HA status and API key.")
         raise HTTPException(
@@ -165,14 +368,78 @@ async def disconnected_event(request: Request, auth_result: str = Depends(check_
             detail="Unable to determine active PAN-OS device. Please check HA status and API key.",
             headers={"WWW-Authenticate": "Basic"},
         )
-    gp_connected_user_data = pan_fw.fw_gp_ext(fw_ip, fw_api_key)
+
+
+def overloaded(e: event_processor.Overloaded) -> HTTPException:
+    """
+    The 429 response for an event of a user with too many events in flight.
+    """
+    logger.error(f"Rejected event: {e}")
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Too many events in flight for user {e.key}, retry in {e.retry_after}s.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def connect_user(data: dict) -> dict:
+    """
+    Applies a connect event (the /connected webhook body) to the user in ISE.
+
+    Args:
+    - data (dict): The webhook body with InternalUser name and optional customAttributes.
+
+    Returns:
+    dict: The ISE response body, or a message if the update was skipped.
+    """
+    if 'customAttributes' in data['InternalUser'].keys():
+        res = update_user(data['InternalUser']['name'],
+                          data['InternalUser']['customAttributes'])
+    else:
+        res = update_user(data['InternalUser']['name'], {
+            'PaloAlto-GlobalProtect-Client-Version': "Unknown"})
+    logger.warning(
+        f"User {data['InternalUser']['name']} connected to GP. Attributes updated in ISE.")
+    logger.opt(lazy=True).debug(
+        "POST Data: {}", lambda: fastjson.dumps_pretty(data))
+    if res is None and write_queue.is_pending(data['InternalUser']['name']):
+        return {"message": "ISE unreachable. Update queued for replay."}
+    try:
+        return fastjson.loads(res.content)
+    except AttributeError:
+        return {"message": "User not found in ISE. Skipping update."}
+    except Exception as e:
+        return {f"message": "Unknown error occurred. Error: {e}"}
+
+
+def disconnect_user(data: dict, gp_connected_user_data: dict = None) -> dict:
+    """
+    Applies a disconnect event (the /disconnected webhook body) to the user in ISE.
+    If the user still has a GP session (e.g. on another device / gateway) the ISE
+    attributes are left to the session state sync, which the caller runs outside
+    the user's event chain when an "info" result is returned.
+
+    Args:
+    - data (dict): The webhook body with InternalUser name and optional customAttributes.
+    - gp_connected_user_data (dict): The merged session index (polled if not given).
+
+    Returns:
+    dict: The ISE response body, or a message dict.
+
+    Raises:
+    - pan_fw.GatewayUnavailable: No gateway has a reachable active firewall.
+    """
+    global config
+    global fw_api_key
+    if gp_connected_user_data is None:
+        gp_connected_user_data = pan_fw.fw_gp_ext_all(
+            pan_fw.get_gateways(config), fw_api_key)
     if data['InternalUser']['name'].lower() in [k.lower() for k in gp_connected_user_data.keys()]:
         if len(gp_connected_user_data[data['InternalUser']['name'].lower()]) > 0:
-            sync_gp_session_state(config)
             logger.warning(
                 f"User {data['InternalUser']['name']} updated with existing session data on ISE.")
             return {"info": f"User {data['InternalUser']['name']} updated with existing session data."}
-    logger.debug(json.dumps(data, indent=2))
+    logger.opt(lazy=True).debug("{}", lambda: fastjson.dumps_pretty(data))
     if 'customAttributes' in data['InternalUser'].keys():
         res = update_user(data['InternalUser']['name'],
                           data['InternalUser']['customAttributes'])
@@ -185,20 +452,196 @@ async def disconnected_event(request: Request, auth_result: str = Depends(check_
                 "PaloAlto-Client-Source-IP": "",
                 "PaloAlto-GlobalProtect-Client-Version": "N-A"
             })
+    if res is None and write_queue.is_pending(data['InternalUser']['name']):
+        return {"message": "ISE unreachable. Update queued for replay."}
     try:
         logger.warning(
             f"User {data['InternalUser']['name']} disconnected from GP. Updating attributes in ISE.")
-        return res.json()
+        return fastjson.loads(res.content)
     except AttributeError:
         return {"message": f"User {data['InternalUser']['name']} not found in ISE. Skipping update."}
     except Exception as e:
         return {f"message": "Unknown error occurred. Error: {e}"}
 
 
+@ app.post('/events/batch')
+async def batch_events(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+    """
+    Applies an ordered batch of connect / disconnect events.
+
+    Events are grouped by user and collapsed to the final event per user, only
+    that one is applied (earlier events of the user are reported as superseded).
+    Users are processed concurrently, at most batch_concurrency at a time.
+
+    Args:
+    request (Request): The incoming request. The body is {"events": [...]} (or a
+    bare list) where each event is {"event": "connected" | "disconnected",
+    "InternalUser": {...}} with an optional "id".
+
+    Returns:
+    dict: Per-event results in request order, and a summary.
+    """
+    global config
+    logger.info(f"{request.client.host} - {request.method} - {request.url}")
+    try:
+        data = fastjson.loads(await request.body())
+        events = data['events'] if isinstance(data, dict) else data
+        assert isinstance(events, list)
+    except Exception:
+        logger.error("Malformed request received for /events/batch endpoint.")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Expected {\"events\": [...]}")
+
+    results = [None] * len(events)
+    final = {}
+    for i, event in enumerate(events):
+        try:
+            event_type = event['event']
+            username = event['InternalUser']['name'].lower()
+            assert event_type in ("connected", "disconnected")
+        except Exception:
+            results[i] = {"status": "error", "message": "Malformed event."}
+            continue
+        if username in final:
+            results[final[username]] = {"status": "superseded", "by": i}
+        final[username] = i
+
+    gp_connected_user_data = None
+    if any(events[i]['event'] == "disconnected" for i in final.values()):
+        try:
+            gp_connected_user_data = await asyncio.to_thread(
+                pan_fw.fw_gp_ext_all, pan_fw.get_gateways(config), fw_api_key)
+        except pan_fw.GatewayUnavailable:
+            logger.error(
+                "Unable to determine active PAN-OS device. Please check HA status and API key.")
+    still_connected = []
+    semaphore = asyncio.Semaphore(config['batch_concurrency'])
+
+    async def apply(i: int, username: str):
+        event = events[i]
+        async with semaphore:
+            try:
+                if event['event'] == "connected":
+                    result = await event_processor.submit(username, connect_user, event)
+                elif gp_connected_user_data is None:
+                    results[i] = {"status": "error",
+                                  "message": "Unable to determine active PAN-OS device."}
+                    return
+                else:
+                    result = await event_processor.submit(
+                        username, disconnect_user, event, gp_connected_user_data)
+                    if isinstance(result, dict) and "info" in result:
+                        still_connected.append(username)
+            except Exception as e:
+                logger.error(f"Batch event {i} for user {username} failed. Error {e}")
+                results[i] = {"status": "error", "message": str(e)}
+            else:
+                results[i] = {"status": "applied", "result": result}
+
+    await asyncio.gather(*[apply(i, username) for username, i in final.items()])
+    if still_connected:
+        await asyncio.to_thread(sync_gp_session_state, config)
+
+    for i, event in enumerate(events):
+        if isinstance(event, dict) and 'id' in event:
+            results[i]["id"] = event['id']
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return {"summary": summary, "results": results}
+
+
+@ app.post('/events/panos')
+async def panos_events(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+    """
+    Ingests GlobalProtect logs forwarded by a PAN-OS HTTP server profile.
+
+    Args:
+    request (Request): The incoming request, a JSON log record or a list of records.
+
+    Returns:
+    dict: Counts of connected / disconnected / ignored records.
+    """
+    try:
+        data = fastjson.loads(await request.body())
+    except Exception:
+        logger.error("Malformed request received for /events/panos endpoint.")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed JSON body")
+    records = data if isinstance(data, list) else [data]
+    # Applying events takes fw_data_lock and writes the session log, keep it off the event loop
+    return await asyncio.to_thread(gp_events.ingest_records, records, request.client.host)
+
+
+@ app.get('/metrics')
+async def get_metrics(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+    """
+    Returns the in-process counters and timing summaries.
+    """
+    logger.info(f"{request.client.host} - {request.method} - {request.url}")
+    return fastjson.JSONBytesResponse(metrics.snapshot())
+
+
+@ app.get('/stats')
+async def get_stats(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+    """
+    Returns the live session statistics (per region, OS and client version) and
+    per-minute history. Maintained incrementally, so the cost doesn't grow with
+    the number of sessions.
+    """
+    logger.info(f"{request.client.host} - {request.method} - {request.url}")
+    return fastjson.JSONBytesResponse(session_stats.snapshot())
+
+
+@ app.get('/audit/duplicates')
+async def get_duplicate_attempts(request: Request,
+                                 username: str = None,
+                                 ip: str = None,
+                                 since: datetime.datetime = None,
+                                 until: datetime.datetime = None,
+                                 days: int = None,
+                                 limit: int = 100,
+                                 cursor: str = None,
+                                 auth_result: str = Depends(check_auth)) -> dict:
+    """
+    Queries the duplicate login attempt history, newest first.
+
+    Args:
+    - username (str): Only attempts of this user.
+    - ip (str): Only attempts where the connected or the denied session used this public IP.
+    - since / until (datetime): ISO 8601 time range, or days for the last N days.
+    - limit (int): Page size (max 1000).
+    - cursor (str): next_cursor from the previous page.
+
+    Returns:
+    dict: The matching attempts ("items") and the cursor of the next page ("next_cursor").
+    """
+    logger.info(f"{request.client.host} - {request.method} - {request.url}")
+    if days is not None:
+        since = datetime.datetime.now() - datetime.timedelta(days=days)
+    try:
+        return await asyncio.to_thread(
+            audit_store.query, username=username, ip=ip,
+            since=since.timestamp() if since else None,
+            until=until.timestamp() if until else None,
+            limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
 @ app.get('/debug/getusersfromise')
-async def get_users_ise(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+async def get_users_ise(request: Request,
+                        format: str = "json",
+                        prefix: str = None,
+                        connected: bool = None,
+                        cursor: str = None,
+                        limit: int = None,
+                        fields: str = None,
+                        auth_result: str = Depends(check_auth)):
     """
-    Retrieve all users from ISE and cache them.
+    Retrieve all users from ISE and cache them. Takes the same output options as
+    /debug/getcachedusers.
 
     Args:
     request (Request): The incoming request object.
@@ -210,23 +653,41 @@ async def get_users_ise(request: Request, auth_result: str = Depends(check_auth)
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
     global ise_token
     global config
-    return cisco_ise.ise_get_all_users(cisco_ise.ise_get_pan_active(ise_token), ise_token)
+    users = await asyncio.to_thread(
+        lambda: cisco_ise.ise_get_all_users(cisco_ise.ise_get_pan_active(ise_token), ise_token))
+    return await asyncio.to_thread(
+        cache_dump.dump_users, users, format, prefix, connected, cursor, limit, fields)
 
 
 @ app.get('/debug/getcachedusers')
-async def get_users_cache(request: Request, auth_result: str = Depends(check_auth)) -> dict:
+async def get_users_cache(request: Request,
+                          format: str = "json",
+                          prefix: str = None,
+                          connected: bool = None,
+                          cursor: str = None,
+                          limit: int = None,
+                          fields: str = None,
+                          auth_result: str = Depends(check_auth)):
     """
     Retrieve all users from cache.
 
     Args:
     request (Request): The incoming request object.
+    format (str): json (default) or ndjson (streamed, one user per line).
+    prefix (str): Only users whose name starts with prefix.
+    connected (bool): Only GP connected (true) or not connected (false) users.
+    cursor (str): Continue after this username (next_cursor of the previous page).
+    limit (int): Page size. Without it all matching users are returned.
+    fields (str): Comma separated record keys to include, e.g. name,customAttributes.
 
     Returns:
-    dict: A dictionary containing all the ISE users from the cache.
+    dict: A dictionary containing all the ISE users from the cache, or one page
+    of them ({"users", "next_cursor"}) when limit is given.
 
     """
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
-    return cisco_ise.all_users
+    return await asyncio.to_thread(
+        cache_dump.dump_users, cisco_ise.all_users, format, prefix, connected, cursor, limit, fields)
 
 
 @ app.get('/sync')
@@ -242,15 +703,20 @@ async def sync_request(request: Request, auth_result: str = Depends(check_auth))
     """
     logger.info(f"{request.client.host} - {request.method} - {request.url}")
     global config
-    return sync_gp_session_state(config)
+    return await asyncio.to_thread(sync_gp_session_state, config)
 
 
 @ app.get('/syncuser/{username}')
 @ app.post('/syncuser/{username}')
-async def sync_user_request(username: str, request: Request, auth_result: str = Depends(check_auth)) -> dict:
+async def sync_user_request(username: str, request: Request, background_tasks: BackgroundTasks,
+                            auth_result: str = Depends(check_auth)) -> dict:
     """
     Sync a single user with the connected state from the firewall.
 
+    The whole upstream work runs under the syncuser_deadline budget (seconds).
+    If the budget runs out the configured syncuser_fallback decision is returned.
+    Notification mails and TSV audit writes are deferred until after the response.
+
     Args:
     - username (str): The username of the user to sync.
     - request (Request): The incoming request object.
@@ -264,84 +730,83 @@ async def sync_user_request(username: str, request: Request, auth_result: str =
             f"Authentication Failed for /syncuser/{username} endpoint.")
         return {"message": "Authentication Failed."}
     try:
-        data = await request.json()
-        logger.debug(f"POST Data Received: {json.dumps(data, indent=2)}")
+        data = fastjson.loads(await request.body())
+        logger.opt(lazy=True).debug(
+            "POST Data Received: {}", lambda: fastjson.dumps_pretty(data))
     except Exception:
         logger.error(f"Malformed request received for /syncuser/{username}")
         logger.debug(f"Request: {await request.body()}")
         return
     global config
+    start = time.monotonic()
+    try:
+        with deadline.deadline_scope(config['syncuser_deadline']):
+            # Runs in a worker thread (which inherits the deadline), so the event
+            # loop keeps admitting higher priority requests meanwhile. Ordered
+            # with the webhooks of the same user.
+            return await event_processor.submit(username, sync_user, username, data, background_tasks)
+    except (deadline.DeadlineExceeded, event_processor.Overloaded) as e:
+        overload = isinstance(e, event_processor.Overloaded)
+        reason = "Too many events in flight" if overload else "Deadline exceeded"
+        metrics.incr("syncuser.overloaded" if overload else "syncuser.deadline_miss")
+        decision = config['syncuser_fallback']
+        logger.error(
+            f"{reason} while syncing user {username}. Returning fallback decision '{decision}'.")
+        return {
+            "message": f"{reason} while syncing user {username}.",
+            "decision": decision,
+            "user": cisco_ise.all_users.get(username.lower()),
+        }
+    finally:
+        metrics.observe("syncuser", time.monotonic() - start)
+
+
+def sync_user(username: str, data: dict, background_tasks: BackgroundTasks) -> dict:
+    """
+    Syncs a single user's ISE attributes with the connected state from the firewall.
+    Runs within the caller's deadline, deferred work is added to background_tasks.
+
+    Args:
+    - username (str): The username of the user to sync.
+    - data (dict): The request body (InternalUser with the new session's customAttributes).
+    - background_tasks (BackgroundTasks): Tasks to run after the response is sent.
+
+    Returns:
+    dict: A dictionary containing the user data after the update.
+    """
+    global config
     global ise_token
     global fw_api_key
-    fw_ip = pan_fw.get_active_fw(
-        config['fw_ip'], config['fw_ha_ip'], fw_api_key)
-    if fw_ip is None:
-        logger.error(
-            "No active and reachable firewall found. Check firewall connectivity, HA status and API key.")
     user = cisco_ise.ise_enrich_user(
-        cisco_ise.ise_get_pan_active(ise_token),
+        cisco_ise.ise_get_pan_last_known(ise_token),
         ise_token,
         username.lower()
     )
     if user and '.' in user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
         logger.info(f"User {user['name']} synced with connected state on ISE")
-        gpusers = pan_fw.fw_gp_ext(fw_ip, fw_api_key, ignore_cache=True)
+        try:
+            # Targeted per-user query instead of a full current-user table dump
+            user_sessions = pan_fw.fw_gp_user_all(
+                pan_fw.get_gateways(config), fw_api_key, user['name'])
+        except pan_fw.GatewayUnavailable:
+            logger.error(
+                "No active and reachable firewall found. Check firewall connectivity, HA status and API key.")
+            user_sessions = pan_fw.merge_gateway_sessions().get(
+                user['name'].lower(), [])
         attributes = data['InternalUser']['customAttributes']
         duplicate_session = \
             attributes['PaloAlto-Client-Hostname'].lower().strip(
             ) != user['customAttributes']['PaloAlto-Client-Hostname'].lower().strip() #and \
             #attributes['PaloAlto-Client-OS'].strip(
             #) != user['customAttributes']['PaloAlto-Client-OS'].strip()
-        if duplicate_session and user['name'].lower() in [k.lower() for k in gpusers.keys()]:
+        if duplicate_session and len(user_sessions):
             logger.warning(
                 f"User {user['name']} tried login with new location while already connected. New attempt parameters {attributes}")
-            tsvlogfile = tsv_log()
-            eventdate = datetime.datetime.now().strftime("%b.%d.%Y")
-            eventtime = datetime.datetime.now().strftime("%H:%M:%S")
-            oldsession = user['customAttributes']
-            oldsession['PaloAlto-Client-Region'] = gpusers[user['name'].lower()
-                                                           ][0]['Raw-Data']['source-region']
-            """
-            tsv_header = "\t".join([
-            "sn", "username", "date", "time",
-            "connected-hostname", "connected-os", "connected-public-ip", "connected-region",
-            "denied-session-hostname", "denied-session-os", "denied-session-public-ip", "denied-session-region"]) + "\n"
-            """
-            tsv_entry = "\t".join([
-                datetime.datetime.now().strftime("%Y%m%d%H%M%S"),
-                user["name"].lower(),
-                eventdate,
-                eventtime,
-                oldsession["PaloAlto-Client-Hostname"],
-                oldsession["PaloAlto-Client-OS"],
-                oldsession["PaloAlto-Client-Source-IP"],
-                oldsession["PaloAlto-Client-Region"],
-                attributes["PaloAlto-Client-Hostname"],
-                attributes["PaloAlto-Client-OS"],
-                attributes["PaloAlto-Client-Source-IP"],
-                attributes["PaloAlto-Client-Region"],
-            ])
-
-            if config['email_enabled']:
-                mailsender.send_mail(
-                    config['smtp_server'],
-                    config['mail_user'],
-                    config['mail_from'],
-                    config['mail_to'],
-                    config['mail_password'],
-                    config['smtp_port'],
-                    f"GP Duplicate Loging Attempt - User: {user['name'].lower()}",
-                    mailsender.mail_html_body({
-                        'username': user['name'].lower(),
-                        'date': eventdate,
-                        'time': eventtime,
-                        'oldsession': user['customAttributes'],
-                        'newsession': attributes
-                    }),
-                    mail_srv_typ=config['smtp_type']
-                )
-            with open(tsvlogfile, "a+") as tsv_file:
-                tsv_file.write(tsv_entry + "\n")
+            oldsession = dict(user['customAttributes'])
+            oldsession['PaloAlto-Client-Region'] = user_sessions[0]['Raw-Data']['source-region']
+            session_stats.record_duplicate_attempt()
+            background_tasks.add_task(
+                record_duplicate_attempt, user['name'].lower(), oldsession, attributes, datetime.datetime.now())
         else:
             custom_attributes = {
                 "PaloAlto-Client-Hostname": '',
@@ -351,11 +816,13 @@ async def sync_user_request(username: str, request: Request, auth_result: str =
             }
             try:
                 cisco_ise.ise_update_user(
-                    cisco_ise.ise_get_pan_active(ise_token),
+                    cisco_ise.ise_get_pan_last_known(ise_token),
                     ise_token,
                     user['name'].lower(),
                     custom_attributes=custom_attributes
                 )
+            except deadline.DeadlineExceeded:
+                raise
             except Exception:
                 logger.error(f"Error updating user {user['name']} on ISE")
                 raise
@@ -365,6 +832,59 @@ async def sync_user_request(username: str, request: Request, auth_result: str =
     return user
 
 
+def record_duplicate_attempt(username: str, oldsession: dict, attributes: dict, event: datetime.datetime):
+    """
+    Writes a duplicate login attempt to the monthly TSV log and sends the notification mail.
+    Called as a background task after the /syncuser response has been sent.
+
+    Args:
+    - username (str): The (lower case) username.
+    - oldsession (dict): Attributes of the connected session, incl. PaloAlto-Client-Region.
+    - attributes (dict): Attributes of the denied login attempt.
+    - event (datetime.datetime): Time of the attempt.
+    """
+    global config
+    tsvlogfile = tsv_log()
+    eventdate = event.strftime("%b.%d.%Y")
+    eventtime = event.strftime("%H:%M:%S")
+    """
+    tsv_header = "\t".join([
+    "sn", "username", "date", "time",
+    "connected-hostname", "connected-os", "connected-public-ip", "connected-region",
+    "denied-session-hostname", "denied-session-os", "denied-session-public-ip", "denied-session-region"]) + "\n"
+    """
+    tsv_entry = "\t".join([
+        event.strftime("%Y%m%d%H%M%S"),
+        username,
+        eventdate,
+        eventtime,
+        oldsession["PaloAlto-Client-Hostname"],
+        oldsession["PaloAlto-Client-OS"],
+        oldsession["PaloAlto-Client-Source-IP"],
+        oldsession["PaloAlto-Client-Region"],
+        attributes["PaloAlto-Client-Hostname"],
+        attributes["PaloAlto-Client-OS"],
+        attributes["PaloAlto-Client-Source-IP"],
+        attributes["PaloAlto-Client-Region"],
+    ])
+    with open(tsvlogfile, "a+") as tsv_file:
+        tsv_file.write(tsv_entry + "\n")
+    try:
+        audit_store.record_attempt(username, oldsession, attributes, event)
+    except Exception as e:
+        logger.error(f"Failed to store duplicate attempt of {username} in audit store. Error {e}")
+
+    if config['email_enabled']:
+        # Repeated attempts of a user are aggregated into the periodic digest
+        mailsender.notify_duplicate(config, {
+            'username': username,
+            'date': eventdate,
+            'time': eventtime,
+            'oldsession': oldsession,
+            'newsession': attributes
+        })
+
+
 def update_user(user: str, custom_attributes: dict) -> dict:
     """
     Update a user in ISE with custom attributes.
@@ -379,7 +899,7 @@ def update_user(user: str, custom_attributes: dict) -> dict:
     global ise_token
 
     res = cisco_ise.ise_update_user(
-        cisco_ise.ise_get_pan_active(ise_token),
+        cisco_ise.ise_get_pan_last_known(ise_token),
         ise_token,
         user,
         custom_attributes
@@ -387,6 +907,134 @@ def update_user(user: str, custom_attributes: dict) -> dict:
     return res
 
 
+def session_changes(ise_gp_connected_users: dict, gp_connected_user_data: dict) -> dict:
+    """
+    Compares the GP sessions recorded on ISE with the firewall sessions (first session of each user).
+
+    Returns:
+    - dict: "added" and "removed" usernames, and "changed" usernames whose
+      hostname, OS or client IP differ.
+    """
+    changes = {"added": [], "removed": [], "changed": []}
+    for user, entries in gp_connected_user_data.items():
+        cache_user = ise_gp_connected_users.get(user)
+        if cache_user is None:
+            changes["added"].append(user)
+            continue
+        attributes = cache_user['customAttributes']
+        u_dict = entries[0]
+        if u_dict['Client-Hostname'] != attributes.get('PaloAlto-Client-Hostname') \
+                or u_dict['Client-OS'] != attributes.get('PaloAlto-Client-OS') \
+                or u_dict['Client-Source-IP'] != attributes.get('PaloAlto-Client-Source-IP'):
+            changes["changed"].append(user)
+    changes["removed"] = [
+        user for user in ise_gp_connected_users if user not in gp_connected_user_data]
+    return changes
+
+
+def reconcile_connected_user(user: str, u_dict: dict):
+    """
+    Sets a user the firewall reports as connected to the GP connected state on
+    ISE, unless ISE already has a connected state. Runs in the user's event chain.
+
+    Args:
+    - user (str): The (lower case) username.
+    - u_dict (dict): The user's first firewall session.
+    """
+    cache_user = cisco_ise.ise_enrich_user(
+        cisco_ise.ise_get_pan_last_known(ise_token),
+        ise_token,
+        user)
+    if cache_user is None:
+        logger.error(
+            'ISE user details not found. Please ensure ISE connectivity and check credentials')
+    elif '.' not in cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
+        custom_attributes = {
+            "PaloAlto-Client-Hostname": u_dict['Client-Hostname'],
+            "PaloAlto-Client-OS": u_dict['Client-OS'],
+            "PaloAlto-Client-Source-IP": u_dict['Client-Source-IP'],
+            "PaloAlto-GlobalProtect-Client-Version": 'X.X.X-Unknown'
+        }
+        try:
+            cisco_ise.ise_update_user(
+                cisco_ise.ise_get_pan_last_known(ise_token),
+                ise_token,
+                u_dict['Username'],
+                custom_attributes=custom_attributes)
+        except Exception:
+            logger.error(
+                f"Error updating user {u_dict['Username']} on ISE")
+            raise
+        logger.warning(
+            f"Updated user {u_dict['Username']} on ISE to GP Connected state")
+
+
+def reconcile_removed_user(user: str):
+    """
+    Sets a user without firewall sessions to the GP non-connected state on ISE,
+    unless an event cleared it meanwhile. Runs in the user's event chain.
+
+    Args:
+    - user (str): The (lower case) username.
+    """
+    cache_user = cisco_ise.all_users.get(user)
+    if cache_user is None or \
+            '.' not in cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
+        return
+    custom_attributes = {
+        "PaloAlto-Client-Hostname": '',
+        "PaloAlto-Client-OS": '',
+        "PaloAlto-Client-Source-IP": '',
+        "PaloAlto-GlobalProtect-Client-Version": 'N-A'
+    }
+    try:
+        cisco_ise.ise_update_user(
+            cisco_ise.ise_get_pan_last_known(ise_token),
+            ise_token,
+            user,
+            custom_attributes=custom_attributes
+        )
+    except Exception:
+        logger.error(f"Error updating user {user} on ISE")
+    else:
+        logger.warning(
+            f"Updated user {user} on ISE to GP Non-connected state")
+
+
+def reconcile_changed_user(user: str, u_dict: dict):
+    """
+    Updates the session details of a GP connected user on ISE from its first
+    firewall session, keeping the client version recorded on ISE. Skipped if an
+    event disconnected the user meanwhile. Runs in the user's event chain.
+
+    Args:
+    - user (str): The (lower case) username.
+    - u_dict (dict): The user's first firewall session.
+    """
+    cache_user = cisco_ise.all_users.get(user)
+    if cache_user is None or \
+            '.' not in cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
+        return
+    custom_attributes = {
+        "PaloAlto-Client-Hostname": u_dict['Client-Hostname'],
+        "PaloAlto-Client-OS": u_dict['Client-OS'],
+        "PaloAlto-Client-Source-IP": u_dict['Client-Source-IP'],
+        "PaloAlto-GlobalProtect-Client-Version": cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']
+    }
+    try:
+        cisco_ise.ise_update_user(
+            cisco_ise.ise_get_pan_last_known(ise_token),
+            ise_token,
+            u_dict['Username'],
+            custom_attributes=custom_attributes)
+    except Exception:
+        logger.error(
+            f"Error updating user {u_dict['Username']} on ISE")
+        raise
+    logger.warning(
+        f"Updated user {u_dict['Username']} on ISE to GP Connected state with existing session details.")
+
+
 def sync_gp_session_state(config: dict, initial: bool = False) -> dict:
     """
     A function to sync the GP connected state from the firewall with the ISE users.
@@ -400,94 +1048,26 @@ def sync_gp_session_state(config: dict, initial: bool = False) -> dict:
     """
     global ise_token
     global fw_api_key
-    fw_ip = pan_fw.get_active_fw(
-        config['fw_ip'], config['fw_ha_ip'], fw_api_key)
-    if fw_ip is None:
+    try:
+        gp_connected_user_data = pan_fw.fw_gp_ext_all(
+            pan_fw.get_gateways(config), fw_api_key, ignore_cache=initial)
+    except pan_fw.GatewayUnavailable:
         logger.error(
             "No active firewall found. Check firewall HA status and API key.")
-        raise Exception("No active and reachable firewall found.")
-    gp_connected_user_data = pan_fw.fw_gp_ext(
-        fw_ip, fw_api_key, ignore_cache=initial)
-    ise_gp_connected_users = []
-    for user in cisco_ise.all_users:
-        if 'customAttributes' in cisco_ise.all_users[user.lower()].keys():
-            if '.' in cisco_ise.all_users[user.lower()]['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
-                ise_gp_connected_users.append(user.lower())
-    for user in [u.lower() for u in gp_connected_user_data]:
-        u_dict = gp_connected_user_data[user.lower()][0]
-        if initial or (user.lower() not in ise_gp_connected_users):
-            cache_user = cisco_ise.ise_enrich_user(
-                cisco_ise.ise_get_pan_active(ise_token),
-                ise_token,
-                user.lower())
-            if cache_user is None:
-                logger.error(
-                    'ISE user details not found. Please ensure ISE connectivity and check credentials')
-            elif '.' not in cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']:
-                custom_attributes = {
-                    "PaloAlto-Client-Hostname": u_dict['Client-Hostname'],
-                    "PaloAlto-Client-OS": u_dict['Client-OS'],
-                    "PaloAlto-Client-Source-IP": u_dict['Client-Source-IP'],
-                    "PaloAlto-GlobalProtect-Client-Version": 'X.X.X-Unknown'
-                }
-                try:
-                    cisco_ise.ise_update_user(
-                        cisco_ise.ise_get_pan_active(ise_token),
-                        ise_token,
-                        u_dict['Username'],
-                        custom_attributes=custom_attributes)
-                except Exception:
-                    logger.error(
-                        f"Error updating user {u_dict['Username']} on ISE")
-                    raise
-                logger.warning(
-                    f"Updated user {u_dict['Username']} on ISE to GP Connected state")
-
-    for user in ise_gp_connected_users:
-        if user not in gp_connected_user_data.keys():
-            custom_attributes = {
-                "PaloAlto-Client-Hostname": '',
-                "PaloAlto-Client-OS": '',
-                "PaloAlto-Client-Source-IP": '',
-                "PaloAlto-GlobalProtect-Client-Version": 'N-A'
-            }
-            try:
-                cisco_ise.ise_update_user(
-                    cisco_ise.ise_get_pan_active(ise_token),
-                    ise_token,
-                    user,
-                    custom_attributes=custom_attributes
-                )
-            except Exception:
-                logger.error(f"Error updating user {user} on ISE")
-            else:
-                logger.warning(
-                    f"Updated user {user} on ISE to GP Non-connected state")
-        else:
-            u_dict = gp_connected_user_data[user][0]
-            cache_user = cisco_ise.all_users[user]
-            if cache_user is None:
-                logger.warning(
-                    f"User {user} not found in ISE Users. Skipping update of attributes.")
-            elif u_dict['Client-Hostname'] != cache_user['customAttributes']['PaloAlto-Client-Hostname'] \
-                    or u_dict['Client-OS'] != cache_user['customAttributes']['PaloAlto-Client-OS'] \
-                    or u_dict['Client-Source-IP'] != cache_user['customAttributes']['PaloAlto-Client-Source-IP']:
-                custom_attributes = {
-                    "PaloAlto-Client-Hostname": u_dict['Client-Hostname'],
-                    "PaloAlto-Client-OS": u_dict['Client-OS'],
-                    "PaloAlto-Client-Source-IP": u_dict['Client-Source-IP'],
-                    "PaloAlto-GlobalProtect-Client-Version": cache_user['customAttributes']['PaloAlto-GlobalProtect-Client-Version']
-                }
-                try:
-                    cisco_ise.ise_update_user(
-                        cisco_ise.ise_get_pan_active(ise_token),
-                        ise_token,
-                        u_dict['Username'],
-                        custom_attributes=custom_attributes)
-                except Exception:
-                    logger.error(
-                        f"Error updating user {u_dict['Username']} on ISE")
-                    raise
-                logger.warning(
-                    f"Updated user {u_dict['Username']} on ISE to GP Connected state with existing session details.")
+        raise
+    ise_gp_connected_users = {
+        name: u for name, u in cisco_ise.all_users.items()
+        if '.' in u.get('customAttributes', {}).get('PaloAlto-GlobalProtect-Client-Version', '')}
+    changes = session_changes(ise_gp_connected_users, gp_connected_user_data)
+    connected = list(gp_connected_user_data) if initial else changes['added']
+    # Each user's write runs in the user's event chain, ordered with its webhooks
+    work = [(reconcile_connected_user, user, gp_connected_user_data[user][0]) for user in connected] \
+        + [(reconcile_removed_user, user) for user in changes['removed']] \
+        + [(reconcile_changed_user, user, gp_connected_user_data[user][0]) for user in changes['changed']]
+    for func, user, *args in work:
+        try:
+            event_processor.run(user, func, user, *args)
+        except event_processor.Overloaded:
+            logger.warning(
+                f"Too many events in flight for user {user}, leaving it to the next sync.")
     return gp_connected_user_data
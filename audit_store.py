@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+"""
+Indexed store of duplicate login attempts (SQLite, data/audit.db).
+
+Every attempt written to the monthly logs/YYYY-MM.gp-dup-sessions.tsv files is
+also stored here, indexed by username, public IPs and time, and queried by the
+/audit/duplicates endpoint. Existing TSV files can be imported with:
+
+    python3 audit_store.py import logs/*.gp-dup-sessions.tsv
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+
+from logger import logger
+
+DB_PATH = "data/audit.db"
+TSV_TIME_FORMAT = "%Y%m%d%H%M%S"
+MAX_PAGE_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS duplicates (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    connected_hostname TEXT,
+    connected_os TEXT,
+    connected_ip TEXT,
+    connected_region TEXT,
+    denied_hostname TEXT,
+    denied_os TEXT,
+    denied_ip TEXT,
+    denied_region TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS duplicates_event
+    ON duplicates (ts, username, denied_hostname, denied_ip);
+CREATE INDEX IF NOT EXISTS duplicates_user_ts ON duplicates (username, ts);
+CREATE INDEX IF NOT EXISTS duplicates_denied_ip_ts ON duplicates (denied_ip, ts);
+CREATE INDEX IF NOT EXISTS duplicates_connected_ip_ts ON duplicates (connected_ip, ts);
+"""
+COLUMNS = ("id", "ts", "username",
+           "connected_hostname", "connected_os", "connected_ip", "connected_region",
+           "denied_hostname", "denied_os", "denied_ip", "denied_region")
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db() -> sqlite3.Connection:
+    """
+    Opens (and creates) the audit database once per process.
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+            _db = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _db.execute("PRAGMA journal_mode=WAL")
+            _db.execute("PRAGMA synchronous=NORMAL")
+            _db.executescript(SCHEMA)
+        return _db
+
+
+def record_attempt(username: str, oldsession: dict, attributes: dict, event: datetime.datetime):
+    """
+    Stores one duplicate login attempt (same fields as the TSV log).
+    """
+    insert_rows([(
+        int(event.timestamp()), username,
+        oldsession["PaloAlto-Client-Hostname"], oldsession["PaloAlto-Client-OS"],
+        oldsession["PaloAlto-Client-Source-IP"], oldsession["PaloAlto-Client-Region"],
+        attributes["PaloAlto-Client-Hostname"], attributes["PaloAlto-Client-OS"],
+        attributes["PaloAlto-Client-Source-IP"], attributes["PaloAlto-Client-Region"],
+    )])
+
+
+def insert_rows(rows: list) -> int:
+    """
+    Inserts attempts as tuples of all columns but id. Already stored attempts are skipped.
+
+    Returns:
+    - int: Number of rows inserted.
+    """
+    db = get_db()
+    with _db_lock, db:
+        before = db.total_changes
+        db.executemany(
+            f"INSERT OR IGNORE INTO duplicates ({', '.join(COLUMNS[1:])}) "
+            f"VALUES ({', '.join('?' * (len(COLUMNS) - 1))})", rows)
+        return db.total_changes - before
+
+
+def query(username: str = None, ip: str = None, since: float = None, until: float = None,
+          limit: int = 100, cursor: str = None) -> dict:
+    """
+    Returns attempts newest first, filtered by username, public IP (connected or
+    denied session) and time range.
+
+    Parameters:
+    - username (str), ip (str): Optional filters.
+    - since (float), until (float): Optional epoch time range.
+    - limit (int): Page size (at most MAX_PAGE_SIZE).
+    - cursor (str): next_cursor of the previous page.
+
+    Returns:
+    - dict: {"items": [...], "next_cursor": str or None}
+    """
+    where = []
+    params = []
+    if username:
+        where.append("username = ?")
+        params.append(username.lower())
+    if ip:
+        where.append("(denied_ip = ? OR connected_ip = ?)")
+        params += [ip, ip]
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(int(since))
+    if until is not None:
+        where.append("ts <= ?")
+        params.append(int(until))
+    if cursor:
+        # Keyset pagination: continue below the last (ts, id) returned
+        ts, row_id = (int(x) for x in cursor.split(":"))
+        where.append("(ts < ? OR (ts = ? AND id < ?))")
+        params += [ts, ts, row_id]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    sql = f"SELECT {', '.join(COLUMNS)} FROM duplicates"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+    db = get_db()
+    with _db_lock:
+        rows = db.execute(sql, params + [limit + 1]).fetchall()
+    items = [dict(zip(COLUMNS, row)) for row in rows[:limit]]
+    for item in items:
+        item["time"] = datetime.datetime.fromtimestamp(item["ts"]).isoformat()
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = f"{items[-1]['ts']}:{items[-1]['id']}"
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def import_tsv(path: str, batch_size: int = 10000) -> int:
+    """
+    Imports a monthly gp-dup-sessions TSV file (see apiserver.tsv_log).
+
+    Returns:
+    - int: Number of new rows stored.
+    """
+    inserted = 0
+    batch = []
+    with open(path) as fd:
+        next(fd, None)  # header
+        for line_no, line in enumerate(fd, start=2):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 12:
+                logger.warning(f"{path}:{line_no}: Expected 12 fields, got {len(fields)}. Skipped.")
+                continue
+            try:
+                ts = datetime.datetime.strptime(fields[0], TSV_TIME_FORMAT).timestamp()
+            except ValueError:
+                logger.warning(f"{path}:{line_no}: Invalid timestamp {fields[0]}. Skipped.")
+                continue
+            batch.append((int(ts), fields[1].lower(), *fields[4:]))
+            if len(batch) >= batch_size:
+                inserted += insert_rows(batch)
+                batch = []
+    if batch:
+        inserted += insert_rows(batch)
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("import", help="Import gp-dup-sessions TSV files")
+    p.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for path in args.files:
+            print(f"{path}: {import_tsv(path)} rows imported")
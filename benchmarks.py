@@ -0,0 +1,540 @@
+#!/usr/bin/python3
+"""
+Local micro-benchmarks for the GP session limiting middleware.
+
+Nothing here talks to a real firewall or ISE node. Benchmarks build synthetic
+data in a temporary working directory and time the middleware code against it.
+
+Usage:
+    python3 benchmarks.py startup [--users 50000] [--runs 5]
+    python3 benchmarks.py logging [--sessions 20000] [--runs 5]
+    python3 benchmarks.py json [--users 100000] [--runs 5]
+    python3 benchmarks.py prewarm [--users 5000] [--days 10]
+    python3 benchmarks.py stress [--users 20000] [--seconds 5] [--writers 4]
+    python3 benchmarks.py persist [--sessions 50000] [--polls 20] [--changed 10]
+"""
+import argparse
+import os
+import pickle
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_workdir() -> str:
+    """
+    Creates a temporary working directory with a config.yaml (from the sample) and a data folder.
+
+    Returns:
+    - str: Path of the working directory.
+    """
+    workdir = tempfile.mkdtemp(prefix="gptool-bench-")
+    shutil.copy(os.path.join(REPO_DIR, "config.yaml.sample"),
+                os.path.join(workdir, "config.yaml"))
+    os.makedirs(os.path.join(workdir, "data"))
+    return workdir
+
+
+def make_users(count: int) -> dict:
+    """
+    Builds a synthetic ISE user cache shaped like cisco_ise.all_users.
+    """
+    users = {}
+    for i in range(count):
+        name = f"user{i}"
+        users[name] = {
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "name": name,
+            "description": "",
+            "link": {"rel": "self", "href": f"https://ise/ers/config/internaluser/{i}", "type": "application/json"},
+            "customAttributes": {
+                "PaloAlto-Client-Hostname": f"HOST-{i}",
+                "PaloAlto-Client-OS": "Microsoft Windows 10 Pro , 64-bit",
+                "PaloAlto-Client-Source-IP": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+                "PaloAlto-GlobalProtect-Client-Version": "6.0.4-26" if i % 2 else "N-A",
+            },
+            "timestamp": time.time(),
+        }
+    return users
+
+
+def make_gp_current_user_xml(count: int) -> str:
+    """
+    Builds a 'show global-protect-gateway current-user' API response with count sessions.
+    """
+    entries = []
+    for i in range(count):
+        entries.append(
+            "<entry>"
+            f"<domain>corp</domain><islocal>no</islocal><username>user{i}</username>"
+            f"<primary-username>user{i}</primary-username><computer>HOST-{i}</computer>"
+            "<client>Microsoft Windows 10 Pro , 64-bit</client><vpn-type>Device Level VPN</vpn-type>"
+            f"<virtual-ip>10.100.{(i >> 8) & 255}.{i & 255}</virtual-ip><virtual-ipv6>::</virtual-ipv6>"
+            f"<public-ip>198.51.{(i >> 8) & 255}.{i & 255}</public-ip><public-ipv6>::</public-ipv6>"
+            f"<client-ip>198.51.{(i >> 8) & 255}.{i & 255}</client-ip><tunnel-type>IPSec</tunnel-type>"
+            "<source-region>IQ</source-region><app-version>6.0.4-26</app-version>"
+            "<login-time>Jan.01 08:00:00</login-time><login-time-utc>1672549200</login-time-utc>"
+            "<lifetime>2592000</lifetime></entry>")
+    return f"<response status=\"success\"><result>{''.join(entries)}</result></response>"
+
+
+class FakeResponse:
+    """
+    Minimal stand-in for requests.Response used to replay canned upstream payloads.
+    """
+
+    def __init__(self, text: str, status_code: int = 200):
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.status_code = status_code
+
+    def json(self):
+        import json
+        return json.loads(self.text)
+
+
+def timed_subprocess(code: str, cwd: str) -> float:
+    """
+    Runs a python snippet in a fresh interpreter and returns the float it prints.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def bench_startup(users: int = 50000, runs: int = 5):
+    """
+    Measures module import time and first-use cache load time in fresh processes.
+    """
+    workdir = make_workdir()
+    try:
+        with open(os.path.join(workdir, "data", "users.pickle"), "wb") as fd:
+            pickle.dump(make_users(users), fd,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        import_code = (
+            "import time; t = time.perf_counter()\n"
+            "import apiserver\n"
+            "print(time.perf_counter() - t)")
+        init_code = (
+            "import time, cisco_ise, pan_fw, config\n"
+            "t = time.perf_counter()\n"
+            "config.get_config(); cisco_ise.init_user_cache(); pan_fw.init_fw_cache()\n"
+            "print(time.perf_counter() - t)")
+        results = {
+            "import apiserver": [timed_subprocess(import_code, workdir) for _ in range(runs)],
+            f"startup cache load ({users} users)": [timed_subprocess(init_code, workdir) for _ in range(runs)],
+        }
+    finally:
+        shutil.rmtree(workdir)
+    for name, samples in results.items():
+        print(f"{name:40s} median {statistics.median(samples) * 1000:9.2f} ms"
+              f"   min {min(samples) * 1000:9.2f} ms")
+
+
+def bench_logging(sessions: int = 20000, runs: int = 5):
+    """
+    Measures a full fw_gp_ext refresh of a large current-user table at INFO and DEBUG level.
+    """
+    workdir = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import pan_fw
+        from logger import init_logging
+        response = FakeResponse(make_gp_current_user_xml(sessions))
+        devnull = open(os.devnull, "w")
+        results = {}
+        with mock.patch.object(pan_fw.requests, "request", return_value=response):
+            for level, enqueue in [("INFO", False), ("DEBUG", False), ("DEBUG", True)]:
+                init_logging(level=level, enqueue=enqueue, sink=devnull)
+                samples = []
+                for _ in range(runs):
+                    t = time.perf_counter()
+                    pan_fw.fw_gp_ext("192.0.2.1", "key", ignore_cache=True)
+                    samples.append(time.perf_counter() - t)
+                label = f"fw_gp_ext {sessions} sessions @ {level}" + \
+                    (" (enqueued)" if enqueue else "")
+                results[label] = samples
+        # Drain the enqueued sink before closing it
+        init_logging(level="WARNING", sink=devnull)
+        devnull.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    for name, samples in results.items():
+        print(f"{name:50s} median {statistics.median(samples) * 1000:9.2f} ms"
+              f"   min {min(samples) * 1000:9.2f} ms")
+
+
+def make_gp_sessions(count: int, changed_every: int = 10) -> dict:
+    """
+    Builds a synthetic merged session index shaped like pan_fw.fw_data["fw_gp_sessions"].
+    Every changed_every-th session has a different hostname than make_users() records.
+    """
+    sessions = {}
+    for i in range(count):
+        name = f"user{i}"
+        sessions[name] = [{
+            "Username": name,
+            "Client-Hostname": f"HOST-{i}" if i % changed_every else f"NEWHOST-{i}",
+            "Client-OS": "Microsoft Windows 10 Pro , 64-bit" if i % 3 else "Apple Mac OS X 13.1",
+            "Client-Source-IP": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            "Raw-Data": {"source-region": ("IQ", "AE", "SA", "US")[i % 4]},
+            "Gateway": "gw1",
+        }]
+    return sessions
+
+
+def make_ers_user_page(page: int = 1, size: int = 100, total: int = 100000) -> bytes:
+    """
+    Builds an ERS 'GET /ers/config/internaluser?size=100&page=N' response body.
+    """
+    import json
+    resources = [{
+        "id": f"00000000-0000-0000-0000-{i:012d}",
+        "name": f"user{i}",
+        "description": "",
+        "link": {"rel": "self", "href": f"https://ise:9060/ers/config/internaluser/00000000-0000-0000-0000-{i:012d}",
+                 "type": "application/json"},
+    } for i in range((page - 1) * size, page * size)]
+    return json.dumps({"SearchResult": {
+        "total": total,
+        "resources": resources,
+        "nextPage": {"rel": "next", "href": f"https://ise:9060/ers/config/internaluser?size={size}&page={page + 1}",
+                     "type": "application/json"},
+    }}).encode("utf-8")
+
+
+def bench_json(users: int = 100000, runs: int = 5):
+    """
+    Compares the stdlib json paths against the fastjson layer for ERS user list
+    pages and a full user cache dump response.
+    """
+    import json
+    import fastjson
+    from fastapi.encoders import jsonable_encoder
+    from starlette.responses import JSONResponse
+    page = make_ers_user_page()
+    cache = make_users(users)
+
+    def ers_page_stdlib():
+        # What ise_get_all_users did per page: up to three response.json() parses
+        for _ in range(3):
+            json.loads(page)["SearchResult"]
+
+    cases = {
+        "ERS page x1000, stdlib json parsed 3 times": lambda: [ers_page_stdlib() for _ in range(1000)],
+        f"ERS page x1000, fastjson ({fastjson.BACKEND}) parsed once":
+            lambda: [fastjson.loads(page)["SearchResult"] for _ in range(1000)],
+        f"{users} user dump, jsonable_encoder + JSONResponse":
+            lambda: JSONResponse(jsonable_encoder(cache)),
+        f"{users} user dump, JSONBytesResponse ({fastjson.BACKEND})":
+            lambda: fastjson.JSONBytesResponse(cache),
+    }
+    for name, func in cases.items():
+        samples = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - t)
+        print(f"{name:60s} median {statistics.median(samples) * 1000:9.2f} ms"
+              f"   min {min(samples) * 1000:9.2f} ms")
+
+
+def bench_prewarm(users: int = 5000, days: int = 10):
+    """
+    Simulates a shift start login storm and reports the ISE user record cache hit
+    rate with and without pre-warming. Users learn a login habit around 08:00
+    (+-20 min) over the given days, then all log in between 08:00 and 08:20.
+    """
+    import datetime
+    import json
+    import random
+    import types
+    workdir = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import cisco_ise
+        import prewarm
+        from config import get_config
+        from logger import init_logging
+        from striped_cache import StripedDict
+        init_logging(level="WARNING", sink=open(os.devnull, "w"))
+        rng = random.Random(1)
+        day = datetime.datetime.combine(datetime.date.today(), datetime.time(8, 0)).timestamp()
+        clock = [day]
+        fake_time = types.SimpleNamespace(time=lambda: clock[0], sleep=lambda s: None)
+        cache = make_users(users)
+
+        def fake_api_call(ise_ip, ise_auth, path, **kwargs):
+            uid = path.rsplit("/", 1)[1]
+            i = int(uid.rsplit("-", 1)[1])
+            user = dict(cache[f"user{i}"])
+            user.pop("timestamp")
+            return FakeResponse(json.dumps({"InternalUser": user}))
+
+        # Login history: one login per user per day around 08:00
+        for d in range(1, days + 1):
+            for i in range(users):
+                prewarm.record_login(f"user{i}", day - d * 86400 + rng.gauss(0, 600))
+        storm = sorted((day + rng.uniform(0, 1200), f"user{i}") for i in range(users))
+        results = {}
+        with mock.patch.object(cisco_ise, "time", fake_time), \
+                mock.patch.object(cisco_ise, "ise_api_call", fake_api_call):
+            for label, warm in (("without pre-warm", False), ("with pre-warm", True)):
+                # Records last synced yesterday
+                cisco_ise.all_users = StripedDict(
+                    {name: dict(u, timestamp=day - 86400) for name, u in cache.items()})
+                cisco_ise.all_users_loaded = True
+                prewarm.prewarmed_on.clear()
+                get_config()["prewarm_rate"] = 10 ** 9
+                before = dict(cisco_ise.metrics.counters)
+                refreshed = 0
+                if warm:
+                    # The job runs every minute from 07:30 on
+                    for minute in range(-30, 0):
+                        clock[0] = day + minute * 60
+                        refreshed += prewarm.run_once("192.0.2.20", "auth", now=clock[0])
+                for ts, name in storm:
+                    clock[0] = ts
+                    cisco_ise.ise_get_user_details("192.0.2.20", "auth", cisco_ise.all_users[name])
+                counters = cisco_ise.metrics.counters
+                hits = counters.get("ise.user_cache.hits", 0) - before.get("ise.user_cache.hits", 0)
+                misses = counters.get("ise.user_cache.misses", 0) - before.get("ise.user_cache.misses", 0)
+                results[label] = (hits / (hits + misses), refreshed)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    for label, (hit_rate, refreshed) in results.items():
+        print(f"storm of {users} logins {label:20s} hit rate {hit_rate * 100:6.2f}%"
+              f"   records pre-warmed {refreshed}")
+
+
+class UnsafeDict(dict):
+    """
+    Plain dict with the StripedDict API but no locking, the baseline of bench_stress.
+    """
+
+    def update_entry(self, key, func):
+        value = func(self.get(key))
+        self[key] = value
+        return value
+
+    def snapshot(self) -> dict:
+        return dict(self)
+
+
+def bench_stress(users: int = 20000, seconds: float = 5, writers: int = 4):
+    """
+    Runs session state reconciliation (sync_gp_session_state) in a loop while
+    writer threads update ISE user records, evict and re-add users and replace
+    per-user GP sessions. Reports failed reconciliations with plain dicts and
+    with the lock-striped caches.
+    """
+    import random
+    import threading
+    workdir = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        import apiserver
+        import cisco_ise
+        import fastjson
+        import pan_fw
+        from config import get_config
+        from logger import init_logging
+        from striped_cache import StripedDict
+        init_logging(level="WARNING", sink=open(os.devnull, "w"))
+        config = get_config()
+        cache = make_users(users)
+        sessions = make_gp_sessions(users)
+        put_response = FakeResponse('{"UpdatedFields": {"updatedField": []}}')
+
+        def fake_api_call(ise_ip, ise_auth, path, method="GET", **kwargs):
+            if method == "PUT":
+                return put_response
+            name = path.rsplit("/", 1)[1]
+            return FakeResponse(fastjson.dumps({"InternalUser": cache.get(name, cache["user0"])}))
+
+        for label, cache_class in (("plain dict", UnsafeDict), ("striped", StripedDict)):
+            cisco_ise.all_users = cache_class({name: dict(u) for name, u in cache.items()})
+            cisco_ise.all_users_loaded = True
+            pan_fw.fw_data = {
+                "fw_key": "key",
+                "gateways": {"gw": {"fw_gp_sessions": cache_class(sessions), "fw_gp_sessions_timestamp": 0}},
+                "fw_gp_sessions": cache_class(sessions),
+            }
+            pan_fw.fw_data_loaded = True
+            stop = threading.Event()
+            counts = {"reconciliations": 0, "writes": 0}
+            errors = {}
+
+            def writer(seed):
+                rng = random.Random(seed)
+                while not stop.is_set():
+                    name = f"user{rng.randrange(users)}"
+                    action = rng.random()
+                    if action < 0.4:
+                        cisco_ise.all_users.update_entry(name, lambda u: dict(u or cache[name], customAttributes={
+                            **cache[name]["customAttributes"],
+                            "PaloAlto-Client-Hostname": f"HOST-{rng.randrange(1000)}"}))
+                    elif action < 0.6:
+                        # Stale id eviction and re-add, as on a 404
+                        cisco_ise.all_users.pop(name, None)
+                        cisco_ise.all_users[name] = dict(cache[name])
+                    else:
+                        pan_fw.set_user_sessions(
+                            "gw", name, sessions.get(name, []) if rng.random() < 0.5 else [])
+                    counts["writes"] += 1
+                    # About a thousand events per second per writer
+                    time.sleep(0.001)
+
+            def reconciler():
+                while not stop.is_set():
+                    try:
+                        apiserver.sync_gp_session_state(config)
+                        cisco_ise.save_user_data()
+                    except Exception as e:
+                        errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    counts["reconciliations"] += 1
+
+            with mock.patch.object(cisco_ise, "ise_api_call", fake_api_call), \
+                    mock.patch.object(cisco_ise, "ise_get_pan_active", lambda auth: "192.0.2.20"), \
+                    mock.patch.object(cisco_ise, "save_user_data", lambda: None), \
+                    mock.patch.object(pan_fw, "fw_gp_ext_all",
+                                      lambda gateways, key, ignore_cache=False: pan_fw.merge_gateway_sessions()):
+                # Bring the user records in line with the sessions first (no writers yet)
+                apiserver.sync_gp_session_state(config)
+                threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+                threads.append(threading.Thread(target=reconciler))
+                for thread in threads:
+                    thread.start()
+                time.sleep(seconds)
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            results[label] = (counts, errors)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    for label, (counts, errors) in results.items():
+        failed = sum(errors.values())
+        print(f"{label:12s} reconciliations {counts['reconciliations']:6d}   failed {failed:6d}"
+              f"   writes {counts['writes']:9d}   errors {errors or '-'}")
+
+
+def bench_persist(sessions: int = 50000, polls: int = 20, changed: int = 10):
+    """
+    Times fw_gp_ext refreshes where only a few sessions change per poll, with a
+    full snapshot pickle per poll (previous behaviour) and with the session delta
+    log, and the cache load time afterwards.
+    """
+    import copy
+    workdir = make_workdir()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        import pan_fw
+        import session_log
+        from logger import init_logging
+        from striped_cache import StripedDict
+        init_logging(level="WARNING", sink=open(os.devnull, "w"))
+        base = make_gp_sessions(sessions)
+
+        def poll_result(i):
+            result = dict(base)
+            for j in range(changed):
+                name = f"user{(i * changed + j) % sessions}"
+                result[name] = [dict(base[name][0], **{"Client-Source-IP": f"203.0.113.{i % 250}"})]
+            return copy.copy(result)
+
+        for label, full in (("full snapshot per poll", True), ("delta log", False)):
+            for path in (pan_fw.FW_CACHE_PATH, session_log.LOG_PATH):
+                if os.path.isfile(path):
+                    os.remove(path)
+            session_log.records = 0
+            pan_fw.fw_data = {"fw_key": "key", "fw_gp_sessions": StripedDict(), "gateways": {}}
+            pan_fw.fw_data_loaded = True
+            state = {}
+            persist = pan_fw.persist_sessions
+            if full:
+                persist = lambda *args: pan_fw.save_fw_cache()
+            with mock.patch.object(pan_fw, "fw_api_call", return_value=FakeResponse("")), \
+                    mock.patch.object(pan_fw, "parse_gp_current_users", lambda text, fw_ip: state["next"]), \
+                    mock.patch.object(pan_fw, "persist_sessions", persist):
+                state["next"] = poll_result(0)
+                pan_fw.fw_gp_ext("192.0.2.1", "key", ignore_cache=True, gateway="gw1")
+                if not full:
+                    # Initial snapshot, written by the compaction task in the server
+                    pan_fw.compact_sessions()
+                samples = []
+                for i in range(1, polls + 1):
+                    state["next"] = poll_result(i)
+                    t = time.perf_counter()
+                    pan_fw.fw_gp_ext("192.0.2.1", "key", ignore_cache=True, gateway="gw1")
+                    samples.append(time.perf_counter() - t)
+            expected = pan_fw.fw_data["gateways"]["gw1"]["fw_gp_sessions"].snapshot()
+            log_size = os.path.getsize(session_log.LOG_PATH) if os.path.isfile(session_log.LOG_PATH) else 0
+            pan_fw.fw_data_loaded = False
+            t = time.perf_counter()
+            pan_fw.init_fw_cache()
+            load = time.perf_counter() - t
+            assert pan_fw.fw_data["gateways"]["gw1"]["fw_gp_sessions"].snapshot() == expected
+            results[label] = (samples, load, os.path.getsize(pan_fw.FW_CACHE_PATH), log_size)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    for label, (samples, load, snapshot_size, log_size) in results.items():
+        print(f"{label:24s} poll median {statistics.median(samples) * 1000:8.2f} ms"
+              f"   load {load * 1000:8.2f} ms   snapshot {snapshot_size / 1e6:6.2f} MB"
+              f"   log {log_size / 1e3:8.1f} kB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("startup", help="Import and cache load time")
+    p.add_argument("--users", type=int, default=50000)
+    p.add_argument("--runs", type=int, default=5)
+    p = sub.add_parser("logging", help="fw_gp_ext cost at INFO vs DEBUG")
+    p.add_argument("--sessions", type=int, default=20000)
+    p.add_argument("--runs", type=int, default=5)
+    p = sub.add_parser("json", help="stdlib json vs fastjson for ERS pages and cache dumps")
+    p.add_argument("--users", type=int, default=100000)
+    p.add_argument("--runs", type=int, default=5)
+    p = sub.add_parser("prewarm", help="Login storm cache hit rate with / without pre-warming")
+    p.add_argument("--users", type=int, default=5000)
+    p.add_argument("--days", type=int, default=10)
+    p = sub.add_parser("stress", help="Reconciliation against concurrent cache updates, plain vs striped")
+    p.add_argument("--users", type=int, default=20000)
+    p.add_argument("--seconds", type=float, default=5)
+    p.add_argument("--writers", type=int, default=4)
+    p = sub.add_parser("persist", help="fw_gp_ext with full snapshot pickle vs session delta log")
+    p.add_argument("--sessions", type=int, default=50000)
+    p.add_argument("--polls", type=int, default=20)
+    p.add_argument("--changed", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.bench == "startup":
+        bench_startup(args.users, args.runs)
+    elif args.bench == "logging":
+        bench_logging(args.sessions, args.runs)
+    elif args.bench == "json":
+        bench_json(args.users, args.runs)
+    elif args.bench == "prewarm":
+        bench_prewarm(args.users, args.days)
+    elif args.bench == "stress":
+        bench_stress(args.users, args.seconds, args.writers)
+    elif args.bench == "persist":
+        bench_persist(args.sessions, args.polls, args.changed)
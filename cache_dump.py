@@ -0,0 +1,106 @@
+"""
+Filtered, paginated and streamed dumps of the ISE user cache for the debug endpoints.
+
+Users are ordered by name, a page continues after the cursor (the last name of
+the previous page). NDJSON output is produced in chunks by a generator, so a
+dump of any size is never built in memory as a whole.
+"""
+import bisect
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+import fastjson
+
+GP_VERSION_ATTRIBUTE = 'PaloAlto-GlobalProtect-Client-Version'
+NDJSON_CHUNK_LINES = 500
+
+
+def is_gp_connected(user: dict) -> bool:
+    return '.' in user.get('customAttributes', {}).get(GP_VERSION_ATTRIBUTE, '')
+
+
+def iter_users(users: dict, prefix: str = None, connected: bool = None,
+               cursor: str = None, fields: list = None):
+    """
+    Yields (name, record) pairs from a user cache in name order.
+
+    Parameters:
+    - users (dict): The user cache (cisco_ise.all_users).
+    - prefix (str): Only names starting with this prefix.
+    - connected (bool): Only GP connected (True) or not connected (False) users.
+    - cursor (str): Start after this name.
+    - fields (list): Only include these top level keys of each record.
+    """
+    names = sorted(users)
+    start = 0
+    if prefix:
+        prefix = prefix.lower()
+        start = bisect.bisect_left(names, prefix)
+    if cursor:
+        start = max(start, bisect.bisect_right(names, cursor.lower()))
+    for name in names[start:]:
+        if prefix and not name.startswith(prefix):
+            break
+        user = users.get(name)
+        if user is None:
+            continue
+        if connected is not None and is_gp_connected(user) != connected:
+            continue
+        if fields:
+            user = {k: user[k] for k in fields if k in user}
+        yield name, user
+
+
+def ndjson_lines(records):
+    """
+    Encodes (name, record) pairs as NDJSON, in chunks of NDJSON_CHUNK_LINES lines.
+    Every line carries the name, also when fields leaves it out of the record.
+    """
+    chunk = []
+    for name, user in records:
+        if "name" not in user:
+            user = {"name": name, **user}
+        chunk.append(fastjson.dumps(user))
+        if len(chunk) >= NDJSON_CHUNK_LINES:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def dump_users(users: dict, format: str = "json", prefix: str = None, connected: bool = None,
+               cursor: str = None, limit: int = None, fields: str = None):
+    """
+    Builds the response of a user cache dump.
+
+    Without limit the whole (filtered) cache is returned, as a {name: record}
+    object for format=json (the original output) or streamed as NDJSON for
+    format=ndjson. With limit one page is returned: {"users": {...},
+    "next_cursor": name or None} for json, and for ndjson the next cursor is
+    sent in the X-Next-Cursor header.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="format must be json or ndjson")
+    if limit is not None and limit < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="limit must be positive")
+    fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    records = iter_users(users, prefix, connected, cursor, fields)
+    next_cursor = None
+    if limit is not None:
+        page = []
+        for record in records:
+            if len(page) == limit:
+                next_cursor = page[-1][0]
+                break
+            page.append(record)
+        records = page
+    if format == "ndjson":
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return StreamingResponse(ndjson_lines(records), media_type="application/x-ndjson",
+                                 headers=headers)
+    if limit is None:
+        return fastjson.JSONBytesResponse(dict(records))
+    return fastjson.JSONBytesResponse({"users": dict(records), "next_cursor": next_cursor})
@@ -1,27 +1,58 @@
 #!/usr/bin/python3
 import base64
-import json
 import requests
 import time
 import pickle
 import os
 import traceback
-from logger import init_logging, logger
+import deadline
+import ers_budget
+import fastjson
+import metrics
+import resilience
+import write_queue
+from logger import logger
 from config import get_config
-from urllib.parse import urlparse
-
-# Setup config
-config = get_config()
-init_logging()
-# Specify level = 'DEBUG' if Debug data is needed.
-# init_logging(level='DEBUG')
+from striped_cache import StripedDict
+from ttl_cache import TTLCache
+from urllib.parse import quote, urlparse
 
 requests.packages.urllib3.disable_warnings()
 
 # Globally cached lists (all_users, all_groups)
+# all_users is loaded lazily from disk by init_user_cache() on first use. It is
+# shared by all worker threads: records are replaced, never changed in place.
+all_users = StripedDict()
+all_users_loaded = False
 all_users_last_updated = 0
 ha_device_last_update = 0
-ise_active = config['ise_api_ip']
+ise_active = None
+# Usernames confirmed absent from ISE (e.g. AD / LDAP only GP users), so a miss
+# doesn't trigger a full user list walk on every webhook
+unknown_users = TTLCache(maxsize=10000, ttl=300)
+metrics.register_gauge("ise.unknown_users", unknown_users.stats)
+# Set when all_users changed since the last save. Request paths only mark the
+# cache dirty, the apiserver flushes it in the background (see flush_user_data).
+users_dirty = False
+
+
+def init_user_cache() -> dict:
+    """
+    Loads the user cache from disk once. Safe to call repeatedly, later calls are no-ops.
+
+    Returns:
+    - all_users: The (possibly empty) user cache.
+    """
+    global all_users
+    global all_users_loaded
+    if not all_users_loaded:
+        all_users = StripedDict(load_user_data())
+        all_users_loaded = True
+        logger.info(f"Loaded {len(all_users)} users from ISE data cache")
+        config = get_config()
+        unknown_users.ttl = config['ise_unknown_user_ttl']
+        unknown_users.maxsize = config['ise_unknown_user_cache_size']
+    return all_users
 
 
 def load_user_data():
@@ -40,10 +71,37 @@ def load_user_data():
 def save_user_data():
     global all_users
     try:
+        # Serialize a snapshot in memory first so concurrent updates can't change it mid-write
+        data = pickle.dumps(all_users.snapshot(), protocol=pickle.HIGHEST_PROTOCOL)
         with open('data/users.pickle', 'wb') as fd:
-            pickle.dump(all_users, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            fd.write(data)
+    except Exception:
+        raise
+
+
+def mark_users_dirty():
+    global users_dirty
+    users_dirty = True
+
+
+def flush_user_data() -> bool:
+    """
+    Saves the user cache if it changed since the last save.
+
+    Returns:
+    - bool: True if the cache was saved.
+    """
+    global users_dirty
+    if not users_dirty:
+        return False
+    # Cleared first, changes made while saving mark it dirty again
+    users_dirty = False
+    try:
+        save_user_data()
     except Exception:
+        users_dirty = True
         raise
+    return True
 
 
 def ise_auth(uname: str, pwd: str) -> str:
@@ -65,7 +123,7 @@ def ise_auth(uname: str, pwd: str) -> str:
 def ise_api_call(ise_ip: str, ise_auth: str, path: str,
                  method: str = "GET",
                  ise_port: int = 9060,
-                 payload: str = None):
+                 payload: bytes = None):
     """
     Parameters:
     - ise_ip (str): The IP address of the ISE server.
@@ -73,11 +131,28 @@ def ise_api_call(ise_ip: str, ise_auth: str, path: str,
     - path (str): The API path.
     - method (str): The HTTP method to use for the API call (defaults to "GET").
     - ise_port (int): The port of the ISE server (defaults to 9060).
-    - payload (str): The payload for the API call (defaults to None).
+    - payload (bytes): The JSON payload for the API call (defaults to None).
 
     Returns:
-    - result (requests.Request): The result of the API call.
+    - result (requests.Request): The result of the API call, None if the call failed
+      or was refused because the circuit breaker for this ISE node is open.
+
+    Raises:
+    - deadline.DeadlineExceeded: The current request deadline leaves no time for the call,
+      or no ERS budget token becomes available within it.
     """
+    breaker = resilience.get_breaker(f"ise:{ise_ip}")
+    if not breaker.allow_request():
+        # Checked first, a refused call must not use (or wait for) an ERS budget token
+        logger.warning(
+            f"Cisco ISE API: Circuit open for ISE {ise_ip}. Failing fast.")
+        return None
+    try:
+        ers_budget.spend(method)
+        timeout = deadline.cap_timeout(5)
+    except deadline.DeadlineExceeded:
+        breaker.release_probe()
+        raise
     api_headers = {
         "Authorization": ise_auth,
         "Content-Type": "application/json",
@@ -93,7 +168,7 @@ def ise_api_call(ise_ip: str, ise_auth: str, path: str,
                 headers=api_headers,
                 verify=False,
                 data=payload,
-                timeout=5
+                timeout=timeout
             )
         else:
             result = requests.request(
@@ -101,12 +176,17 @@ def ise_api_call(ise_ip: str, ise_auth: str, path: str,
                 url=api_url,
                 headers=api_headers,
                 verify=False,
-                timeout=5
+                timeout=timeout
             )
     except Exception:
+        breaker.record_failure()
         logger.error(f"Error occurred while trying API call for ISE {ise_ip}")
         return None
     else:
+        if result.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         return result
 
 
@@ -127,19 +207,21 @@ def ise_get_node_details(node_name: str, ise_ip: str, ise_auth: str) -> dict:
     except Exception as e:
         logger.error(f"Error occurred while trying API call for ISE {ise_ip}")
         raise
-    return response.json()
+    return fastjson.loads(response.content)
 
 
 def ise_get_pan_active(ise_auth: str) -> str:
     """
     Get the primary / active PAN status.
     """
-    global config
     global ha_device_last_update
     global ise_active
+    config = get_config()
     ise_ip = config['ise_api_ip']
     ise_ha_ip = config['ise_api_ha_ip']
     api_path = "/ers/config/node"
+    if ise_active is None:
+        ise_active = ise_ip
 
     # Check if we have the active PAN IP cached
     freshness = time.time() - ha_device_last_update
@@ -152,13 +234,13 @@ def ise_get_pan_active(ise_auth: str) -> str:
             f'ISE API: Active Node refreshing because freshness is {freshness:.2f}s')
         try:
             response = ise_api_call(ise_ip, ise_auth, api_path)
-            nodes = response.json()['SearchResult']['resources']
+            nodes = fastjson.loads(response.content)['SearchResult']['resources']
         except Exception as e:
             logger.error(
                 f"ISE API: Connection Failure, ISE Unreachable on {ise_ip}. Error {e}. Trying other node")
             try:
                 response = ise_api_call(ise_ha_ip, ise_auth, api_path)
-                nodes = response.json()['SearchResult']['resources']
+                nodes = fastjson.loads(response.content)['SearchResult']['resources']
             except Exception as e:
                 logger.error(
                     f"ISE API: Connection Failure, ISE Unreachable on both {ise_ip} and {ise_ha_ip}. Error {e}")
@@ -185,6 +267,22 @@ def ise_get_pan_active(ise_auth: str) -> str:
         return ise_active
 
 
+def ise_get_pan_last_known(ise_auth: str) -> str:
+    """
+    Like ise_get_pan_active, but returns the last known active PAN IP (or ise_api_ip)
+    instead of raising when no ISE node is reachable, so that updates reach
+    ise_update_user and are queued for replay.
+    """
+    try:
+        return ise_get_pan_active(ise_auth)
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        fallback = ise_active or get_config()['ise_api_ip']
+        logger.warning(f"ISE API: Active PAN lookup failed, using last known {fallback}. Error {e}")
+        return fallback
+
+
 def ise_get_all_users(ise_ip: str, ise_auth: str) -> dict:
     """
     Retrieves all users (InternalUsers) on ISE.
@@ -198,48 +296,51 @@ def ise_get_all_users(ise_ip: str, ise_auth: str) -> dict:
     """
     global all_users
     global all_users_last_updated
+    init_user_cache()
     api_path = f"/ers/config/internaluser?size=100&page=1"
-    if all_users_last_updated > time.time() - config['ise_all_user_refresh_ttl']:
+    if all_users_last_updated > time.time() - get_config()['ise_all_user_refresh_ttl']:
         logger.warning(
             f"Cisco ISE API: Userlist already fresh. Not requesting from ISE {ise_ip}")
         return all_users
     continue_flag = True
     logger.info(f"Cisco ISE API: Request All ISE Users, ISE {ise_ip}")
     while continue_flag:
-        for _ in range(3):
-            try:
-                response = ise_api_call(ise_ip, ise_auth, api_path)
-            except Exception as e:
-                logger.error(
-                    f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred")
-                logger.debug(traceback.format_exc())
-                time.sleep(1)
-            else:
-                if response.status_code == 401:
-                    logger.error(
-                        "Cisco ISE API: Authentication Failure. Please check credentials")
-                    logger.error(
-                        f"Response: {response.text}, Status Code: {response.status_code}")
-                    return {}
-                elif response.status_code == 201:
-                    logger.info(
-                        f"Cisco ISE API: Connection Succeeded, ISE {ise_ip} Users Retrieved")
-                users_ext = response.json()["SearchResult"]["resources"]
-                logger.debug(f"Users Retrieved on page: {len(users_ext)}")
-                for _ in users_ext:
-                    if _['name'].lower() in all_users:
-                        for k in _:
-                            all_users[_['name'].lower()][k] = _[k]
-                    else:
-                        all_users[_['name'].lower()] = _
-                if 'nextPage' in response.json()["SearchResult"]:
-                    next_url = response.json(
-                    )["SearchResult"]['nextPage']['href']
-                    p = urlparse(next_url)
-                    api_path = f"{p.path}?{p.query}"
-                else:
-                    logger.debug(f"All Users Count: {len(all_users.keys())}")
-                    continue_flag = False
+        try:
+            response = resilience.retry_call(
+                ise_api_call, ise_ip, ise_auth, api_path,
+                retry_if=lambda r: r is None or r.status_code >= 500,
+                breaker=resilience.get_breaker(f"ise:{ise_ip}"))
+        except resilience.CircuitOpenError:
+            logger.error(
+                f"Cisco ISE API: Circuit open for ISE {ise_ip}. Returning cached users.")
+            return all_users
+        if response is None or response.status_code >= 500:
+            logger.error(
+                f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred")
+            return all_users
+        if response.status_code == 401:
+            logger.error(
+                "Cisco ISE API: Authentication Failure. Please check credentials")
+            logger.error(
+                f"Response: {response.text}, Status Code: {response.status_code}")
+            return {}
+        elif response.status_code == 201:
+            logger.info(
+                f"Cisco ISE API: Connection Succeeded, ISE {ise_ip} Users Retrieved")
+        page = fastjson.loads(response.content)["SearchResult"]
+        users_ext = page["resources"]
+        logger.debug(f"Users Retrieved on page: {len(users_ext)}")
+        for _ in users_ext:
+            unknown_users.pop(_['name'].lower())
+            all_users.update_entry(
+                _['name'].lower(), lambda cached, new=_: {**cached, **new} if cached else new)
+        if 'nextPage' in page:
+            next_url = page['nextPage']['href']
+            p = urlparse(next_url)
+            api_path = f"{p.path}?{p.query}"
+        else:
+            logger.debug(f"All Users Count: {len(all_users.keys())}")
+            continue_flag = False
     all_users_last_updated = time.time()
     return all_users
 
@@ -260,24 +361,35 @@ def ise_get_user_details(ise_ip: str, ise_auth: str, user: dict):
     try:
         api_path = f"/ers/config/internaluser/{user['id']}"
     except Exception:
-        logger.debug(
-            f"User Details: {json.dumps(user, indent=2, sort_keys=True)}")
+        logger.opt(lazy=True).debug(
+            "User Details: {}", lambda: fastjson.dumps_pretty(user))
         raise
     if user['name'].lower() in all_users:
         username = user['name'].lower()
         data = all_users[username]
-        # If cache is fresh, return cached data
-        if 'customAttributes' in data and 'timestamp' in data and data['timestamp'] > time.time() - config['ise_cache_ttl']:
+        # If cache is fresh, return cached data. Pre-warmed records (see prewarm)
+        # stay fresh for prewarm_ttl until their first use.
+        config = get_config()
+        age = time.time() - data.get('timestamp', 0)
+        if 'customAttributes' in data and 'timestamp' in data and (
+                age < config['ise_cache_ttl']
+                or (data.get('prewarmed') and age < config['prewarm_ttl'])):
             logger.info(
-                f"Cisco ISE Data Cache Hit for user {user['name'].lower()} with data freshness {(time.time() - data['timestamp']):.2f}s")
-            data = all_users[username]
+                f"Cisco ISE Data Cache Hit for user {user['name'].lower()} with data freshness {age:.2f}s")
+            metrics.incr("ise.user_cache.hits")
+            if data.get('prewarmed'):
+                data = {k: v for k, v in data.items() if k != 'prewarmed'}
+                all_users[username] = data
+                if age >= config['ise_cache_ttl']:
+                    metrics.incr("prewarm.hits")
         else:
+            metrics.incr("ise.user_cache.misses")
             # If cache is stale or user details are not known, retrieve from ISE
             logger.warning(
                 f"Cisco ISE Data Cache Miss for user {username}")
             if username in all_users:
-                logger.debug(
-                    f"User Details: {json.dumps(all_users[username], indent=2, sort_keys=True)}")
+                logger.opt(lazy=True).debug(
+                    "User Details: {}", lambda: fastjson.dumps_pretty(all_users[username]))
             else:
                 logger.debug(
                     f"User Details for {username} not found in cache.")
@@ -285,6 +397,8 @@ def ise_get_user_details(ise_ip: str, ise_auth: str, user: dict):
                 logger.debug(
                     f"Cisco ISE API: Request ISE User {username} Details, ISE {ise_ip}")
                 response = ise_api_call(ise_ip, ise_auth, api_path)
+            except deadline.DeadlineExceeded:
+                raise
             except Exception:
                 logger.error(
                     f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred.")
@@ -293,34 +407,111 @@ def ise_get_user_details(ise_ip: str, ise_auth: str, user: dict):
             else:
                 logger.info(
                     f"Cisco ISE API: User {username} Details Retrieved, ISE {ise_ip}")
-            data = response.json()['InternalUser']
+            data = fastjson.loads(response.content)['InternalUser']
             data['name'] = data['name'].lower()
             data['timestamp'] = time.time()
     return data
 
 
+def ise_get_user_by_name(ise_ip: str, ise_auth: str, username: str) -> dict:
+    """
+    Retrieves a single user by name (one round trip instead of a full list walk)
+    and merges it into the user cache.
+
+    Parameters:
+    - ise_ip (str): The IP address of the ISE server.
+    - ise_auth (str): The ISE API authorization token.
+    - username (str): The name of the user.
+
+    Returns:
+    - dict: The cached user, None if ISE has no such user or is unreachable.
+    """
+    username = username.lower()
+    api_path = f"/ers/config/internaluser/name/{quote(username, safe='')}"
+    logger.debug(
+        f"Cisco ISE API: Request ISE User {username} by name, ISE {ise_ip}")
+    try:
+        response = resilience.retry_call(
+            ise_api_call, ise_ip, ise_auth, api_path,
+            retry_if=lambda r: r is None or r.status_code >= 500,
+            breaker=resilience.get_breaker(f"ise:{ise_ip}"))
+    except resilience.CircuitOpenError:
+        response = None
+    if response is None or response.status_code >= 500:
+        logger.error(
+            f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred")
+        return None
+    if response.status_code == 404:
+        logger.warning(f"Cisco ISE API: User {username} not found on ISE {ise_ip}")
+        unknown_users.set(username, True)
+        return None
+    if response.status_code != 200:
+        logger.error(
+            f"Response: {response.text}, Status Code: {response.status_code}")
+        return None
+    data = fastjson.loads(response.content)['InternalUser']
+    data['name'] = data['name'].lower()
+    data['timestamp'] = time.time()
+    all_users[username] = data
+    unknown_users.pop(username)
+    return data
+
+
+def ise_prewarm_user(ise_ip: str, ise_auth: str, username: str) -> bool:
+    """
+    Refreshes a user's cached record ahead of an expected login (see prewarm).
+
+    Returns:
+    - bool: True if the record was refreshed.
+    """
+    init_user_cache()
+    username = username.lower()
+    user = all_users.get(username)
+    if user is None or 'id' not in user:
+        user = ise_get_user_by_name(ise_ip, ise_auth, username)
+        if user is None:
+            return False
+    else:
+        response = ise_api_call(
+            ise_ip, ise_auth, f"/ers/config/internaluser/{user['id']}")
+        if response is None or response.status_code != 200:
+            return False
+        user = fastjson.loads(response.content)['InternalUser']
+        user['name'] = user['name'].lower()
+        user['timestamp'] = time.time()
+    all_users[username] = {**user, 'prewarmed': True}
+    return True
+
+
 def ise_enrich_user(ise_ip: str, ise_auth: str, username: str) -> dict:
     global all_users
+    init_user_cache()
     username = username.lower()
     try:
         if username in all_users:
             logger.debug(f"User {username} found in cache.")
+        elif unknown_users.get(username):
+            logger.debug(f"User {username} recently confirmed absent on ISE.")
+            return None
         else:
             logger.warning(
-                f"User {username} not found in cache. Fetching full list of users from ISE.")
-            all_users = ise_get_all_users(ise_ip, ise_auth)
+                f"User {username} not found in cache. Looking up user by name on ISE.")
+            if ise_get_user_by_name(ise_ip, ise_auth, username) is None:
+                return None
         all_users[username] = ise_get_user_details(
             ise_ip, ise_auth, all_users[username])
-        # Save user data to cache
-        save_user_data()
+        mark_users_dirty()
         user = all_users[username]
     except KeyError:
         logger.error(
             f"Cisco ISE API: User {username} not found on ISE {ise_ip}")
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
+        # No blocking retry here, the circuit breaker in ise_api_call decides
+        # when the next attempt goes out to ISE
         logger.error(
             f"Cisco ISE API: ISE {ise_ip} Unreachable or error occurred")
-        time.sleep(1)
     else:
         logger.debug(
             f"User details for {username} synced with ISE Data Cache.")
@@ -328,57 +519,110 @@ def ise_enrich_user(ise_ip: str, ise_auth: str, username: str) -> dict:
     return None
 
 
+def ise_put_user(ise_ip: str, ise_auth: str, user: dict, custom_attributes: dict):
+    """
+    Sends the InternalUser PUT for a user record (only its id and name are used).
+
+    Returns:
+    - The response of the API call, None if ISE is unreachable or the breaker is open.
+    """
+    api_path = f"/ers/config/internaluser/{user['id']}"
+    api_payload_dict = {
+        "InternalUser": {
+            "name": user['name'],
+            "id": user["id"],
+        }}
+    if len(custom_attributes.keys()):
+        api_payload_dict['InternalUser']['customAttributes'] = custom_attributes
+    api_payload = fastjson.dumpb(api_payload_dict)
+    logger.opt(lazy=True).debug(
+        "API Payload: {}", lambda: fastjson.dumps_pretty(api_payload_dict))
+    try:
+        return resilience.retry_call(
+            ise_api_call, ise_ip, ise_auth, api_path,
+            method="PUT", payload=api_payload,
+            retry_if=lambda r: r is None or r.status_code >= 500,
+            breaker=resilience.get_breaker(f"ise:{ise_ip}"))
+    except resilience.CircuitOpenError:
+        return None
+
+
 def ise_update_user(ise_ip: str,
                     ise_auth: str,
                     username: str,
-                    custom_attributes: dict = {}):
+                    custom_attributes: dict = {},
+                    queue_on_failure: bool = True):
     """
     Updates a user on the ISE server and adds custom attributes.
 
+    The PUT is sent directly with the cached user id (no read before write). Only
+    if the user is not cached, or ISE answers 404 because the cached id is stale,
+    the record is fetched from ISE and the PUT retried once. The written
+    attributes are stored in the cache. If ISE is unreachable the update is
+    queued for replay (see write_queue).
+
     Parameters:
     - ise_ip (str): The IP address of the ISE server.
     - ise_auth (str): The ISE API authorization token.
     - username (str): The name of the user to update.
     - custom_attributes (dict): A dictionary of custom attributes to add to the user (defaults to an empty dictionary).
+    - queue_on_failure (bool): Queue the update if ISE is unreachable (the replay worker passes False).
 
     Returns:
-    - res: The result of the API call.
+    - res: The result of the API call, None if ISE is unreachable, False if the user doesn't exist.
     """
-    # Enrich user details (if not already done) and get user
+    init_user_cache()
     username = username.lower()
-    u = ise_enrich_user(ise_ip, ise_auth, username)
-    if u is None:
-        logger.error(
-            f"User {username} does not seem to exist. Aborting update")
-        return False
-
-    api_path = f"/ers/config/internaluser/{u['id']}"
-    api_payload_dict = {
-        "InternalUser": {
-            "name": u['name'],
-            "id": u["id"],
-        }}
-    if len(custom_attributes.keys()):
-        api_payload_dict['InternalUser']['customAttributes'] = custom_attributes
-    api_payload = json.dumps(api_payload_dict)
-    for _ in range(3):
-        try:
-            logger.debug(
-                f"API Payload: {json.dumps(json.loads(api_payload), indent=2)}")
-            res = ise_api_call(ise_ip, ise_auth, api_path,
-                               method="PUT", payload=api_payload)
-        except Exception:
+    u = all_users.get(username)
+    if u is None or 'id' not in u:
+        # Not cached yet, fetch it once
+        u = ise_enrich_user(ise_ip, ise_auth, username)
+        if u is None and unknown_users.get(username) is None:
+            # Lookup failed without a 404, ISE is unreachable
             logger.error(
                 f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred.")
-            logger.debug(traceback.format_exc())
-        else:
-            all_users[u['name'].lower()]['customAttributes'] = custom_attributes
-            save_user_data()
-            logger.debug(
-                f"Status Code: {res.status_code}, Response Body: {json.dumps(res.json(), indent=2)}")
-            logger.info(
-                f"User {u['name']} updated.")
-            return res
+            if queue_on_failure:
+                write_queue.enqueue(username, custom_attributes)
+            return None
+        if u is None:
+            logger.error(
+                f"User {username} does not seem to exist. Aborting update")
+            return False
+    res = ise_put_user(ise_ip, ise_auth, u, custom_attributes)
+    if res is not None and res.status_code == 404:
+        logger.warning(
+            f"Cisco ISE API: Cached id {u['id']} of user {username} is stale. Refreshing user record.")
+        # The user was cached, so only a 404 of this lookup marks it unknown
+        unknown_users.pop(username)
+        fresh = ise_get_user_by_name(ise_ip, ise_auth, username)
+        if fresh is None and unknown_users.get(username):
+            logger.error(
+                f"User {username} does not seem to exist. Aborting update")
+            all_users.pop(username, None)
+            return False
+        # Lookup failed without a 404: keep the cached record and queue the update below
+        res = None if fresh is None else ise_put_user(ise_ip, ise_auth, fresh, custom_attributes)
+        u = fresh or u
+    if res is None:
+        logger.error(
+            f"Cisco ISE API: Connection Failure, ISE {ise_ip} Unreachable or error occurred.")
+        if queue_on_failure:
+            write_queue.enqueue(username, custom_attributes)
+        return None
+    if res.status_code < 300:
+        # Write-through, the cached record now matches ISE
+        all_users.update_entry(u['name'].lower(), lambda cached: {
+            **(cached or u), 'customAttributes': custom_attributes, 'timestamp': time.time()})
+        mark_users_dirty()
+        if queue_on_failure:
+            # Newer than any queued update
+            write_queue.discard(username)
+    logger.opt(lazy=True).debug(
+        "Status Code: {}, Response Body: {}",
+        lambda: res.status_code, lambda: fastjson.dumps_pretty(fastjson.loads(res.content)))
+    logger.info(
+        f"User {u['name']} updated.")
+    return res
 
 
 def ise_get_all_devices(ise_ip: str, ise_auth: str) -> list:
@@ -417,7 +661,7 @@ def ise_get_all_devices(ise_ip: str, ise_auth: str) -> list:
                 continue_flag = False
                 break
         continue_flag = False
-    return response.json()['SearchResult']['resources']
+    return fastjson.loads(response.content)['SearchResult']['resources']
 
 
 def ise_get_device_details(ise_ip: str, ise_auth: str, device: dict) -> dict:
@@ -434,7 +678,7 @@ def ise_get_device_details(ise_ip: str, ise_auth: str, device: dict) -> dict:
     """
 
     api_path = f"/ers/config/networkdevice/{device['id']}"
-    data = ise_api_call(ise_ip, ise_auth, api_path).json()['NetworkDevice']
+    data = fastjson.loads(ise_api_call(ise_ip, ise_auth, api_path).content)['NetworkDevice']
     return data
 
 
@@ -443,8 +687,5 @@ def ise_set_device_details(ise_ip: str, ise_auth: str, devicedata: dict) -> dict
     api_path = f"/ers/config/networkdevice/{devicedata['id']}"
     api_payload_dict = {"NetworkDevice": devicedata}
     res = ise_api_call(ise_ip, ise_auth, api_path, method="PUT",
-                       payload=json.dumps(api_payload_dict))
+                       payload=fastjson.dumpb(api_payload_dict))
     return res
-
-
-all_users = load_user_data()
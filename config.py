@@ -10,7 +10,74 @@ import xmltodict
 from logger import init_logging, logger
 
 requests.packages.urllib3.disable_warnings()
-init_logging(level="WARNING")
+
+# Parsed config cache (per config file), shared by all modules
+_config_cache = {}
+
+# Defaults of the optional settings (see config.yaml.sample), filled in by
+# get_config() for keys missing from the config file. Modules read them with
+# get_config()[key]. Dict values are merged with the configured dict.
+DEFAULTS = {
+    # GP session cache and gateways (pan_fw)
+    "fw_gateway_timeout": 10,
+    "fw_poll_workers": 16,
+    "fw_ha_state_ttl": 30,
+    "fw_session_log_max_records": 1000,
+    "fw_session_log_max_ratio": 0.5,
+    "fw_session_log_compact_interval": 30,
+    # GP log events (gp_events)
+    "gp_syslog_host": "0.0.0.0",
+    "gp_syslog_protocol": "udp",
+    "gp_events_stale_after": 300,
+    "fw_gp_consistency_ttl": 600,
+    # ISE user cache (cisco_ise)
+    "ise_unknown_user_ttl": 300,
+    "ise_unknown_user_cache_size": 10000,
+    "ise_user_cache_flush_interval": 10,
+    # Pre-warming (prewarm)
+    "prewarm_interval": 60,
+    "prewarm_lead": 600,
+    "prewarm_rate": 5,
+    "prewarm_min_logins": 3,
+    "prewarm_max_per_run": 1000,
+    "prewarm_ttl": 2700,
+    # Upstream retries and circuit breakers (resilience)
+    "retry_attempts": 3,
+    "retry_base_delay": 0.5,
+    "retry_max_delay": 5,
+    "breaker_failure_threshold": 5,
+    "breaker_reset_timeout": 30,
+    # /syncuser latency budget
+    "syncuser_deadline": 4,
+    "syncuser_fallback": "allow",
+    # Webhook handling (webhook_dedup, /events/batch)
+    "webhook_dedup_ttl": 30,
+    "webhook_dedup_size": 10000,
+    "batch_concurrency": 8,
+    "event_user_queue": 100,
+    # Admission control (admission)
+    "admission_max_concurrent": 32,
+    "admission_route_limits": {"syncuser": 32, "webhook": 16, "events": 4,
+                               "sync": 1, "debug": 1, "audit": 2},
+    "admission_shed_queue_depth": 8,
+    "admission_background_queue": 1,
+    # ISE ERS call budget (ers_budget)
+    "ers_read_rate": 20,
+    "ers_read_burst": 40,
+    "ers_write_rate": 10,
+    "ers_write_burst": 20,
+    "ers_reserve": 0.25,
+    # ISE write queue (write_queue)
+    "write_queue_interval": 5,
+    "write_queue_concurrency": 4,
+    "write_queue_batch": 200,
+    "write_queue_max_attempts": 10,
+    # Statistics and duplicate alert mails (session_stats, mailsender)
+    "stats_history_minutes": 60,
+    "mail_suppress_window": 900,
+    "mail_digest_interval": 3600,
+    "mail_max_per_interval": 20,
+}
 
 
 def fw_key(fw_ip, uname, pwd):
@@ -21,7 +88,9 @@ def fw_key(fw_ip, uname, pwd):
         "password": {pwd}
     }
 
-    for _ in range(3):
+    # Plain retries: config.py is imported by every module (incl. resilience),
+    # so the config tool can't use the shared retry layer without an import cycle
+    for attempt in range(3):
         try:
             logger.info(f"PAN-OS API: Connection Requested, Firewall {fw_ip}")
             response = requests.request(
@@ -29,7 +98,8 @@ def fw_key(fw_ip, uname, pwd):
         except Exception:
             logger.error(
                 f"PAN-OS API: Connection Failure, Firewall {fw_ip} Unreachable")
-            time.sleep(2)
+            if attempt < 2:
+                time.sleep(2)
         else:
             logger.info(
                 f"PAN-OS API: Connection Succeeded, Firewall {fw_ip} Key Retrieved")
@@ -60,7 +130,37 @@ def ise_auth(uname: str, pwd: str) -> str:
     return f"Basic {token}"
 
 
-def get_config(config_file: str = "config.yaml") -> dict:
+def get_config(config_file: str = "config.yaml", reload: bool = False) -> dict:
+    """
+    Returns the parsed config, reading and parsing the YAML file only once per process.
+    DEFAULTS are filled in for missing optional settings (the file is not changed).
+
+    Parameters:
+    - config_file (str): Path of the config file (defaults to "config.yaml").
+    - reload (bool): Force re-reading the config file from disk (defaults to False).
+
+    Returns:
+    - dict: The config dictionary (shared between all callers).
+    """
+    if not reload and config_file in _config_cache:
+        return _config_cache[config_file]
+    # Defaults go into a copy, read_config's dict is what gets saved back to disk
+    config = apply_defaults(dict(read_config(config_file)))
+    _config_cache[config_file] = config
+    return config
+
+
+def read_config(config_file: str = "config.yaml") -> dict:
+    """
+    Reads the config file and applies the environment variable overrides
+    (saving them to the file), without DEFAULTS.
+
+    Parameters:
+    - config_file (str): Path of the config file (defaults to "config.yaml").
+
+    Returns:
+    - dict: The config as stored in the file.
+    """
     with open(config_file, "r") as yamlfile:
         orig_config = yaml.load(yamlfile, Loader=yaml.FullLoader)
         logger.info(f"Read config successfully from {config_file}")
@@ -83,6 +183,18 @@ def get_config(config_file: str = "config.yaml") -> dict:
     return config
 
 
+def apply_defaults(config: dict) -> dict:
+    """
+    Fills in DEFAULTS for the optional settings missing from (or empty in) a config.
+    """
+    for key, value in DEFAULTS.items():
+        if isinstance(value, dict):
+            config[key] = {**value, **(config.get(key) or {})}
+        elif config.get(key) is None:
+            config[key] = value
+    return config
+
+
 def save_config_yaml(config_dict: dict, config_file: str = "config.yaml"):
     try:
         with open(config_file, 'w') as yamlfile:
@@ -97,13 +209,13 @@ def save_config_yaml(config_dict: dict, config_file: str = "config.yaml"):
 
 def initialize_credentials(config_file: str = "config.yaml"):
     import getpass
-    config = get_config(config_file)
+    # Without DEFAULTS, only the operator's settings are saved back
+    config = read_config(config_file)
     print("--- GP Session Limiting Middleware Config Tool ---\n")
     print(f"Config File:\t{config_file}")
     print(f"Firewall IP:\t{config['fw_ip']}")
     print(f"ISE IP:\t\t{config['ise_api_ip']}")
     print(f"SMTP Server:\t{config['smtp_server']}\n")
-    config = get_config()
     modified = False
 
     # Set API Username and Password
@@ -219,6 +331,7 @@ def initialize_credentials(config_file: str = "config.yaml"):
 
 
 if __name__ == '__main__':
+    init_logging(level="WARNING")
     try:
         initialize_credentials()
     except KeyboardInterrupt:
@@ -0,0 +1,79 @@
+"""
+Per-request deadlines carried to every upstream call.
+
+A deadline is set for the current request (context) with deadline_scope().
+Upstream calls cap their timeouts with cap_timeout(), which raises
+DeadlineExceeded when too little of the budget is left to make the call.
+Outside of a deadline scope all helpers are no-ops.
+
+>>> with deadline_scope(3):
+>>>     requests.get(url, timeout=cap_timeout(10))   # timeout <= 3s
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Absolute (time.monotonic) deadline of the current request, None if unbounded
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+# Calls are not started with less than this much time left (s)
+MIN_TIMEOUT = 0.1
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the request's deadline has passed or is about to.
+    """
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """
+    Runs the enclosed block with a deadline seconds from now. Nested scopes can
+    only shorten the deadline, never extend it.
+    """
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < new_deadline:
+        new_deadline = current
+    token = _deadline.set(new_deadline)
+    try:
+        yield new_deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Returns the seconds left until the current deadline, or None without a deadline.
+    """
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def check():
+    """
+    Raises DeadlineExceeded if the current deadline has (nearly) passed.
+    """
+    left = remaining()
+    if left is not None and left < MIN_TIMEOUT:
+        metrics.incr("deadline.calls_refused")
+        raise DeadlineExceeded(f"Deadline exceeded ({left:.3f}s left)")
+
+
+def cap_timeout(timeout: float) -> float:
+    """
+    Caps an upstream call timeout by the remaining budget of the current deadline.
+
+    Raises:
+    - DeadlineExceeded: Less than MIN_TIMEOUT seconds of the budget are left.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    check()
+    return min(timeout, left)
@@ -0,0 +1,143 @@
+"""
+ISE ERS API call budget: token bucket rate limiting with priorities and per-caller accounting.
+
+Every ERS call takes a token from the read (GET) or the write (PUT / POST /
+DELETE) bucket before it is sent. A share of each bucket (ers_reserve) is kept
+for authorization path calls: high priority callers may drain the bucket,
+normal priority callers leave half of the reserve, low priority callers (e.g.
+reconciliation, pre-warming) the whole reserve.
+
+The caller is set for the current context with caller_scope() and inherited by
+worker threads started with asyncio.to_thread. Calls and time spent waiting for
+tokens are counted per caller in metrics (ers.calls.<caller>.<read|write>,
+ers.wait.<caller>).
+
+>>> with caller_scope("reconcile", LOW):
+>>>     await asyncio.to_thread(sync_gp_session_state, config)
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import deadline
+import metrics
+from config import get_config
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+_caller = contextvars.ContextVar("ers_caller", default=("other", NORMAL))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with priority dependent floors.
+
+    Parameters:
+    - name (str): Bucket name (read / write).
+    - rate (float): Tokens added per second.
+    - burst (float): Bucket capacity.
+    - reserve (float): Share of the burst kept for high priority callers.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, reserve: float = 0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _floor(self, priority: int) -> float:
+        reserve = self.burst * self.reserve
+        return {HIGH: 0, NORMAL: reserve / 2}.get(priority, reserve)
+
+    def try_acquire(self, priority: int = NORMAL) -> float:
+        """
+        Takes a token if one is available above the priority's floor.
+
+        Returns:
+        - float: 0 if a token was taken, else the seconds until one will be available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            needed = self._floor(priority) + 1
+            if self.tokens >= needed:
+                self.tokens -= 1
+                return 0
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, priority: int = NORMAL) -> float:
+        """
+        Blocks until a token is taken. Returns the seconds waited.
+
+        Raises:
+        - deadline.DeadlineExceeded: The wait would run past the current deadline.
+        """
+        waited = 0
+        while True:
+            wait = self.try_acquire(priority)
+            if not wait:
+                return waited
+            left = deadline.remaining()
+            if left is not None and wait >= left - deadline.MIN_TIMEOUT:
+                metrics.incr(f"ers.budget_exhausted.{self.name}")
+                raise deadline.DeadlineExceeded(
+                    f"ERS {self.name} budget exhausted ({wait:.2f}s until next token)")
+            time.sleep(wait)
+            waited += wait
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return {"tokens": round(tokens, 2), "rate": self.rate, "burst": self.burst}
+
+
+# Read and write buckets, created on first use
+buckets = {}
+_buckets_lock = threading.Lock()
+metrics.register_gauge("ers.budget", lambda: {k: b.snapshot() for k, b in list(buckets.items())})
+
+
+def get_bucket(kind: str) -> TokenBucket:
+    """
+    Returns the read or write bucket, created from the ers_<kind>_rate / ers_<kind>_burst settings.
+    """
+    with _buckets_lock:
+        if kind not in buckets:
+            config = get_config()
+            buckets[kind] = TokenBucket(
+                kind, config[f"ers_{kind}_rate"], config[f"ers_{kind}_burst"], config["ers_reserve"])
+        return buckets[kind]
+
+
+@contextmanager
+def caller_scope(name: str, priority: int = NORMAL):
+    """
+    Attributes the ERS calls of the enclosed block to caller name with the given priority.
+    """
+    token = _caller.set((name, priority))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def spend(method: str):
+    """
+    Takes a token for one ERS call of the current caller, waiting if needed.
+
+    Raises:
+    - deadline.DeadlineExceeded: No token is available within the current deadline.
+    """
+    kind = "read" if method == "GET" else "write"
+    name, priority = _caller.get()
+    waited = get_bucket(kind).acquire(priority)
+    metrics.incr(f"ers.calls.{name}.{kind}")
+    if waited:
+        metrics.observe(f"ers.wait.{name}", waited)
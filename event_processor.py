@@ -0,0 +1,199 @@
+"""
+Per-user ordered processing of GP events (webhooks, /syncuser, write queue
+replays and the per-user writes of the session state sync).
+
+Work items of one user are chained: an item runs in a worker thread once the
+previous item of the same user has finished, so a /connected and a
+/disconnected of a user can't interleave their cache updates and ISE PUTs.
+Items of different users don't wait for each other at all. A user's chain
+only exists while the user has items in flight, and holds at most
+event_user_queue items: further items of a hot or stuck user are rejected
+with Overloaded (the API answers 429 with Retry-After) instead of piling up.
+
+Fleet-wide work (sync_gp_session_state) must not run as one item, it would
+hold up the user it was submitted for. It runs its per-user writes through
+run() instead.
+
+Lag is exported as the events.users gauge (users with items in flight, queued
+items, age of the oldest queued item, and depth and oldest age of the
+REPORTED_USERS most lagging users) and the events.queue_wait timing.
+"""
+import asyncio
+import contextvars
+import itertools
+import math
+import time
+
+import deadline
+import metrics
+from config import get_config
+
+# Users listed with their depth and lag in the events.users gauge
+REPORTED_USERS = 20
+
+
+class Overloaded(Exception):
+    def __init__(self, key: str, retry_after: int):
+        super().__init__(f"Too many events in flight for {key}")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Chain:
+    """
+    The items in flight of one key.
+    """
+
+    def __init__(self):
+        # Future of the last item, done when that item and all earlier items have finished
+        self.tail = None
+        # Items submitted and not finished (waiting or running)
+        self.depth = 0
+        # Enqueue time of every waiting item, by item number
+        self.waiting = {}
+
+    def lag(self, now: float) -> float:
+        return round(now - min(self.waiting.values()), 3) if self.waiting else 0
+
+
+class UserSerializer:
+    """
+    Runs work items ordered per key (username) and concurrently across keys.
+    submit() must only be used from the event loop thread, run() only from
+    other threads.
+    """
+
+    def __init__(self):
+        self._chains = {}
+        self._seq = itertools.count()
+        self._loop = None
+
+    def start(self):
+        """
+        Binds the serializer to the running event loop (needed by run()).
+        """
+        self._loop = asyncio.get_running_loop()
+
+    async def submit(self, key: str, func, *args):
+        """
+        Runs func(*args) in a worker thread after all earlier items of key. Returns its result.
+
+        Raises:
+        - Overloaded: key already has event_user_queue items in flight.
+        - deadline.DeadlineExceeded: The current deadline runs out while the item
+          waits for earlier items of key (the item is then skipped).
+        """
+        key = key.lower()
+        loop = asyncio.get_running_loop()
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._chains[key] = Chain()
+        elif chain.depth >= get_config()["event_user_queue"]:
+            metrics.incr("events.rejected")
+            raise Overloaded(key, min(60, max(1, math.ceil(chain.lag(time.monotonic())))))
+        previous = chain.tail
+        done = loop.create_future()
+        chain.tail = done
+        chain.depth += 1
+
+        def finish(future=None):
+            if future is not None and not future.cancelled():
+                # Retrieved here if the submitter was cancelled meanwhile
+                future.exception()
+            if not done.done():
+                done.set_result(None)
+            chain.depth -= 1
+            if chain.tail is done and self._chains.get(key) is chain:
+                del self._chains[key]
+
+        def after(future):
+            # Later items of key must also wait for future (previous item or own work)
+            if future.done():
+                finish()
+            else:
+                future.add_done_callback(finish)
+
+        if previous is not None and not previous.done():
+            number = next(self._seq)
+            chain.waiting[number] = time.monotonic()
+            try:
+                left = deadline.remaining()
+                if left is None:
+                    await asyncio.shield(previous)
+                else:
+                    await asyncio.wait_for(asyncio.shield(previous), max(left, 0))
+            except asyncio.TimeoutError:
+                after(previous)
+                raise deadline.DeadlineExceeded(
+                    f"Deadline exceeded while waiting for earlier events of {key}")
+            except BaseException:
+                after(previous)
+                raise
+            finally:
+                metrics.observe("events.queue_wait", time.monotonic() - chain.waiting.pop(number))
+        # Run in the submitter's context (deadline, ERS budget caller)
+        ctx = contextvars.copy_context()
+        work = asyncio.ensure_future(asyncio.to_thread(ctx.run, func, *args))
+        try:
+            # A cancelled request doesn't stop the thread, the next item waits for it
+            return await asyncio.shield(work)
+        finally:
+            after(work)
+
+    def run(self, key: str, func, *args):
+        """
+        Runs func(*args) in the chain of key from a worker thread and waits for its
+        result. Called before start() (initial sync) or from the event loop thread,
+        func runs directly as no events can be in flight.
+
+        Raises:
+        - Overloaded: key already has event_user_queue items in flight.
+        """
+        if self._loop is None or not self._loop.is_running():
+            return func(*args)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            return func(*args)
+        # The item runs in this thread's context (ERS budget caller)
+        ctx = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(
+            self.submit(key, ctx.run, func, *args), self._loop).result()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        chains = list(self._chains.items())
+        lagging = sorted(((chain.lag(now), key, chain) for key, chain in chains if chain.waiting),
+                         reverse=True)[:REPORTED_USERS]
+        return {"active_users": len(chains),
+                "queued": sum(len(chain.waiting) for _, chain in chains),
+                "max_lag": lagging[0][0] if lagging else 0,
+                "users": {key: {"depth": chain.depth, "lag": lag} for lag, key, chain in lagging}}
+
+
+processor = UserSerializer()
+metrics.register_gauge("events.users", processor.snapshot)
+
+
+def start():
+    """
+    Binds the event processor to the running event loop, see UserSerializer.start.
+    """
+    processor.start()
+
+
+async def submit(username: str, func, *args):
+    """
+    Runs func(*args) in order with the other events of username (see UserSerializer.submit).
+    """
+    return await processor.submit(username, func, *args)
+
+
+def run(username: str, func, *args):
+    """
+    Runs func(*args) in order with the other events of username from a worker thread
+    (see UserSerializer.run).
+    """
+    return processor.run(username, func, *args)
@@ -0,0 +1,77 @@
+"""
+JSON codec used for ISE payloads and API responses.
+
+Uses orjson when it is installed and falls back to the standard library json
+module otherwise (or when JSON_BACKEND=stdlib is set in the environment).
+"""
+import json
+import os
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.environ.get('JSON_BACKEND', '').lower() == 'stdlib':
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "stdlib"
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data):
+        """
+        Parses JSON from str or bytes.
+        """
+        return orjson.loads(data)
+
+    def dumpb(obj) -> bytes:
+        """
+        Serializes obj to UTF-8 JSON bytes.
+        """
+        return orjson.dumps(obj, default=str, option=_OPTIONS)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=str, option=_OPTIONS).decode("utf-8")
+
+    def dumps_pretty(obj) -> str:
+        """
+        Indented, key sorted JSON for logging.
+        """
+        return orjson.dumps(
+            obj, default=str, option=_OPTIONS | orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode("utf-8")
+else:
+    def loads(data):
+        """
+        Parses JSON from str or bytes.
+        """
+        return json.loads(data)
+
+    def dumpb(obj) -> bytes:
+        """
+        Serializes obj to UTF-8 JSON bytes.
+        """
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def dumps_pretty(obj) -> str:
+        """
+        Indented, key sorted JSON for logging.
+        """
+        return json.dumps(obj, indent=2, sort_keys=True, default=str)
+
+
+class JSONBytesResponse(JSONResponse):
+    """
+    JSON response rendered straight to bytes with the fast codec. Returned
+    directly from an endpoint it also skips FastAPI's jsonable_encoder pass.
+    """
+
+    def render(self, content) -> bytes:
+        return dumpb(content)
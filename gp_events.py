@@ -0,0 +1,325 @@
+"""
+Event driven GP session tracking from PAN-OS GlobalProtect logs.
+
+PAN-OS forwards GlobalProtect logs either to an HTTP server profile (ingested by
+the /events/panos endpoint) or to a syslog server profile (received by the
+listener started from the API server when gp_syslog_port is set).
+
+Both forwarders should use a custom log format with these fields, as JSON for
+HTTP and as key=value pairs for syslog:
+
+    eventid=$eventid user=$srcuser machine=$machinename os=$os public_ip=$public_ip
+    private_ip=$private_ip region=$srcregion client_ver=$client_ver status=$status
+    time=$time_generated serial=$serial device_name=$device_name
+
+Login (gateway-connected) and logout (gateway-logout) events update the session
+index in pan_fw incrementally. The periodic current-user poll is then only a
+low frequency consistency check (see pan_fw.sessions_ttl).
+
+Applying an event takes pan_fw.fw_data_lock and writes the session log, so it
+never runs on the event loop: HTTP records are applied in a worker thread and
+syslog messages are queued to a single consumer thread, which keeps their order.
+"""
+import asyncio
+import queue
+import re
+import threading
+import time
+
+import fastjson
+import metrics
+import pan_fw
+from config import get_config
+from logger import logger
+
+CONNECT_EVENTS = ("gateway-connected",)
+DISCONNECT_EVENTS = ("gateway-logout",)
+
+# Accepted spellings of each normalized field
+FIELD_ALIASES = {
+    "eventid": ("eventid", "event_id", "event-id"),
+    "user": ("user", "srcuser", "src_user", "username"),
+    "machine": ("machine", "machinename", "machine_name", "computer"),
+    "os": ("os", "client_os"),
+    "public_ip": ("public_ip", "publicip", "public-ip", "client_ip"),
+    "private_ip": ("private_ip", "privateip", "private-ip", "virtual_ip"),
+    "region": ("region", "srcregion", "source_region"),
+    "client_ver": ("client_ver", "clientver", "client_version", "app_version"),
+    "status": ("status",),
+    "time": ("time", "time_generated", "receive_time"),
+    "serial": ("serial",),
+    "device_name": ("device_name", "devicename", "host"),
+    "gateway": ("gateway",),
+}
+
+SYSLOG_KV = re.compile(r'([\w-]+)=("[^"]*"|\S*)')
+
+# Received syslog messages (line, source IP) waiting for the consumer thread
+SYSLOG_QUEUE_SIZE = 10000
+# Largest accepted octet counted TCP syslog frame (bytes)
+SYSLOG_MAX_FRAME = 65536
+syslog_queue = queue.Queue(maxsize=SYSLOG_QUEUE_SIZE)
+_syslog_consumer = None
+
+
+def parse_gp_event(record: dict) -> dict:
+    """
+    Normalizes a forwarded GlobalProtect log record (HTTP JSON or parsed syslog).
+
+    Returns:
+    - dict: The event with the FIELD_ALIASES keys, None if it is not a GP login / logout.
+    """
+    lowered = {str(k).lower(): v for k, v in record.items()}
+    event = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if lowered.get(alias) not in (None, ""):
+                event[field] = str(lowered[alias]).strip()
+                break
+    if event.get("eventid") not in CONNECT_EVENTS + DISCONNECT_EVENTS or not event.get("user"):
+        return None
+    # Strip the domain as GP reports usernames without it (DOMAIN\\user or user@domain)
+    event["user"] = event["user"].split("\\")[-1].split("@")[0].lower()
+    return event
+
+
+def parse_syslog_message(message: str) -> dict:
+    """
+    Parses a syslog line carrying a GP log in key=value (or JSON) custom format.
+
+    Returns:
+    - dict: The normalized event, None if the line is not a GP login / logout.
+    """
+    brace = message.find("{")
+    if brace >= 0:
+        try:
+            return parse_gp_event(fastjson.loads(message[brace:]))
+        except ValueError:
+            pass
+    record = {k: v.strip('"') for k, v in SYSLOG_KV.findall(message)}
+    if not record:
+        return None
+    return parse_gp_event(record)
+
+
+def resolve_gateway(event: dict, source_ip: str = None) -> str:
+    """
+    Maps an event to a configured gateway name, by explicit gateway field, by the
+    sending firewall's IP, or else the first configured gateway.
+    """
+    gateways = pan_fw.get_gateways(get_config())
+    names = [gw['name'] for gw in gateways]
+    if event.get("gateway") in names:
+        return event["gateway"]
+    for gw in gateways:
+        if source_ip and source_ip in (gw['fw_ip'], gw.get('fw_ha_ip')):
+            return gw['name']
+        if event.get("device_name") and event["device_name"] in (gw.get('device_name'), gw['name']):
+            return gw['name']
+    return names[0]
+
+
+def event_session(event: dict, gateway: str) -> dict:
+    """
+    Builds a session dict shaped like pan_fw.parse_gp_current_users() entries.
+    """
+    raw = {
+        "username": event["user"],
+        "computer": event.get("machine", ""),
+        "client": event.get("os", ""),
+        "client-ip": event.get("public_ip", ""),
+        "public-ip": event.get("public_ip", ""),
+        "virtual-ip": event.get("private_ip"),
+        "source-region": event.get("region", ""),
+        "app-version": event.get("client_ver", ""),
+        "login-time-utc": str(int(time.time())),
+        "source": "event",
+    }
+    return {
+        "Username": event["user"],
+        "Client-Hostname": raw["computer"],
+        "Client-OS": raw["client"],
+        "Client-Source-IP": raw["client-ip"],
+        "Raw-Data": raw,
+        "Gateway": gateway,
+    }
+
+
+def apply_gp_event(event: dict, source_ip: str = None) -> str:
+    """
+    Applies one normalized GP event to the session index.
+
+    Returns:
+    - str: "connected", "disconnected" or "ignored".
+    """
+    pan_fw.init_fw_cache()
+    gateway = resolve_gateway(event, source_ip)
+    username = event["user"]
+    with pan_fw.fw_data_lock:
+        current = pan_fw.fw_data.get("gateways", {}).get(
+            gateway, {}).get("fw_gp_sessions", {}).get(username, [])
+        if event["eventid"] in CONNECT_EVENTS:
+            if event.get("status", "success").lower() != "success":
+                metrics.incr("gp_events.ignored")
+                return "ignored"
+            session = event_session(event, gateway)
+            sessions = [s for s in current
+                        if s["Client-Hostname"].lower() != session["Client-Hostname"].lower()
+                        or s["Client-Source-IP"] != session["Client-Source-IP"]]
+            sessions.append(session)
+            result = "connected"
+        else:
+            machine = event.get("machine", "").lower()
+            public_ip = event.get("public_ip")
+            if machine or public_ip:
+                sessions = [s for s in current
+                            if not ((not machine or s["Client-Hostname"].lower() == machine)
+                                    and (not public_ip or s["Client-Source-IP"] == public_ip))]
+            else:
+                sessions = []
+            result = "disconnected"
+        pan_fw.set_user_sessions(gateway, username, sessions)
+        pan_fw.events_last_applied = time.time()
+    metrics.incr(f"gp_events.{result}")
+    logger.debug("GP event: User {} {} on gateway {}", username, result, gateway)
+    return result
+
+
+def ingest_records(records: list, source_ip: str = None) -> dict:
+    """
+    Parses and applies a list of forwarded records (HTTP ingest).
+
+    Returns:
+    - dict: Counts of connected / disconnected / ignored records.
+    """
+    counts = {"connected": 0, "disconnected": 0, "ignored": 0}
+    for record in records:
+        event = parse_gp_event(record) if isinstance(record, dict) else None
+        if event is None:
+            counts["ignored"] += 1
+            continue
+        counts[apply_gp_event(event, source_ip)] += 1
+    return counts
+
+
+def handle_syslog_line(line: str, source_ip: str = None):
+    """
+    Parses and applies one syslog message. Runs in the syslog consumer thread.
+    """
+    event = parse_syslog_message(line)
+    if event is None:
+        metrics.incr("gp_events.ignored")
+        return
+    try:
+        apply_gp_event(event, source_ip)
+    except Exception as e:
+        logger.error(f"GP event: Failed to apply syslog event from {source_ip}. Error {e}")
+
+
+def consume_syslog():
+    """
+    Syslog consumer thread, applies the queued messages in order of arrival.
+    """
+    while True:
+        line, source_ip = syslog_queue.get()
+        try:
+            handle_syslog_line(line, source_ip)
+        except Exception as e:
+            logger.error(f"GP event: Failed to handle syslog message from {source_ip}. Error {e}")
+
+
+def queue_syslog_line(line: str, source_ip: str = None):
+    """
+    Hands a received syslog message to the consumer thread (called on the event loop).
+    """
+    try:
+        syslog_queue.put_nowait((line, source_ip))
+    except queue.Full:
+        metrics.incr("gp_events.dropped")
+        logger.error(f"GP event: Syslog queue full, dropping message from {source_ip}")
+
+
+def start_syslog_consumer():
+    global _syslog_consumer
+    if _syslog_consumer is None:
+        _syslog_consumer = threading.Thread(target=consume_syslog, name="gp-syslog", daemon=True)
+        _syslog_consumer.start()
+
+
+metrics.register_gauge("gp_events.syslog_queue", syslog_queue.qsize)
+
+
+class SyslogUDPProtocol(asyncio.DatagramProtocol):
+    """
+    UDP syslog receiver, one message per datagram.
+    """
+
+    def datagram_received(self, data, addr):
+        queue_syslog_line(data.decode("utf-8", errors="replace"), addr[0])
+
+
+async def read_syslog_frame(reader: asyncio.StreamReader) -> bytes:
+    """
+    Reads one TCP syslog frame (RFC 6587). A frame starting with a digit is octet
+    counted ("<length> <message>"), any other frame is newline terminated.
+
+    Returns:
+    - bytes: The message, b"" at the end of the stream.
+
+    Raises:
+    - ValueError: Malformed or oversized octet count (the stream can't be resynchronized).
+    """
+    first = await reader.read(1)
+    if not first:
+        return b""
+    if not first.isdigit():
+        return first + await reader.readline()
+    count = first + await reader.readuntil(b" ")
+    length = int(count[:-1])
+    if length > SYSLOG_MAX_FRAME:
+        raise ValueError(f"Octet count {length} exceeds {SYSLOG_MAX_FRAME}")
+    return await reader.readexactly(length)
+
+
+async def handle_syslog_tcp(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    TCP syslog receiver, octet counted or newline framed messages (see read_syslog_frame).
+    """
+    source_ip = writer.get_extra_info("peername")[0]
+    try:
+        while True:
+            try:
+                frame = await read_syslog_frame(reader)
+            except asyncio.IncompleteReadError:
+                # Connection closed within a frame
+                break
+            except (ValueError, asyncio.LimitOverrunError) as e:
+                metrics.incr("gp_events.bad_frames")
+                logger.error(f"GP event: Bad syslog frame from {source_ip}, closing connection. Error {e}")
+                break
+            if not frame:
+                break
+            line = frame.decode("utf-8", errors="replace")
+            if line.strip():
+                queue_syslog_line(line, source_ip)
+    finally:
+        writer.close()
+
+
+async def start_syslog_listener(host: str, port: int, protocol: str = "udp"):
+    """
+    Starts the syslog listener on the running event loop.
+
+    Returns:
+    - The asyncio transport (UDP) or server (TCP), to be closed on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    start_syslog_consumer()
+    if protocol == "tcp":
+        server = await asyncio.start_server(handle_syslog_tcp, host, port)
+        logger.info(f"GP event syslog listener on tcp/{host}:{port}")
+        return server
+    transport, _ = await loop.create_datagram_endpoint(
+        SyslogUDPProtocol, local_addr=(host, port))
+    logger.info(f"GP event syslog listener on udp/{host}:{port}")
+    return transport
@@ -15,6 +15,12 @@ if DEBUG and (DEBUG.lower() != "false" and DEBUG.lower() != "0"):
 else:
     LOG_LEVEL = "INFO"
 
+# Hand log records to a background thread instead of writing them on the caller's thread
+LOG_ENQUEUE = os.environ.get('LOG_ENQUEUE', 'false').lower() not in ("false", "0", "")
+
+# Settings the loguru handlers are currently configured with (None until first init)
+_configured = None
+
 
 class InterceptHandler(logging.Handler):
     """
@@ -65,7 +71,7 @@ def format_record(record: dict) -> str:
     return format_string
 
 
-def init_logging(level: str = LOG_LEVEL):
+def init_logging(level: str = LOG_LEVEL, enqueue: bool = LOG_ENQUEUE, sink=sys.stdout):
     """
     Replaces logging handlers with a handler for using the custom handler.
 
@@ -81,7 +87,20 @@ def init_logging(level: str = LOG_LEVEL):
     INFO:     Waiting for application startup.
     2020-07-25 02:19:21.357 | INFO     | uvicorn.lifespan.on:startup:34 - Application startup complete.
 
+    Repeated calls with already configured settings are no-ops, so modules can
+    call this freely without re-creating the handlers.
+
+    With enqueue=True (or LOG_ENQUEUE=true in the environment) records are put on
+    a queue and written by a background thread, so slow stdout / log collectors
+    never block request handling.
+
+    Payload heavy debug statements should be lazy so they cost nothing when the
+    level is disabled:
+    >>> logger.opt(lazy=True).debug("Data: {}", lambda: json.dumps(data, indent=2))
     """
+    global _configured
+    if _configured == (level, enqueue, sink):
+        return
 
     # disable handlers for specific uvicorn loggers
     # to redirect their output to the default uvicorn logger
@@ -107,8 +126,10 @@ def init_logging(level: str = LOG_LEVEL):
         log_level = logging.WARNING
 
     logger.configure(
-        handlers=[{"sink": sys.stdout,
+        handlers=[{"sink": sink,
                    "level": log_level,
-                   "format": format_record}
+                   "format": format_record,
+                   "enqueue": enqueue}
                   ]
     )
+    _configured = (level, enqueue, sink)
@@ -1,11 +1,60 @@
 import smtplib
 import base64
+import html
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from logger import init_logging, logger
+import metrics
+from logger import logger
 
-init_logging()
+MAIL_STYLE = """    <style>
+      body {
+        font-family: 'Trebuchet MS', 'Open Sans', Tahoma, sans-serif;
+        background-color: #F8F0E3;
+      }
+
+      h1 {
+        text-align: center;
+        font-size: 18px;
+      }
+
+      .notification {
+        background-color: #f5f5f5;
+        border-radius: 10px;
+        padding: 20px;
+        text-align: center;
+        margin: 20px;
+        font-size: 13px;
+        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+      }
+
+      table {
+        border-collapse: separate;
+        border: solid black 1px;
+        border-radius: 6px;
+        margin: 0 auto;
+      }
+      th {
+        border: none;
+        padding-left: 10px;
+        padding-right: 10px;
+      }
+      td {
+        padding-left: 10px;
+        padding-right: 10px;
+        border-top:  solid black 1px;
+      }
+    </style>
+"""
+
+# Attempts waiting for the next digest, by username
+pending_alerts = {}
+# Time of the last immediate alert mail, by username
+last_alerted = {}
+alerts_sent_in_interval = 0
+_alerts_lock = threading.Lock()
 
 
 def send_mail(mail_srv_add,
@@ -87,45 +136,7 @@ def mail_html_body(data):
 <html>
   <head>
     <meta charset="UTF-8">
-    <style>
-      body {{
-        font-family: 'Trebuchet MS', 'Open Sans', Tahoma, sans-serif;
-        background-color: #F8F0E3;
-      }}
-
-      h1 {{
-        text-align: center;
-        font-size: 18px;
-      }}
-
-      .notification {{
-        background-color: #f5f5f5;
-        border-radius: 10px;
-        padding: 20px;
-        text-align: center;
-        margin: 20px;
-        font-size: 13px;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-      }}
-
-      table {{
-        border-collapse: separate;
-        border: solid black 1px;
-        border-radius: 6px;
-        margin: 0 auto;
-      }}
-      th {{
-        border: none;
-        padding-left: 10px;
-        padding-right: 10px;
-      }}
-      td {{
-        padding-left: 10px;
-        padding-right: 10px;
-        border-top:  solid black 1px;
-      }}
-    </style>
-  </head>
+{MAIL_STYLE}  </head>
 
   <body>
     <h1>GP Duplicate session login attempt detected</h1>
@@ -175,3 +186,121 @@ def mail_html_body(data):
   </body>
 </html>"""
     return body
+
+
+def mail_digest_html_body(alerts: dict, interval_start: float, interval_end: float) -> str:
+    """
+    Builds the digest mail body summarizing suppressed duplicate attempts per user.
+    """
+    rows = "".join(f"""
+        <tr>
+          <td>{html.escape(username)}</td>
+          <td>{alert['count']}</td>
+          <td>{time.strftime('%b.%d.%Y %H:%M:%S', time.localtime(alert['first']))}</td>
+          <td>{time.strftime('%b.%d.%Y %H:%M:%S', time.localtime(alert['last']))}</td>
+          <td>{html.escape(', '.join(sorted(alert['hostnames'])))}</td>
+          <td>{html.escape(', '.join(sorted(alert['ips'])))}</td>
+        </tr>""" for username, alert in sorted(alerts.items()))
+    body = f"""
+<html>
+  <head>
+    <meta charset="UTF-8">
+{MAIL_STYLE}  </head>
+
+  <body>
+    <h1>GP Duplicate session login attempts digest</h1>
+    <div class="notification">
+      <p>
+      {sum(a['count'] for a in alerts.values())} further duplicate login attempts by {len(alerts)} users between
+      {time.strftime('%b.%d.%Y %H:%M:%S', time.localtime(interval_start))} and {time.strftime('%b.%d.%Y %H:%M:%S', time.localtime(interval_end))}
+      </p>
+      <table>
+        <thead>
+          <tr>
+            <th>Username</th>
+            <th>Attempts</th>
+            <th>First Attempt</th>
+            <th>Last Attempt</th>
+            <th>Denied Client Hostnames</th>
+            <th>Denied Client IPs</th>
+          </tr>
+        </thead>{rows}
+      </table>
+    </div>
+  </body>
+</html>"""
+    return body
+
+
+def send_config_mail(config: dict, subject: str, body: str) -> bool:
+    return send_mail(
+        config['smtp_server'],
+        config['mail_user'],
+        config['mail_from'],
+        config['mail_to'],
+        config['mail_password'],
+        config['smtp_port'],
+        subject,
+        body,
+        mail_srv_typ=config['smtp_type'])
+
+
+def notify_duplicate(config: dict, data: dict) -> bool:
+    """
+    Sends the alert mail for a duplicate login attempt (see mail_html_body for data),
+    unless the user was alerted within mail_suppress_window seconds or the
+    mail_max_per_interval cap is reached. Suppressed attempts go to the next digest.
+
+    Returns:
+    - bool: True if an alert mail was sent.
+    """
+    global alerts_sent_in_interval
+    username = data['username']
+    now = time.time()
+    with _alerts_lock:
+        suppressed = now - last_alerted.get(username, 0) < config['mail_suppress_window'] \
+            or alerts_sent_in_interval >= config['mail_max_per_interval']
+        if suppressed:
+            alert = pending_alerts.setdefault(username, {
+                'count': 0, 'first': now, 'last': now, 'hostnames': set(), 'ips': set()})
+            alert['count'] += 1
+            alert['last'] = now
+            alert['hostnames'].add(data['newsession']['PaloAlto-Client-Hostname'])
+            alert['ips'].add(data['newsession']['PaloAlto-Client-Source-IP'])
+        else:
+            last_alerted[username] = now
+            alerts_sent_in_interval += 1
+    if suppressed:
+        metrics.incr("mail.alerts_suppressed")
+        logger.info(f"Email: Duplicate alert for {username} added to digest")
+        return False
+    metrics.incr("mail.alerts_sent")
+    return send_config_mail(
+        config, f"GP Duplicate Loging Attempt - User: {username}", mail_html_body(data))
+
+
+def flush_digest(config: dict, interval_start: float) -> bool:
+    """
+    Sends one digest mail for all suppressed attempts and starts a new interval
+    (resetting the mail cap and forgetting expired suppression windows).
+
+    Returns:
+    - bool: True if a digest mail was sent.
+    """
+    global pending_alerts
+    global alerts_sent_in_interval
+    now = time.time()
+    with _alerts_lock:
+        alerts = pending_alerts
+        pending_alerts = {}
+        alerts_sent_in_interval = 0
+        for username in [u for u, t in last_alerted.items()
+                         if now - t >= config['mail_suppress_window']]:
+            del last_alerted[username]
+    if not alerts:
+        return False
+    metrics.incr("mail.digests_sent")
+    return send_config_mail(
+        config,
+        f"GP Duplicate Login Attempts Digest - {len(alerts)} Users",
+        mail_digest_html_body(alerts, interval_start, now))
@@ -0,0 +1,59 @@
+"""
+In-process counters and timing summaries, exposed by the /metrics endpoint.
+"""
+import threading
+
+counters = {}
+timings = {}
+# Gauges are evaluated when a snapshot is taken: {name: callable}
+gauges = {}
+_lock = threading.Lock()
+
+
+def incr(name: str, value: int = 1):
+    """
+    Increments the counter name by value.
+    """
+    with _lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float):
+    """
+    Records a duration (in seconds) in the timing summary name.
+    """
+    with _lock:
+        t = timings.get(name)
+        if t is None:
+            timings[name] = {"count": 1, "total": seconds, "max": seconds}
+        else:
+            t["count"] += 1
+            t["total"] += seconds
+            if seconds > t["max"]:
+                t["max"] = seconds
+
+
+def register_gauge(name: str, func):
+    """
+    Registers a callable whose return value is reported as gauge name.
+    """
+    gauges[name] = func
+
+
+def snapshot() -> dict:
+    """
+    Returns a copy of all counters, gauges and timing summaries (avg / max in ms).
+    """
+    gauge_values = {name: func() for name, func in list(gauges.items())}
+    with _lock:
+        return {
+            "gauges": gauge_values,
+            "counters": dict(counters),
+            "timings": {
+                name: {
+                    "count": t["count"],
+                    "avg_ms": round(t["total"] / t["count"] * 1000, 3),
+                    "max_ms": round(t["max"] * 1000, 3),
+                } for name, t in timings.items()
+            },
+        }
@@ -1,39 +1,99 @@
 #!/usr/bin/python3
+import concurrent.futures
+import contextvars
+import threading
 import time
-import json
+import fastjson
 import os
 import pickle
 import requests
 import xmltodict
-from logger import init_logging, logger
+from xml.sax.saxutils import escape as xml_escape
+import deadline
+import metrics
+import prewarm
+import resilience
+import session_log
+import session_stats
+from logger import logger
 from config import get_config
+from striped_cache import StripedDict
 
-# Setup config
-config = get_config()
-
-# Setup logging
-init_logging()
-logger.debug("Debug Logging Enabled")
 requests.packages.urllib3.disable_warnings()
 
+# FW data cache, loaded lazily from disk by init_fw_cache() on first use. Persisted
+# as a snapshot plus a delta log of session changes (see session_log).
+FW_CACHE_PATH = "data/fw_data.pickle"
+fw_data = {}
+fw_data_loaded = False
+# Guards fw_data updates / saves from the concurrent gateway pollers
+fw_data_lock = threading.RLock()
 
-def get_active_fw(fw_ip: str, fw_ip2: str, api_key: str) -> str:
+# Active firewall per gateway: {gateway name: (fw_ip, timestamp)}
+active_fw_cache = {}
+# Last poll result per gateway, for status reporting
+gateway_status = {}
+# Thread pool for concurrent gateway polling (created on first use)
+_poll_executor = None
+# Time the last GP login / logout event was applied (see gp_events)
+events_last_applied = 0
+
+
+class GatewayUnavailable(Exception):
     """
-    Determine the HA State and return the Active Firewall IP
+    Raised when no configured gateway has a reachable active firewall.
     """
+
+
+def fw_api_call(fw_ip: str, api_prm: dict, timeout: float = 10):
+    """
+    Performs a PAN-OS XML API GET request, guarded by the firewall's circuit breaker.
+
+    Parameters:
+    - fw_ip (str): The IP address of the firewall.
+    - api_prm (dict): The API query parameters (key, type, cmd, ...).
+    - timeout (float): Request timeout in seconds (defaults to 10).
+
+    Returns:
+    - response (requests.Response): The API response.
+
+    Raises:
+    - resilience.CircuitOpenError: The breaker for this firewall is open.
+    - deadline.DeadlineExceeded: The current request deadline leaves no time for the call.
+    - Any requests exception raised by the call.
+    """
+    timeout = deadline.cap_timeout(timeout)
+    breaker = resilience.get_breaker(f"panos:{fw_ip}")
+    if not breaker.allow_request():
+        raise resilience.CircuitOpenError(breaker.name)
     try:
-        api_url = f"https://{fw_ip}/api"
-        api_prm = {
-            "key": api_key,
-            "type": "op",
-            "cmd": "<show><high-availability><state/></high-availability></show>",
-        }
         response = requests.request(
             "GET",
-            url=api_url,
+            url=f"https://{fw_ip}/api",
             params=api_prm,
             verify=False,
-            timeout=10)
+            timeout=timeout)
+    except Exception:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def get_active_fw(fw_ip: str, fw_ip2: str, api_key: str) -> str:
+    """
+    Determine the HA State and return the Active Firewall IP
+    """
+    api_prm = {
+        "key": api_key,
+        "type": "op",
+        "cmd": "<show><high-availability><state/></high-availability></show>",
+    }
+    try:
+        response = fw_api_call(fw_ip, api_prm, timeout=10)
         fw1_result = xmltodict.parse(response.text)["response"]["result"]
         if fw1_result['enabled'] == 'yes':
             if fw1_result['group']['local-info']['state'] == 'active':
@@ -46,22 +106,13 @@ def get_active_fw(fw_ip: str, fw_ip2: str, api_key: str) -> str:
         elif fw1_result['enabled'] == 'no':
             logger.debug(f"HA Disabled on FW1: {fw_ip}")
             active_fw = fw_ip
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error for FW1: {e}")
         fw1_result = 'error'
-        api_url = f"https://{fw_ip2}/api"
-        api_prm = {
-            "key": api_key,
-            "type": "op",
-            "cmd": "<show><high-availability><state/></high-availability></show>",
-        }
         try:
-            response = requests.request(
-                "GET",
-                url=api_url,
-                params=api_prm,
-                verify=False,
-                timeout=10)
+            response = fw_api_call(fw_ip2, api_prm, timeout=10)
             fw2_result = xmltodict.parse(response.text)["response"]["result"]
             if fw2_result['enabled'] == 'yes':
                 if fw2_result['group']['local-info']['state'] == 'active':
@@ -73,6 +124,8 @@ def get_active_fw(fw_ip: str, fw_ip2: str, api_key: str) -> str:
                     logger.error("HA State Unknown based on FW2")
             elif fw2_result['enabled'] == 'no':
                 active_fw = fw_ip2
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:
             print(f"Error for FW2: {e}")
             active_fw = None
@@ -80,73 +133,406 @@ def get_active_fw(fw_ip: str, fw_ip2: str, api_key: str) -> str:
     return active_fw
 
 
-def fw_gp_ext(fw_ip, fw_key, ignore_cache: bool = False):
+def parse_gp_current_users(response_text: str, fw_ip: str) -> dict:
+    """
+    Parses a 'show global-protect-gateway current-user' API response.
+
+    Returns:
+    - dict: Sessions keyed by lower case username, each a list of session dicts.
+    """
+    gp_connected_user_data = dict()
+    result = xmltodict.parse(response_text)["response"]["result"]
+    gp_users = []
+    if result:
+        logger.debug(
+            f"PAN-OS API: Found Users Connected to GP-Gateway, Firewall {fw_ip}")
+        if type(result["entry"]) == dict:
+            result["entry"] = [result["entry"]]
+        for _ in result["entry"]:
+            user = dict()
+            user["Username"] = _["username"].lower()
+            user["Client-Hostname"] = _["computer"]
+            user["Client-OS"] = _["client"]
+            user["Client-Source-IP"] = _["client-ip"]
+            user["Raw-Data"] = _
+            gp_users.append(user)
+            logger.debug(
+                'PAN-OS API: User "{}" Connected to GP-Gateway, Firewall {}', user['Username'], fw_ip)
+    else:
+        logger.debug(
+            f"PAN-OS API: NO Users Connected to GP-Gateway, Firewall {fw_ip}")
+    for entry in gp_users:
+        if entry['Username'] in gp_connected_user_data.keys():
+            gp_connected_user_data[entry['Username'].lower()].append(
+                entry)
+        else:
+            gp_connected_user_data[entry['Username'].lower()] = [
+                entry]
+    return gp_connected_user_data
+
+
+def fw_gp_ext(fw_ip, fw_key, ignore_cache: bool = False, gateway: str = None):
+    """
+    Returns the GP sessions of one gateway, from cache if fresh or from the firewall.
+
+    Parameters:
+    - fw_ip (str): The IP address of the (active) gateway firewall.
+    - fw_key (str): The PAN-OS API key.
+    - ignore_cache (bool): Always refresh from the firewall (defaults to False).
+    - gateway (str): The gateway name sessions are cached and tagged with (defaults to fw_ip).
 
+    Returns:
+    - dict: Sessions keyed by lower case username, each a list of session dicts.
+    """
     global fw_data
-    api_url = f"https://{fw_ip}/api"
+    init_fw_cache()
+    gateway = gateway or fw_ip
+    with fw_data_lock:
+        gw_cache = fw_data.setdefault("gateways", {}).setdefault(
+            gateway, {"fw_gp_sessions": StripedDict(), "fw_gp_sessions_timestamp": 0})
     api_prm = {
         "key": fw_key,
         "type": "op",
         "cmd": "<show><global-protect-gateway><current-user/></global-protect-gateway></show>"
     }
-    if not ignore_cache and ("fw_gp_sessions" in fw_data.keys() and fw_data["fw_gp_sessions_timestamp"] > time.time() - config['fw_gp_sessions_ttl']):
+    if not ignore_cache and gw_cache["fw_gp_sessions_timestamp"] > time.time() - sessions_ttl():
         logger.debug(
-            f"FW GP Sessions data cache hit, freshness: {(time.time() - fw_data['fw_gp_sessions_timestamp']):.2f}s")
-        gp_connected_user_data = fw_data["fw_gp_sessions"]
+            f"FW GP Sessions data cache hit for gateway {gateway}, freshness: {(time.time() - gw_cache['fw_gp_sessions_timestamp']):.2f}s")
+        return gw_cache["fw_gp_sessions"]
+
+    logger.warning(
+        f"FW GP Sessions data Cache Miss for gateway {gateway}. Refreshing data from FW.")
+    logger.info(
+        f"PAN-OS API: Request GP-Gateway Connected Users, Firewall {fw_ip}")
+    try:
+        response = resilience.retry_call(
+            fw_api_call, fw_ip, api_prm, timeout=5,
+            breaker=resilience.get_breaker(f"panos:{fw_ip}"))
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Degrade to the last known session table instead of reporting no sessions
+        logger.error(
+            f"PAN-OS API: Connection Failure, Firewall {fw_ip} Unreachable ({e}). Using cached GP sessions.")
+        return gw_cache["fw_gp_sessions"]
+    logger.debug(
+        f"PAN-OS API: Analyzing GP-Gateway Connected Users, Firewall {fw_ip}")
+    gp_connected_user_data = parse_gp_current_users(response.text, fw_ip)
+    for sessions in gp_connected_user_data.values():
+        for entry in sessions:
+            entry["Gateway"] = gateway
+    with fw_data_lock:
+        changes = session_log.diff(gw_cache["fw_gp_sessions"], gp_connected_user_data)
+        gw_cache["fw_gp_sessions"] = StripedDict(gp_connected_user_data)
+        gw_cache["fw_gp_sessions_timestamp"] = time.time()
+        old_index = fw_data.get("fw_gp_sessions", {})
+        fw_data["fw_gp_sessions"] = StripedDict(merge_gateway_sessions())
+        fw_data["fw_gp_sessions_timestamp"] = time.time()
+        # Only users whose sessions changed on this gateway can differ in the merged index
+        removed, added = index_changes(old_index, fw_data["fw_gp_sessions"], changes)
+        session_stats.apply_changes(removed, added)
+        prewarm.record_sessions(added)
+        persist_sessions(gateway, changes, gw_cache["fw_gp_sessions_timestamp"])
+    logger.opt(lazy=True).debug(
+        "Connected GP Users Data:\n {}",
+        lambda: fastjson.dumps_pretty(gp_connected_user_data))
+    return gp_connected_user_data
+
+
+def fw_gp_user(fw_ip, fw_key, username: str, gateway: str = None) -> list:
+    """
+    Queries one gateway for the GP sessions of a single user and merges them into
+    the session cache (replacing that user's cached sessions on the gateway).
+
+    Parameters:
+    - fw_ip (str): The IP address of the (active) gateway firewall.
+    - fw_key (str): The PAN-OS API key.
+    - username (str): The username to look up.
+    - gateway (str): The gateway name sessions are cached and tagged with (defaults to fw_ip).
+
+    Returns:
+    - list: The user's sessions on this gateway (empty if not connected).
+    """
+    global fw_data
+    init_fw_cache()
+    gateway = gateway or fw_ip
+    username = username.lower()
+    api_prm = {
+        "key": fw_key,
+        "type": "op",
+        "cmd": f"<show><global-protect-gateway><current-user><user>{xml_escape(username)}</user></current-user></global-protect-gateway></show>"
+    }
+    logger.info(
+        f"PAN-OS API: Request GP-Gateway sessions of user {username}, Firewall {fw_ip}")
+    response = resilience.retry_call(
+        fw_api_call, fw_ip, api_prm, timeout=5,
+        breaker=resilience.get_breaker(f"panos:{fw_ip}"))
+    sessions = parse_gp_current_users(response.text, fw_ip).get(username, [])
+    for entry in sessions:
+        entry["Gateway"] = gateway
+    set_user_sessions(gateway, username, sessions)
+    return sessions
+
+
+def set_user_sessions(gateway: str, username: str, sessions: list):
+    """
+    Replaces the cached sessions of one user on one gateway and updates the user's
+    entry in the merged session index, without touching any other user.
+    """
+    init_fw_cache()
+    username = username.lower()
+    with fw_data_lock:
+        gw_cache = fw_data.setdefault("gateways", {}).setdefault(
+            gateway, {"fw_gp_sessions": StripedDict(), "fw_gp_sessions_timestamp": 0})
+        if gw_cache["fw_gp_sessions"].get(username) == (sessions or None):
+            return
+        if sessions:
+            gw_cache["fw_gp_sessions"][username] = sessions
+        else:
+            gw_cache["fw_gp_sessions"].pop(username, None)
+        merged = merge_user_sessions(username)
+        index = fw_data.setdefault("fw_gp_sessions", StripedDict())
+        removed, added = index_changes(index, {username: merged}, [username])
+        session_stats.apply_changes(removed, added)
+        prewarm.record_sessions(added)
+        if merged:
+            index[username] = merged
+        else:
+            index.pop(username, None)
+        persist_sessions(gateway, {username: sessions or None})
+
+
+def get_gateways(config: dict) -> list:
+    """
+    Returns the configured GP gateway HA pairs as a list of dicts with name, fw_ip,
+    fw_ha_ip and optionally api_key. Without a 'gateways' list in the config the
+    single fw_ip / fw_ha_ip pair is used.
+    """
+    gateways = config.get('gateways')
+    if not gateways:
+        return [{"name": config['fw_ip'], "fw_ip": config['fw_ip'], "fw_ha_ip": config.get('fw_ha_ip')}]
+    return [dict(gw, name=gw.get('name') or gw['fw_ip']) for gw in gateways]
+
+
+def get_gateway_active_fw(gateway: dict, api_key: str) -> str:
+    """
+    Returns the active firewall of a gateway HA pair, cached for fw_ha_state_ttl seconds.
+    """
+    name = gateway['name']
+    ttl = get_config()['fw_ha_state_ttl']
+    cached = active_fw_cache.get(name)
+    if cached and cached[0] and cached[1] > time.time() - ttl:
+        return cached[0]
+    active_fw = get_active_fw(
+        gateway['fw_ip'], gateway.get('fw_ha_ip') or gateway['fw_ip'], api_key)
+    active_fw_cache[name] = (active_fw, time.time())
+    return active_fw
+
+
+def poll_gateway(gateway: dict, fw_key: str, ignore_cache: bool = False) -> str:
+    """
+    Resolves the active peer of one gateway and refreshes its GP sessions.
+
+    Returns:
+    - str: The active firewall IP, None if no peer of the gateway is reachable.
+    """
+    name = gateway['name']
+    api_key = gateway.get('api_key') or fw_key
+    fw_ip = get_gateway_active_fw(gateway, api_key)
+    if fw_ip is None:
+        logger.error(f"Gateway {name}: No active and reachable firewall found.")
     else:
-        logger.warning(
-            f"FW GP Sessions data Cache Miss. Refreshing data from FW.")
-        gp_connected_user_data = dict()
-        for counter in range(3):
-            try:
-                logger.info(
-                    f"PAN-OS API: Request GP-Gateway Connected Users, Firewall {fw_ip}")
-                response = requests.request(
-                    "GET", url=api_url, params=api_prm, verify=False, timeout=5)
-            except Exception:
-                if counter < 3:
-                    logger.error(
-                        f"PAN-OS API: Connection Failure, Firewall {fw_ip} Unreachable on Attempt {counter+1}/3")
-                else:
-                    logger.error(
-                        f"PAN-OS API: Connection Failure, Firewall {fw_ip} Unreachable after 3 Attempts. Aborting.")
+        fw_gp_ext(fw_ip, api_key, ignore_cache=ignore_cache, gateway=name)
+    gw_cache = fw_data.get("gateways", {}).get(name, {})
+    gateway_status[name] = {
+        "active_fw": fw_ip,
+        "sessions": sum(len(v) for v in gw_cache.get("fw_gp_sessions", {}).values()),
+        "last_refresh": gw_cache.get("fw_gp_sessions_timestamp"),
+        "last_poll": time.time(),
+    }
+    return fw_ip
+
+
+def merge_gateway_sessions(gateway_names: list = None) -> dict:
+    """
+    Builds the fleet wide session index from the per gateway caches.
+    Sessions are keyed by username, tagged with their gateway and de-duplicated
+    on (username, hostname, client IP, virtual IP).
+    """
+    merged = dict()
+    seen = set()
+    gateways = fw_data.get("gateways", {})
+    for name in (gateway_names if gateway_names is not None else list(gateways)):
+        if name not in gateways:
+            continue
+        for username, sessions in gateways[name]["fw_gp_sessions"].items():
+            for entry in sessions:
+                key = session_key(username, entry)
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.setdefault(username, []).append(entry)
+    return merged
+
+
+def merge_user_sessions(username: str) -> list:
+    """
+    Returns the merged (all gateways, de-duplicated) sessions of a single user.
+    """
+    merged = []
+    seen = set()
+    for gw_cache in fw_data.get("gateways", {}).values():
+        for entry in gw_cache["fw_gp_sessions"].get(username, []):
+            key = session_key(username, entry)
+            if key not in seen:
+                seen.add(key)
+                merged.append(entry)
+    return merged
+
+
+def index_changes(old_index: dict, new_index: dict, usernames) -> tuple:
+    """
+    Compares the sessions of the given users in two session indexes.
+
+    Returns:
+    - tuple: (removed, added) session entries, for session_stats.apply_changes().
+    """
+    removed = []
+    added = []
+    for username in usernames:
+        old = {session_key(username, e): e for e in old_index.get(username, [])}
+        new = {session_key(username, e): e for e in new_index.get(username, [])}
+        for key, entry in old.items():
+            if key not in new or session_stats.stat_key(new[key]) != session_stats.stat_key(entry):
+                removed.append(entry)
+        for key, entry in new.items():
+            if key not in old or session_stats.stat_key(old[key]) != session_stats.stat_key(entry):
+                added.append(entry)
+    return removed, added
+
+
+def session_key(username: str, entry: dict) -> tuple:
+    """
+    Identity of a GP session for de-duplication: (username, hostname, client IP, virtual IP).
+    """
+    return (username, entry["Client-Hostname"].lower(), entry["Client-Source-IP"],
+            entry["Raw-Data"].get("virtual-ip"))
+
+
+def sessions_ttl() -> float:
+    """
+    Returns the session table cache TTL. While GP events are being received
+    (see gp_events) polling is only a low frequency consistency check.
+    """
+    config = get_config()
+    if events_last_applied > time.time() - config['gp_events_stale_after']:
+        return config['fw_gp_consistency_ttl']
+    return config['fw_gp_sessions_ttl']
+
+
+def fw_gp_user_all(gateways: list, fw_key: str, username: str) -> list:
+    """
+    Looks up the GP sessions of a single user on all gateways concurrently.
+
+    A gateway that fails or does not answer within fw_gateway_timeout seconds
+    (capped by the request deadline) contributes its cached sessions of the user.
+
+    Returns:
+    - list: The user's sessions across the fleet, tagged with their gateway.
+
+    Raises:
+    - GatewayUnavailable: No gateway has a reachable active firewall.
+    """
+    init_fw_cache()
+    username = username.lower()
+
+    def lookup(gateway):
+        api_key = gateway.get('api_key') or fw_key
+        fw_ip = get_gateway_active_fw(gateway, api_key)
+        if fw_ip is None:
+            logger.error(
+                f"Gateway {gateway['name']}: No active and reachable firewall found.")
+            return None
+        return fw_gp_user(fw_ip, api_key, username, gateway=gateway['name'])
+
+    results = run_on_gateways(gateways, lookup)
+    if results and all(r is None for r in results.values()):
+        raise GatewayUnavailable("No active and reachable firewall found.")
+    sessions = []
+    with fw_data_lock:
+        for name in [gw['name'] for gw in gateways]:
+            if isinstance(results.get(name), list):
+                sessions.extend(results[name])
             else:
-                logger.debug(
-                    f"PAN-OS API: Analyzing GP-Gateway Connected Users, Firewall {fw_ip}")
-                result = xmltodict.parse(response.text)["response"]["result"]
-                gp_users = []
-                if result:
-                    logger.debug(
-                        f"PAN-OS API: Found Users Connected to GP-Gateway, Firewall {fw_ip}")
-                    if type(result["entry"]) == dict:
-                        result["entry"] = [result["entry"]]
-                    for _ in result["entry"]:
-                        user = dict()
-                        user["Username"] = _["username"].lower()
-                        user["Client-Hostname"] = _["computer"]
-                        user["Client-OS"] = _["client"]
-                        user["Client-Source-IP"] = _["client-ip"]
-                        user["Raw-Data"] = _
-                        gp_users.append(user)
-                        logger.debug(
-                            f"PAN-OS API: User \"{user['Username']}\" Connected to GP-Gateway, Firewall {fw_ip}")
-                else:
-                    logger.debug(
-                        f"PAN-OS API: NO Users Connected to GP-Gateway, Firewall {fw_ip}")
-                for entry in gp_users:
-                    if entry['Username'] in gp_connected_user_data.keys():
-                        gp_connected_user_data[entry['Username'].lower()].append(
-                            entry)
-                    else:
-                        gp_connected_user_data[entry['Username'].lower()] = [
-                            entry]
-                fw_data["fw_gp_sessions"] = gp_connected_user_data
-                fw_data["fw_gp_sessions_timestamp"] = time.time()
-                save_fw_cache()
-                logger.debug(
-                    f"Connected GP Users Data:\n {json.dumps(gp_connected_user_data, indent=2, sort_keys=True)}")
-                break
-    return gp_connected_user_data
+                sessions.extend(fw_data.get("gateways", {}).get(
+                    name, {}).get("fw_gp_sessions", {}).get(username, []))
+    return sessions
+
+
+def run_on_gateways(gateways: list, func) -> dict:
+    """
+    Runs func(gateway) for all gateways concurrently in the polling thread pool.
+
+    Each gateway gets at most fw_gateway_timeout seconds (capped by the request
+    deadline). Gateways that fail or time out are missing from the result.
+
+    Returns:
+    - dict: Results of func by gateway name.
+    """
+    global _poll_executor
+    config = get_config()
+    if _poll_executor is None:
+        _poll_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config['fw_poll_workers'], thread_name_prefix="gp-gateway-poll")
+    timeout = config['fw_gateway_timeout']
+    left = deadline.remaining()
+    if left is not None:
+        timeout = min(timeout, left)
+    futures = {}
+    for gateway in gateways:
+        # Run in a copy of the current context so the request deadline applies
+        ctx = contextvars.copy_context()
+        futures[_poll_executor.submit(ctx.run, func, gateway)] = gateway['name']
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    results = {}
+    for future in not_done:
+        logger.error(
+            f"Gateway {futures[future]} did not answer within {timeout:.2f}s. Using cached GP sessions.")
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            logger.error(f"Gateway {futures[future]}: Request failed. Error {e}")
+    deadline.check()
+    return results
+
+
+def fw_gp_ext_all(gateways: list, fw_key: str, ignore_cache: bool = False) -> dict:
+    """
+    Polls the GP sessions of all gateways concurrently and returns the merged session index.
+
+    Each gateway gets at most fw_gateway_timeout seconds (capped by the request
+    deadline). A gateway that is slower or unreachable does not hold up the
+    others, its last cached sessions are used instead.
+
+    Parameters:
+    - gateways (list): Gateways as returned by get_gateways().
+    - fw_key (str): The default PAN-OS API key.
+    - ignore_cache (bool): Always refresh from the firewalls (defaults to False).
+
+    Returns:
+    - dict: Sessions keyed by lower case username (see merge_gateway_sessions).
+
+    Raises:
+    - GatewayUnavailable: No gateway has a reachable active firewall.
+    """
+    init_fw_cache()
+    results = run_on_gateways(
+        gateways, lambda gateway: poll_gateway(gateway, fw_key, ignore_cache))
+    if len(results) == len(gateways) and not any(results.values()):
+        raise GatewayUnavailable("No active and reachable firewall found.")
+    with fw_data_lock:
+        return merge_gateway_sessions([gw['name'] for gw in gateways])
 
 
 def fw_gp_lst(gp_ext):
@@ -158,36 +544,125 @@ def fw_gp_lst(gp_ext):
 # Implement cache for fw_key and fw_gp_ext
 
 
-def save_fw_cache():
-    global fw_data
-    if "fw_key" in fw_data and not fw_data["fw_key"] is None:
+def save_fw_cache(data: dict = None) -> bool:
+    """
+    Writes a full snapshot of the FW data cache.
+
+    Parameters:
+    - data (dict): Copy of the cache to write (see snapshot_fw_cache). Without it
+      fw_data itself is written, which needs fw_data_lock held.
+
+    Returns:
+    - bool: True if the snapshot was written.
+    """
+    data = fw_data if data is None else data
+    if "fw_key" in data and not data["fw_key"] is None:
         try:
-            with open('data/fw_data.pickle', 'wb') as fd:
-                pickle.dump(fw_data, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            # Replace atomically, the delta log is only valid on top of a complete snapshot
+            with open(f"{FW_CACHE_PATH}.tmp", 'wb') as fd:
+                pickle.dump(data, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{FW_CACHE_PATH}.tmp", FW_CACHE_PATH)
         except Exception:
             raise
+        return True
     else:
         logger.error("FW Data Cache Not Saved. No Data to Save.")
+        return False
 
 
-def get_fw_cache():
+def persist_sessions(gateway: str, changes: dict, timestamp: float = None):
+    """
+    Appends session changes of a gateway to the delta log (compact_sessions writes
+    the snapshots). Must be called with fw_data_lock held, after the changes have
+    been applied to fw_data.
+
+    Parameters:
+    - gateway (str): The gateway name.
+    - changes (dict): New sessions by username, None for disconnected users (see session_log.diff).
+    - timestamp (float): The gateway's poll time, None for event updates.
+    """
+    session_log.append(gateway, changes, timestamp)
+
+
+def snapshot_fw_cache() -> dict:
+    """
+    Returns a plain dict copy of the FW data cache. Must be called with fw_data_lock held.
+    """
+    data = dict(fw_data)
+    if "fw_gp_sessions" in data:
+        data["fw_gp_sessions"] = dict(data["fw_gp_sessions"].items())
+    data["gateways"] = {
+        name: dict(gw_cache, fw_gp_sessions=dict(gw_cache["fw_gp_sessions"].items()))
+        for name, gw_cache in data.get("gateways", {}).items()}
+    return data
+
+
+def compact_sessions() -> bool:
+    """
+    Writes a full snapshot and drops the logged changes it includes, if the delta
+    log has grown too large (see session_log). The snapshot is pickled without
+    fw_data_lock held, so it runs in the background without blocking session
+    updates.
+
+    Returns:
+    - bool: True if a snapshot was written.
+    """
+    init_fw_cache()
+    if not session_log.needs_compaction(FW_CACHE_PATH):
+        return False
+    with fw_data_lock:
+        data = snapshot_fw_cache()
+        mark = session_log.mark()
+    if not save_fw_cache(data):
+        return False
+    session_log.truncate(mark)
+    metrics.incr("fw_session_log.compactions")
+    return True
+
+
+def init_fw_cache() -> dict:
+    """
+    Loads the FW data cache from disk once. Safe to call repeatedly, later calls are no-ops.
+    """
     global fw_data
-    if os.path.isfile('data/fw_data.pickle'):
+    global fw_data_loaded
+    if not fw_data_loaded:
+        fw_data = get_fw_cache()
+        if os.path.isfile(FW_CACHE_PATH):
+            session_log.replay(fw_data)
+        else:
+            # Deltas without their snapshot are meaningless
+            session_log.truncate()
+        # Session indexes are read without fw_data_lock (e.g. by /syncuser), see striped_cache
+        fw_data["fw_gp_sessions"] = StripedDict(fw_data.get("fw_gp_sessions", {}))
+        for gw_cache in fw_data.get("gateways", {}).values():
+            gw_cache["fw_gp_sessions"] = StripedDict(gw_cache["fw_gp_sessions"])
+        if fw_data.get("gateways"):
+            fw_data["fw_gp_sessions"] = StripedDict(merge_gateway_sessions())
+        fw_data_loaded = True
+        session_stats.apply_changes([], [
+            entry for entries in fw_data.get("fw_gp_sessions", {}).values() for entry in entries],
+            record_history=False)
+    return fw_data
+
+
+def get_fw_cache():
+    """
+    Reads the FW data cache from disk. If no cache file exists a fresh cache is
+    returned, it is only written to disk on the next save_fw_cache().
+    """
+    if os.path.isfile(FW_CACHE_PATH):
         try:
-            with open('data/fw_data.pickle', 'rb') as fd:
+            with open(FW_CACHE_PATH, 'rb') as fd:
                 fw_data = pickle.load(fd)
         except Exception:
-            os.remove("data/fw_data.pickle")
+            os.remove(FW_CACHE_PATH)
             raise
     else:
         fw_data = {
-            'fw_key': config['fw_credentials']['api_key'],
+            'fw_key': get_config()['fw_credentials']['api_key'],
             'fw_key_timestamp': time.time(),
             'fw_gp_sessions': {},
-            'fw_gp_sessions_timestamp': time.time(),
+            'fw_gp_sessions_timestamp': 0,
         }
-        save_fw_cache()
     return fw_data
-
-
-fw_data = get_fw_cache()
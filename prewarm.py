@@ -0,0 +1,161 @@
+"""
+Predictive pre-warming of the ISE user record cache.
+
+Logins are learned per user as counts per 15 minute slot of the day, from the
+GP sessions the firewalls report (login-time-utc) and from the duplicate
+attempt audit store. Shortly before a user's usual login slot (prewarm_lead
+seconds) the background job refreshes the user's ISE record, rate limited to
+prewarm_rate fetches per second. Pre-warmed records count as fresh for
+prewarm_ttl seconds (instead of ise_cache_ttl) until they are first used, so a
+login storm at shift start is served from the cache.
+
+Effect is reported on /metrics: ise.user_cache.hits / misses and prewarm.hits
+(hits that were only possible because of pre-warming).
+"""
+import datetime
+import os
+import pickle
+import threading
+import time
+
+import cisco_ise
+import deadline
+import metrics
+from config import get_config
+from logger import logger
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DATA_FILE = "data/login_windows.pickle"
+
+# Login counts per slot of the day, by username
+login_counts = {}
+# Slot with the most logins, by username
+top_slot = {}
+# login-time-utc of the last recorded login, by username (a session is only counted once)
+last_login = {}
+# Day a user was last pre-warmed on, by username
+prewarmed_on = {}
+_lock = threading.Lock()
+
+
+def slot_of(ts: float) -> int:
+    local = time.localtime(ts)
+    return (local.tm_hour * 60 + local.tm_min) // SLOT_MINUTES
+
+
+def record_login(username: str, ts: float):
+    username = username.lower()
+    with _lock:
+        if last_login.get(username) == ts:
+            return
+        last_login[username] = ts
+        counts = login_counts.setdefault(username, [0] * SLOTS_PER_DAY)
+        slot = slot_of(ts)
+        counts[slot] += 1
+        top = top_slot.get(username)
+        if top is None or counts[slot] > counts[top]:
+            top_slot[username] = slot
+
+
+def record_sessions(entries: list):
+    """
+    Learns logins from session entries newly added to the session index.
+    """
+    for entry in entries:
+        try:
+            ts = float(entry["Raw-Data"].get("login-time-utc") or time.time())
+        except (TypeError, ValueError):
+            ts = time.time()
+        record_login(entry["Username"], ts)
+
+
+def learn_from_audit(days: int = 30):
+    """
+    Learns logins from the duplicate attempts of the last days (audit store).
+    """
+    import audit_store
+    since = time.time() - days * 86400
+    rows = audit_store.get_db().execute(
+        "SELECT username, ts FROM duplicates WHERE ts >= ?", (since,)).fetchall()
+    for username, ts in rows:
+        record_login(username, ts)
+    logger.info(f"Pre-warm: Learned {len(rows)} logins from the audit store")
+
+
+def login_window(username: str) -> int:
+    """
+    Returns the user's usual login slot, None if there is not enough history.
+    """
+    slot = top_slot.get(username)
+    if slot is None or login_counts[username][slot] < get_config()["prewarm_min_logins"]:
+        return None
+    return slot
+
+
+def due_users(now: float = None) -> list:
+    """
+    Returns the users whose usual login slot starts within prewarm_lead seconds
+    and who have not been pre-warmed today.
+    """
+    config = get_config()
+    now = time.time() if now is None else now
+    slot = slot_of(now + config["prewarm_lead"])
+    today = datetime.date.fromtimestamp(now)
+    with _lock:
+        users = [u for u, s in top_slot.items()
+                 if s == slot and prewarmed_on.get(u) != today
+                 and login_counts[u][s] >= config["prewarm_min_logins"]]
+    return users[:config["prewarm_max_per_run"]]
+
+
+def run_once(ise_ip: str, ise_auth: str, now: float = None) -> int:
+    """
+    Pre-warms the records of all due users, rate limited. Runs in a worker thread.
+
+    Returns:
+    - int: Number of records refreshed.
+    """
+    now = time.time() if now is None else now
+    today = datetime.date.fromtimestamp(now)
+    users = due_users(now)
+    refreshed = 0
+    interval = 1 / get_config()["prewarm_rate"]
+    for username in users:
+        started = time.monotonic()
+        try:
+            if cisco_ise.ise_prewarm_user(ise_ip, ise_auth, username):
+                refreshed += 1
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Pre-warm: Refreshing user {username} failed. Error {e}")
+        prewarmed_on[username] = today
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+    if users:
+        metrics.incr("prewarm.refreshed", refreshed)
+        logger.info(f"Pre-warm: Refreshed {refreshed}/{len(users)} user records")
+    return refreshed
+
+
+def save():
+    with _lock:
+        data = pickle.dumps({"login_counts": login_counts, "last_login": last_login},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+    with open(DATA_FILE, "wb") as fd:
+        fd.write(data)
+
+
+def load():
+    """
+    Loads the learned login windows from disk (if saved before).
+    """
+    if not os.path.isfile(DATA_FILE):
+        return
+    with open(DATA_FILE, "rb") as fd:
+        data = pickle.load(fd)
+    with _lock:
+        login_counts.update(data["login_counts"])
+        last_login.update(data["last_login"])
+        for username, counts in login_counts.items():
+            top_slot[username] = max(range(SLOTS_PER_DAY), key=counts.__getitem__)
@@ -0,0 +1,207 @@
+"""
+Shared retry / circuit breaker layer for upstream (Cisco ISE and PAN-OS) API calls.
+
+Every upstream host gets its own circuit breaker (e.g. "ise:192.168.1.20" or
+"panos:192.168.1.10"). After breaker_failure_threshold consecutive failures the
+breaker opens and calls fail fast without touching the network. Once
+breaker_reset_timeout seconds have passed the breaker goes half-open and lets a
+single probe request through, which either closes it again or re-opens it.
+"""
+import random
+import threading
+import time
+
+import deadline
+from config import get_config
+from logger import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Circuit breakers by upstream name
+breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is refused because the upstream's circuit breaker is open.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker for {name} is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Consecutive failure circuit breaker with half-open probing.
+
+    Parameters:
+    - name (str): Upstream name used in logs and state reports.
+    - failure_threshold (int): Consecutive failures that open the breaker.
+    - reset_timeout (float): Seconds the breaker stays open before allowing a probe.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+        self._state = CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def is_open(self) -> bool:
+        """
+        True while the breaker refuses calls (open and not yet due for a probe).
+        """
+        return self.state == OPEN
+
+    def allow_request(self) -> bool:
+        """
+        Returns True if a call may go to the upstream now. In half-open state only
+        one probe call is allowed at a time.
+        """
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                logger.info(f"Circuit breaker {self.name}: half-open, probing")
+                return True
+            self.total_rejected += 1
+            return False
+
+    def release_probe(self):
+        """
+        Gives back a call allowed by allow_request() that was not sent, so the
+        next call can probe a half-open breaker.
+        """
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.warning(f"Circuit breaker {self.name}: closed")
+            self._state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            if self.probe_in_flight or self.failures >= self.failure_threshold:
+                if self._state != OPEN or self.probe_in_flight:
+                    logger.error(
+                        f"Circuit breaker {self.name}: open after {self.failures} consecutive failures")
+                self._state = OPEN
+                self.opened_at = time.time()
+            self.probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "total_rejected": self.total_rejected,
+            "opened_at": self.opened_at or None,
+        }
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker for an upstream, creating it on first use.
+    """
+    with _breakers_lock:
+        if name not in breakers:
+            config = get_config()
+            breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=config["breaker_failure_threshold"],
+                reset_timeout=config["breaker_reset_timeout"])
+        return breakers[name]
+
+
+def breaker_states() -> dict:
+    """
+    Returns a snapshot of all circuit breakers, for health / status reporting.
+    """
+    with _breakers_lock:
+        return {name: b.snapshot() for name, b in breakers.items()}
+
+
+def backoff_delay(attempt: int, base_delay: float = None, max_delay: float = None) -> float:
+    """
+    Exponential backoff with full jitter: a random delay in [0, min(max, base * 2^attempt)].
+    """
+    base_delay = get_config()["retry_base_delay"] if base_delay is None else base_delay
+    max_delay = get_config()["retry_max_delay"] if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_call(func, *args,
+               attempts: int = None,
+               base_delay: float = None,
+               max_delay: float = None,
+               retry_if=None,
+               breaker: CircuitBreaker = None,
+               **kwargs):
+    """
+    Calls func(*args, **kwargs), retrying with exponential backoff and jitter.
+
+    Parameters:
+    - func: The callable to invoke.
+    - attempts (int): Maximum number of calls (defaults to retry_attempts setting).
+    - base_delay (float), max_delay (float): Backoff parameters in seconds.
+    - retry_if: Optional predicate, a result for which it returns True is retried.
+    - breaker (CircuitBreaker): If given, no (further) attempts are made while it is open.
+
+    Returns:
+    - The first accepted result, or the last result if all attempts were retried.
+
+    Raises:
+    - CircuitOpenError: The breaker is open.
+    - The last exception raised by func if every attempt raised.
+    """
+    attempts = get_config()["retry_attempts"] if attempts is None else attempts
+    result = None
+    for attempt in range(attempts):
+        if breaker is not None and breaker.is_open():
+            raise CircuitOpenError(breaker.name)
+        last_exc = None
+        try:
+            result = func(*args, **kwargs)
+        except (CircuitOpenError, deadline.DeadlineExceeded):
+            raise
+        except Exception as e:
+            last_exc = e
+        else:
+            if retry_if is None or not retry_if(result):
+                return result
+        if attempt < attempts - 1:
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            left = deadline.remaining()
+            if left is not None and delay >= left:
+                deadline.check()
+                delay = max(0, left - deadline.MIN_TIMEOUT)
+            logger.warning(
+                f"Attempt {attempt + 1}/{attempts} of {getattr(func, '__name__', func)} failed. Retrying in {delay:.2f}s")
+            time.sleep(delay)
+    if last_exc is not None:
+        raise last_exc
+    return result
+
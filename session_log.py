@@ -0,0 +1,143 @@
+"""
+Append-only delta log of GP session changes (data/fw_sessions.log).
+
+The FW data cache is persisted as a full snapshot (data/fw_data.pickle) plus
+this log. A session poll or event only appends the users whose sessions changed
+on a gateway, as one pickled record (gateway, poll timestamp, {username:
+sessions or None}). When the log holds fw_session_log_max_records records or
+grows beyond fw_session_log_max_ratio of the snapshot size, a background task
+(pan_fw.compact_sessions) writes a new snapshot and the records it includes are
+dropped from the log (compaction). Loading replays the log on top of the
+snapshot.
+"""
+import os
+import pickle
+import threading
+
+import metrics
+from config import get_config
+from logger import logger
+
+LOG_PATH = "data/fw_sessions.log"
+
+# Records appended since the last compaction
+records = 0
+_lock = threading.Lock()
+
+
+def diff(old_sessions, new_sessions: dict) -> dict:
+    """
+    Compares two session maps of a gateway (sessions keyed by username).
+
+    Returns:
+    - dict: The new sessions of each changed user, None for users no longer connected.
+    """
+    changes = {}
+    for username, sessions in new_sessions.items():
+        if old_sessions.get(username) != sessions:
+            changes[username] = sessions
+    for username in old_sessions.keys() - new_sessions.keys():
+        changes[username] = None
+    return changes
+
+
+def append(gateway: str, changes: dict, timestamp: float = None):
+    """
+    Appends the session changes of a gateway (see diff) to the log.
+    """
+    global records
+    if not changes:
+        return
+    with _lock:
+        with open(LOG_PATH, "ab") as fd:
+            pickle.dump((gateway, timestamp, changes), fd, protocol=pickle.HIGHEST_PROTOCOL)
+        records += 1
+    metrics.incr("fw_session_log.records")
+
+
+def needs_compaction(snapshot_path: str) -> bool:
+    """
+    Returns True if a full snapshot should be written instead of appending to the log.
+    """
+    config = get_config()
+    if records >= config["fw_session_log_max_records"] or not os.path.isfile(snapshot_path):
+        return True
+    try:
+        log_size = os.path.getsize(LOG_PATH)
+    except OSError:
+        return False
+    return log_size > os.path.getsize(snapshot_path) * config["fw_session_log_max_ratio"]
+
+
+def mark() -> tuple:
+    """
+    Returns the current end of the log as (offset, records), to truncate up to later.
+    """
+    with _lock:
+        offset = os.path.getsize(LOG_PATH) if os.path.isfile(LOG_PATH) else 0
+        return offset, records
+
+
+def truncate(upto: tuple = None):
+    """
+    Drops the logged changes a written snapshot includes: all of them, or the ones
+    before a mark() taken together with the snapshot's copy.
+    """
+    global records
+    with _lock:
+        if not os.path.isfile(LOG_PATH):
+            records = 0
+            return
+        if upto is None:
+            open(LOG_PATH, "wb").close()
+            records = 0
+            return
+        offset, marked = upto
+        with open(LOG_PATH, "rb") as fd:
+            fd.seek(offset)
+            tail = fd.read()
+        # Records appended after the mark stay, rewritten at the start of the log
+        with open(f"{LOG_PATH}.tmp", "wb") as fd:
+            fd.write(tail)
+        os.replace(f"{LOG_PATH}.tmp", LOG_PATH)
+        records = max(records - marked, 0)
+
+
+def replay(fw_data: dict) -> int:
+    """
+    Applies the logged changes to the per-gateway session maps of a loaded snapshot.
+    A torn record at the end of the log (crash while appending) is cut off.
+
+    Returns:
+    - int: Number of records applied.
+    """
+    global records
+    if not os.path.isfile(LOG_PATH):
+        return 0
+    applied = 0
+    gateways = fw_data.setdefault("gateways", {})
+    with _lock, open(LOG_PATH, "r+b") as fd:
+        good = 0
+        while True:
+            try:
+                gateway, timestamp, changes = pickle.load(fd)
+            except Exception as e:
+                if fd.seek(0, os.SEEK_END) > good:
+                    logger.warning(f"FW session log: Dropping torn record at offset {good}. Error {e}")
+                    fd.truncate(good)
+                break
+            gw_cache = gateways.setdefault(
+                gateway, {"fw_gp_sessions": {}, "fw_gp_sessions_timestamp": 0})
+            for username, sessions in changes.items():
+                if sessions:
+                    gw_cache["fw_gp_sessions"][username] = sessions
+                else:
+                    gw_cache["fw_gp_sessions"].pop(username, None)
+            if timestamp:
+                gw_cache["fw_gp_sessions_timestamp"] = timestamp
+            applied += 1
+            good = fd.tell()
+        records = applied
+    if applied:
+        logger.info(f"FW session log: Replayed {applied} records")
+    return applied
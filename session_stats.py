@@ -0,0 +1,156 @@
+"""
+Live GP session statistics, maintained incrementally.
+
+pan_fw reports every change of the merged session index (sessions added and
+removed) and apiserver reports duplicate login attempts. Counters per region,
+OS and client version, and per-minute history in fixed size ring buffers, are
+updated on those changes, so reading the statistics never walks the sessions.
+"""
+import threading
+import time
+from collections import Counter
+
+from config import get_config
+
+HISTORY_MINUTES = 60
+
+
+class MinuteRing:
+    """
+    Fixed size ring buffer of per-minute values (the last `size` minutes).
+
+    Parameters:
+    - size (int): Number of minutes kept.
+    - gauge (bool): Minutes without a value repeat the previous minute's value
+      (for levels such as the session count) instead of reading 0.
+    """
+
+    def __init__(self, size: int = HISTORY_MINUTES, gauge: bool = False):
+        self.size = size
+        self.gauge = gauge
+        self.minutes = [-1] * size
+        self.values = [0] * size
+
+    def _slot(self, now: float) -> int:
+        minute = int(now // 60)
+        i = minute % self.size
+        if self.minutes[i] != minute:
+            self.minutes[i] = minute
+            self.values[i] = 0
+        return i
+
+    def add(self, n: int = 1, now: float = None):
+        i = self._slot(time.time() if now is None else now)
+        self.values[i] += n
+
+    def set(self, value: int, now: float = None):
+        i = self._slot(time.time() if now is None else now)
+        self.values[i] = value
+
+    def history(self, now: float = None) -> list:
+        """
+        Returns the values of the last `size` minutes, oldest first.
+        """
+        minute = int((time.time() if now is None else now) // 60)
+        out = []
+        previous = 0
+        for m in range(minute - self.size + 1, minute + 1):
+            i = m % self.size
+            if self.minutes[i] == m:
+                previous = self.values[i]
+                out.append(previous)
+            else:
+                out.append(previous if self.gauge else 0)
+        return out
+
+
+_lock = threading.Lock()
+sessions = 0
+users = Counter()
+per_region = Counter()
+per_os = Counter()
+per_client_version = Counter()
+# Per-minute rings, created stats_history_minutes long on first use (see _history)
+history = {}
+# Always an hour long, for duplicate_attempts_last_hour whatever stats_history_minutes is
+duplicate_attempts_hour = MinuteRing(HISTORY_MINUTES)
+
+
+def _history() -> dict:
+    # Must be called with _lock held
+    if not history:
+        size = get_config()['stats_history_minutes']
+        history.update({
+            "sessions_added": MinuteRing(size),
+            "sessions_removed": MinuteRing(size),
+            "connected_sessions": MinuteRing(size, gauge=True),
+            "duplicate_attempts": MinuteRing(size),
+        })
+    return history
+
+
+def stat_key(entry: dict) -> tuple:
+    """
+    Returns the (username, region, OS, client version) a session is counted under.
+    """
+    raw = entry.get("Raw-Data", {})
+    return (entry["Username"],
+            raw.get("source-region") or "unknown",
+            entry.get("Client-OS") or "unknown",
+            raw.get("app-version") or "unknown")
+
+
+def _count(entry: dict, n: int):
+    for counter, key in zip((users, per_region, per_os, per_client_version), stat_key(entry)):
+        counter[key] += n
+        # Drop zero counts so the reported value sets stay bounded
+        if counter[key] <= 0:
+            del counter[key]
+
+
+def apply_changes(removed: list, added: list, record_history: bool = True):
+    """
+    Updates the statistics with session entries removed from and added to the session index.
+    """
+    global sessions
+    with _lock:
+        for entry in removed:
+            _count(entry, -1)
+        for entry in added:
+            _count(entry, 1)
+        sessions += len(added) - len(removed)
+        rings = _history()
+        if record_history:
+            now = time.time()
+            if added:
+                rings["sessions_added"].add(len(added), now)
+            if removed:
+                rings["sessions_removed"].add(len(removed), now)
+        rings["connected_sessions"].set(sessions)
+
+
+def record_duplicate_attempt(now: float = None):
+    with _lock:
+        now = time.time() if now is None else now
+        _history()["duplicate_attempts"].add(1, now)
+        duplicate_attempts_hour.add(1, now)
+
+
+def snapshot(now: float = None) -> dict:
+    """
+    Returns the current statistics and the per-minute history (oldest minute first).
+    """
+    with _lock:
+        now = time.time() if now is None else now
+        rings = _history()
+        rings["connected_sessions"].set(sessions, now)
+        return {
+            "connected_sessions": sessions,
+            "connected_users": len(users),
+            "per_region": dict(per_region),
+            "per_os": dict(per_os),
+            "per_client_version": dict(per_client_version),
+            "duplicate_attempts_last_hour": sum(duplicate_attempts_hour.history(now)),
+            "history_minutes": rings["duplicate_attempts"].size,
+            "history": {name: ring.history(now) for name, ring in rings.items()},
+        }
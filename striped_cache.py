@@ -0,0 +1,118 @@
+"""
+Thread-safe dict with lock striping, used for the shared caches (cisco_ise.all_users,
+the GP session indexes in pan_fw.fw_data).
+
+Keys are spread over a fixed number of stripes, each a plain dict with its own
+lock, so writers of different keys rarely contend. Iteration (keys(), items(),
+values(), for ... in) works on a snapshot copied stripe by stripe, so readers
+never see "dictionary changed size during iteration" and only hold a stripe
+lock for the copy of that stripe.
+
+Values are treated as immutable: instead of changing a cached record in place,
+build a new one, e.g. with update_entry() for a read-modify-write.
+"""
+import threading
+from collections.abc import MutableMapping
+
+DEFAULT_STRIPES = 64
+_MISSING = object()
+
+
+class StripedDict(MutableMapping):
+    """
+    Parameters:
+    - data (dict): Initial content (optional).
+    - stripes (int): Number of lock stripes.
+    """
+
+    def __init__(self, data=None, stripes: int = DEFAULT_STRIPES):
+        self._stripes = [{} for _ in range(stripes)]
+        self._count = stripes
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        if data:
+            for key, value in data.items():
+                self._stripes[hash(key) % stripes][key] = value
+
+    def _index(self, key) -> int:
+        return hash(key) % self._count
+
+    # Single dict lookups are atomic, readers take no lock
+    def __getitem__(self, key):
+        return self._stripes[hash(key) % self._count][key]
+
+    def get(self, key, default=None):
+        return self._stripes[hash(key) % self._count].get(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self._stripes[hash(key) % self._count]
+
+    def __setitem__(self, key, value):
+        i = self._index(key)
+        with self._locks[i]:
+            self._stripes[i][key] = value
+
+    def __delitem__(self, key):
+        i = self._index(key)
+        with self._locks[i]:
+            del self._stripes[i][key]
+
+    def pop(self, key, default=_MISSING):
+        i = self._index(key)
+        with self._locks[i]:
+            if default is _MISSING:
+                return self._stripes[i].pop(key)
+            return self._stripes[i].pop(key, default)
+
+    def setdefault(self, key, default=None):
+        i = self._index(key)
+        with self._locks[i]:
+            return self._stripes[i].setdefault(key, default)
+
+    def update_entry(self, key, func):
+        """
+        Atomically replaces the value of key with func(current value or None).
+
+        Returns:
+        - The new value.
+        """
+        i = self._index(key)
+        with self._locks[i]:
+            value = func(self._stripes[i].get(key))
+            self._stripes[i][key] = value
+            return value
+
+    def __len__(self) -> int:
+        return sum(len(stripe) for stripe in self._stripes)
+
+    def snapshot(self) -> dict:
+        """
+        Returns a plain dict copy (each stripe is copied under its lock).
+        """
+        result = {}
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                result.update(stripe)
+        return result
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def keys(self):
+        return self.snapshot().keys()
+
+    def items(self):
+        return self.snapshot().items()
+
+    def values(self):
+        return self.snapshot().values()
+
+    def clear(self):
+        for stripe, lock in zip(self._stripes, self._locks):
+            with lock:
+                stripe.clear()
+
+    def __reduce__(self):
+        return (self.__class__, (self.snapshot(), len(self._stripes)))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.snapshot()!r})"
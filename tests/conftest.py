@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+import resilience  # noqa: E402
+import write_queue  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs each test in an empty working directory (data/ for the caches) with
+    the sample config, no retry delays and a fresh write queue database.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    with open(os.path.join(ROOT, "config.yaml.sample")) as fd:
+        cfg = yaml.safe_load(fd)
+    cfg.update({"ise_credentials": {"token": "Basic test"},
+                "fw_credentials": {"api_key": "KEY"},
+                "retry_attempts": 1, "retry_base_delay": 0})
+    monkeypatch.setitem(config._config_cache, "config.yaml", config.apply_defaults(cfg))
+    resilience.breakers.clear()
+    write_queue._db = None
+    write_queue._queued.clear()
+    yield cfg
+    if write_queue._db is not None:
+        write_queue._db.close()
+        write_queue._db = None
+    write_queue._queued.clear()
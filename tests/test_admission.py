@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import admission
+from config import get_config
+
+
+def test_waiters_are_admitted_by_priority():
+    get_config()["admission_max_concurrent"] = 1
+
+    async def scenario():
+        controller = admission.AdmissionController()
+        await controller.acquire("sync", admission.PRIORITY_BACKGROUND)
+        order = []
+
+        async def request(route, priority):
+            await controller.acquire(route, priority)
+            order.append(route)
+            controller.release(route, 0.01)
+
+        webhook = asyncio.ensure_future(request("webhook", admission.PRIORITY_WEBHOOK))
+        await asyncio.sleep(0)
+        syncuser = asyncio.ensure_future(request("syncuser", admission.PRIORITY_AUTH))
+        await asyncio.sleep(0)
+        controller.release("sync", 0.01)
+        await asyncio.gather(webhook, syncuser)
+        return order, controller.snapshot()
+
+    order, snapshot = asyncio.run(scenario())
+    assert order == ["syncuser", "webhook"]
+    assert snapshot["active"] == 0 and snapshot["waiting"] == 0
+
+
+def test_route_limit_and_background_shedding():
+    async def scenario():
+        controller = admission.AdmissionController()
+        await controller.acquire("sync", admission.PRIORITY_BACKGROUND)
+        # Route limit 1: the second /sync queues, the third is shed
+        queued = asyncio.ensure_future(controller.acquire("sync", admission.PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Rejected) as rejected:
+            await controller.acquire("sync", admission.PRIORITY_BACKGROUND)
+        # Other routes are not held up by the full route
+        await controller.acquire("syncuser", admission.PRIORITY_AUTH)
+        assert not queued.done()
+        controller.release("sync", 0.5)
+        await queued
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.route == "sync"
+    assert rejected.retry_after >= 1
+
+
+def test_cancelled_waiter_is_removed():
+    get_config()["admission_max_concurrent"] = 1
+
+    async def scenario():
+        controller = admission.AdmissionController()
+        await controller.acquire("webhook", admission.PRIORITY_WEBHOOK)
+        waiter = asyncio.ensure_future(controller.acquire("webhook", admission.PRIORITY_WEBHOOK))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release("webhook", 0)
+        return controller.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["active"] == 0 and snapshot["waiting"] == 0
+    assert snapshot["routes"]["webhook"] == {"active": 0, "waiting": 0}
+
+
+def test_classify():
+    assert admission.classify("/syncuser/user1") == ("syncuser", admission.PRIORITY_AUTH)
+    assert admission.classify("/sync") == ("sync", admission.PRIORITY_BACKGROUND)
+    assert admission.classify("/health") is None
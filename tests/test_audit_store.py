@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+import audit_store
+
+
+@pytest.fixture(autouse=True)
+def audit_db(monkeypatch):
+    monkeypatch.setattr(audit_store, "_db", None)
+    yield
+    if audit_store._db is not None:
+        audit_store._db.close()
+
+
+def row(ts, username, denied_ip="5.6.7.8", connected_ip="1.2.3.4", hostname="HOST2"):
+    return (ts, username, "HOST1", "Windows", connected_ip, "US", hostname, "Mac", denied_ip, "AE")
+
+
+def test_cursor_pages_cover_every_attempt_once():
+    # Several attempts share a timestamp, the id breaks the tie
+    audit_store.insert_rows([row(1000 + i // 3, f"user{i % 4}", hostname=f"HOST{i}") for i in range(20)])
+    seen = []
+    cursor = None
+    while True:
+        page = audit_store.query(limit=3, cursor=cursor)
+        seen += [(item["ts"], item["id"]) for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert len(seen) == 20 == len(set(seen))
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_filters():
+    audit_store.insert_rows([
+        row(1000, "user1"),
+        row(2000, "user1", denied_ip="9.9.9.9"),
+        row(3000, "user2", connected_ip="9.9.9.9"),
+        row(4000, "user2"),
+    ])
+    assert [i["ts"] for i in audit_store.query(username="USER1")["items"]] == [2000, 1000]
+    # Matches the connected or the denied session's IP
+    assert [i["ts"] for i in audit_store.query(ip="9.9.9.9")["items"]] == [3000, 2000]
+    assert [i["ts"] for i in audit_store.query(since=2000, until=3000)["items"]] == [3000, 2000]
+    assert audit_store.query(username="user2", since=3500)["items"][0]["time"] == \
+        datetime.datetime.fromtimestamp(4000).isoformat()
+
+
+def test_repeated_attempt_is_stored_once():
+    assert audit_store.insert_rows([row(1000, "user1")]) == 1
+    assert audit_store.insert_rows([row(1000, "user1"), row(1001, "user1")]) == 1
+
+
+@pytest.mark.parametrize("where, params, index", [
+    ("username = ?", ["user1"], "duplicates_user_ts"),
+    ("(denied_ip = ? OR connected_ip = ?)", ["1.2.3.4", "1.2.3.4"], "duplicates_denied_ip_ts"),
+])
+def test_filtered_queries_use_an_index(where, params, index):
+    db = audit_store.get_db()
+    plan = " ".join(str(r[-1]) for r in db.execute(
+        f"EXPLAIN QUERY PLAN SELECT * FROM duplicates WHERE {where} "
+        "ORDER BY ts DESC, id DESC LIMIT 10", params))
+    assert index in plan
+    assert "SCAN duplicates" not in plan
+
+
+def test_import_tsv(tmp_path):
+    path = tmp_path / "2026-10.gp-dup-sessions.tsv"
+    path.write_text("header\n"
+                    "20261019100000\tUser1\tOct.19.2026\t10:00:00\tHOST1\tWin\t1.2.3.4\tUS\tHOST2\tMac\t5.6.7.8\tAE\n"
+                    "bad line\n"
+                    "notatime\tuser2\td\tt\th\to\ti\tr\th\to\ti\tr\n")
+    assert audit_store.import_tsv(str(path)) == 1
+    assert audit_store.import_tsv(str(path)) == 0
+    item = audit_store.query(username="user1")["items"][0]
+    assert (item["connected_ip"], item["denied_hostname"]) == ("1.2.3.4", "HOST2")
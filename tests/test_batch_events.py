@@ -0,0 +1,56 @@
+import asyncio
+
+from starlette.requests import Request
+
+import apiserver
+import fastjson
+import pan_fw
+from config import get_config
+
+
+def post(body) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": fastjson.dumpb(body), "more_body": False}
+    return Request({"type": "http", "method": "POST", "path": "/events/batch", "headers": [],
+                    "query_string": b"", "client": ("127.0.0.1", 40000)}, receive)
+
+
+def event(kind, name, id=None):
+    e = {"event": kind, "InternalUser": {"name": name}}
+    if id is not None:
+        e["id"] = id
+    return e
+
+
+def test_batch_applies_only_the_last_event_per_user(monkeypatch):
+    applied = []
+    synced = []
+    monkeypatch.setattr(apiserver, "config", get_config())
+    monkeypatch.setattr(apiserver, "fw_api_key", "KEY")
+    monkeypatch.setattr(pan_fw, "fw_gp_ext_all", lambda gateways, key: {"user3": [{}]})
+    monkeypatch.setattr(apiserver, "connect_user",
+                        lambda data: applied.append(("connected", data["InternalUser"]["name"])) or {})
+    monkeypatch.setattr(apiserver, "disconnect_user", lambda data, sessions: applied.append(
+        ("disconnected", data["InternalUser"]["name"])) or (
+            {"info": "still connected"} if data["InternalUser"]["name"] in sessions else {}))
+    monkeypatch.setattr(apiserver, "sync_gp_session_state", lambda config: synced.append(True))
+
+    body = {"events": [
+        event("connected", "user1", id="a"),
+        event("connected", "user2"),
+        event("disconnected", "User1", id="b"),
+        {"event": "renamed", "InternalUser": {"name": "user4"}},
+        event("disconnected", "USER2"),
+        event("disconnected", "user3"),
+    ]}
+    result = asyncio.run(apiserver.batch_events(post(body), auth_result=True))
+
+    assert sorted(applied) == [("disconnected", "USER2"), ("disconnected", "User1"),
+                               ("disconnected", "user3")]
+    statuses = [r["status"] for r in result["results"]]
+    assert statuses == ["superseded", "superseded", "applied", "error", "applied", "applied"]
+    assert result["results"][0] == {"status": "superseded", "by": 2, "id": "a"}
+    assert result["results"][2]["id"] == "b"
+    assert result["summary"] == {"superseded": 2, "applied": 3, "error": 1}
+    # user3 still has a firewall session, so the session state is synced once
+    assert synced == [True]
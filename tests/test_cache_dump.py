@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import cache_dump
+import fastjson
+
+
+def user(name, version="N-A"):
+    return {"id": f"id-{name}", "name": name,
+            "customAttributes": {cache_dump.GP_VERSION_ATTRIBUTE: version}}
+
+
+USERS = {name: user(name, "6.1.0" if name.endswith("1") else "N-A")
+         for name in ("alice1", "alice2", "bob1", "bob2", "carol1")}
+
+
+def ndjson(response) -> list:
+    async def read():
+        return [chunk async for chunk in response.body_iterator]
+    body = "".join(chunk if isinstance(chunk, str) else chunk.decode()
+                   for chunk in asyncio.run(read()))
+    return [fastjson.loads(line) for line in body.splitlines()]
+
+
+def test_prefix_and_connected_filters():
+    assert [name for name, _ in cache_dump.iter_users(USERS, prefix="ALICE")] == ["alice1", "alice2"]
+    assert [name for name, _ in cache_dump.iter_users(USERS, connected=True)] == [
+        "alice1", "bob1", "carol1"]
+    assert list(cache_dump.iter_users(USERS, prefix="dave")) == []
+
+
+def test_cursor_pages_cover_every_user_once():
+    names = []
+    cursor = None
+    while True:
+        page = fastjson.loads(cache_dump.dump_users(USERS, cursor=cursor, limit=2).body)
+        names += list(page["users"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert names == sorted(USERS)
+
+
+def test_cursor_within_prefix():
+    page = fastjson.loads(cache_dump.dump_users(USERS, prefix="b", cursor="bob1", limit=5).body)
+    assert list(page["users"]) == ["bob2"]
+    assert page["next_cursor"] is None
+
+
+def test_ndjson_fields_keep_the_name():
+    response = cache_dump.dump_users(USERS, format="ndjson", fields="customAttributes", limit=2)
+    lines = ndjson(response)
+    assert [line["name"] for line in lines] == ["alice1", "alice2"]
+    assert set(lines[0]) == {"name", "customAttributes"}
+    assert response.headers["x-next-cursor"] == "alice2"
+
+
+def test_fields_filter_json():
+    users = fastjson.loads(cache_dump.dump_users(USERS, prefix="carol", fields="id").body)
+    assert users == {"carol1": {"id": "id-carol1"}}
+
+
+def test_invalid_arguments():
+    with pytest.raises(HTTPException):
+        cache_dump.dump_users(USERS, format="xml")
+    with pytest.raises(HTTPException):
+        cache_dump.dump_users(USERS, limit=0)
@@ -0,0 +1,25 @@
+import shutil
+
+import yaml
+
+import config
+from conftest import ROOT
+
+
+def test_defaults_are_not_written_to_the_config_file():
+    shutil.copy(f"{ROOT}/config.yaml.sample", "operator.yaml")
+    with open("operator.yaml") as fd:
+        raw = yaml.safe_load(fd)
+    raw.pop("event_user_queue")
+    with open("operator.yaml", "w") as fd:
+        yaml.dump(raw, fd)
+
+    cfg = config.get_config("operator.yaml")
+    assert cfg["event_user_queue"] == config.DEFAULTS["event_user_queue"]
+
+    stored = config.read_config("operator.yaml")
+    assert "event_user_queue" not in stored
+    config.save_config_yaml(stored, "operator.yaml")
+    with open("operator.yaml") as fd:
+        assert "event_user_queue" not in yaml.safe_load(fd)
+    config._config_cache.pop("operator.yaml")
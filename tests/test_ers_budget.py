@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+import cisco_ise
+import deadline
+import ers_budget
+import resilience
+
+
+def test_open_breaker_does_not_spend_budget(monkeypatch):
+    spent = []
+    monkeypatch.setattr(ers_budget, "spend", spent.append)
+    breaker = resilience.get_breaker("ise:192.168.1.20")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    assert cisco_ise.ise_api_call("192.168.1.20", "Basic test", "/ers/config/internaluser") is None
+    assert spent == []
+    assert breaker.total_rejected == 1
+
+
+def test_probe_is_released_when_budget_runs_out(monkeypatch):
+    def no_token(method):
+        raise deadline.DeadlineExceeded("No ERS budget token within the deadline")
+
+    monkeypatch.setattr(ers_budget, "spend", no_token)
+    breaker = resilience.get_breaker("ise:192.168.1.20")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at = time.time() - breaker.reset_timeout
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        cisco_ise.ise_api_call("192.168.1.20", "Basic test", "/ers/config/internaluser")
+    # The next call may still probe
+    assert breaker.allow_request()
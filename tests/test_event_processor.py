@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import deadline
+import event_processor
+
+
+def test_events_of_a_user_run_in_order():
+    order = []
+
+    def work(name, delay):
+        time.sleep(delay)
+        order.append(name)
+        return name
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        return await asyncio.gather(
+            processor.submit("User1", work, "first", 0.05),
+            processor.submit("user1", work, "second", 0),
+            processor.submit("USER1", work, "third", 0))
+
+    assert asyncio.run(scenario()) == ["first", "second", "third"]
+    assert order == ["first", "second", "third"]
+
+
+def test_users_do_not_wait_for_each_other():
+    release = threading.Event()
+    order = []
+
+    def slow():
+        release.wait(5)
+        order.append("user1")
+
+    def fast():
+        order.append("user2")
+        release.set()
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        await asyncio.gather(processor.submit("user1", slow), processor.submit("user2", fast))
+        return processor
+
+    processor = asyncio.run(scenario())
+    assert order == ["user2", "user1"]
+    # Chains are dropped once the user has nothing in flight
+    assert processor.snapshot() == {"active_users": 0, "queued": 0, "max_lag": 0, "users": {}}
+
+
+def test_failed_event_does_not_block_the_next():
+    def fail():
+        raise RuntimeError("ISE error")
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        return await asyncio.gather(
+            processor.submit("user1", fail), processor.submit("user1", lambda: "next"),
+            return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == "next"
+
+
+def test_cancelled_waiter_keeps_order_of_later_events():
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "first":
+            release.wait(5)
+        order.append(name)
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        first = asyncio.ensure_future(processor.submit("user1", work, "first"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(processor.submit("user1", work, "second"))
+        third = asyncio.ensure_future(processor.submit("user1", work, "third"))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        release.set()
+        await asyncio.gather(first, third)
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+    asyncio.run(scenario())
+    # The cancelled event is skipped, the third still waits for the first
+    assert order == ["first", "third"]
+
+
+def test_cancelled_running_event_still_blocks_the_next():
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "first":
+            release.wait(5)
+        order.append(name)
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        first = asyncio.ensure_future(processor.submit("user1", work, "first"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        second = asyncio.ensure_future(processor.submit("user1", work, "second"))
+        await asyncio.sleep(0.01)
+        release.set()
+        await second
+
+    asyncio.run(scenario())
+    assert order == ["first", "second"]
+
+
+def test_deadline_exceeded_while_waiting():
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "first":
+            release.wait(5)
+        order.append(name)
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        first = asyncio.ensure_future(processor.submit("user1", work, "first"))
+        await asyncio.sleep(0.01)
+        with deadline.deadline_scope(0.05):
+            with pytest.raises(deadline.DeadlineExceeded):
+                await processor.submit("user1", work, "second")
+        release.set()
+        await first
+        await processor.submit("user1", work, "third")
+
+    asyncio.run(scenario())
+    assert order == ["first", "third"]
+
+
+def test_same_user_ordered_while_other_user_runs_in_parallel():
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "user1-first":
+            # Only released by the other user, so it has to run meanwhile
+            assert release.wait(5)
+        order.append(name)
+
+    def other():
+        order.append("user2")
+        release.set()
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        first = asyncio.ensure_future(processor.submit("user1", work, "user1-first"))
+        second = asyncio.ensure_future(processor.submit("user1", work, "user1-second"))
+        await asyncio.sleep(0.01)
+        await processor.submit("user2", other)
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+    assert order == ["user2", "user1-first", "user1-second"]
+
+
+def test_full_chain_is_rejected_and_reported(workdir, monkeypatch):
+    monkeypatch.setitem(workdir, "event_user_queue", 2)
+    release = threading.Event()
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        items = [asyncio.ensure_future(processor.submit("user1", release.wait, 5))
+                 for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(event_processor.Overloaded) as e:
+            await processor.submit("User1", release.wait, 5)
+        snapshot = processor.snapshot()
+        # Other users are not affected
+        assert await processor.submit("user2", lambda: "ok") == "ok"
+        release.set()
+        await asyncio.gather(*items)
+        return e.value, snapshot
+
+    error, snapshot = asyncio.run(scenario())
+    assert error.key == "user1" and error.retry_after >= 1
+    assert snapshot["active_users"] == 1 and snapshot["queued"] == 1
+    assert snapshot["users"]["user1"]["depth"] == 2
+    assert snapshot["users"]["user1"]["lag"] > 0
+
+
+def test_run_from_thread_waits_for_the_users_chain():
+    release = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "event":
+            release.wait(5)
+        order.append(name)
+
+    async def scenario():
+        processor = event_processor.UserSerializer()
+        processor.start()
+        event = asyncio.ensure_future(processor.submit("user1", work, "event"))
+        await asyncio.sleep(0.01)
+        sync = asyncio.ensure_future(asyncio.to_thread(processor.run, "user1", work, "sync"))
+        await asyncio.sleep(0.05)
+        assert order == []
+        release.set()
+        await asyncio.gather(event, sync)
+
+    asyncio.run(scenario())
+    assert order == ["event", "sync"]
+
+
+def test_run_without_loop_runs_directly():
+    processor = event_processor.UserSerializer()
+    assert processor.run("user1", lambda x: x * 2, 21) == 42
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+import gp_events
+import pan_fw
+import session_log
+
+LOGIN = ("<14>1 2026-10-19T10:00:00Z fw1 - - - - eventid=gateway-connected "
+         "user=CORP\\User1 machine=\"HOST 1\" os=Windows public_ip=1.2.3.4 "
+         "region=US client_ver=6.1.0 status=success")
+
+
+@pytest.fixture
+def fw_cache(monkeypatch):
+    monkeypatch.setattr(pan_fw, "fw_data", {})
+    monkeypatch.setattr(pan_fw, "fw_data_loaded", False)
+    monkeypatch.setattr(session_log, "records", 0)
+    pan_fw.init_fw_cache()
+    return pan_fw.fw_data
+
+
+def sessions_of(username):
+    return pan_fw.fw_data["fw_gp_sessions"].get(username, [])
+
+
+def test_parse_http_record_with_aliases():
+    event = gp_events.parse_gp_event({"EventID": "gateway-connected", "srcuser": "user1@corp.example",
+                                      "machinename": "HOST1", "public-ip": "1.2.3.4"})
+    assert event["user"] == "user1"
+    assert (event["machine"], event["public_ip"]) == ("HOST1", "1.2.3.4")
+
+
+def test_parse_ignores_other_events():
+    assert gp_events.parse_gp_event({"eventid": "portal-auth", "user": "user1"}) is None
+    assert gp_events.parse_gp_event({"eventid": "gateway-connected"}) is None
+    assert gp_events.parse_syslog_message("<14>1 unrelated message") is None
+
+
+def test_parse_syslog_key_value_and_json():
+    event = gp_events.parse_syslog_message(LOGIN)
+    assert event["user"] == "user1"
+    assert event["machine"] == "HOST 1"
+    assert event["client_ver"] == "6.1.0"
+
+    json_event = gp_events.parse_syslog_message(
+        '<14>Oct 19 10:00:00 fw1 {"eventid": "gateway-logout", "user": "user2"}')
+    assert (json_event["eventid"], json_event["user"]) == ("gateway-logout", "user2")
+
+
+def test_apply_login_and_logout(fw_cache):
+    login = gp_events.parse_syslog_message(LOGIN)
+    assert gp_events.apply_gp_event(login, "192.168.1.10") == "connected"
+    # A repeated login from the same device replaces the session
+    assert gp_events.apply_gp_event(login, "192.168.1.10") == "connected"
+    assert [s["Client-Hostname"] for s in sessions_of("user1")] == ["HOST 1"]
+
+    second = dict(login, machine="HOST2", public_ip="5.6.7.8")
+    gp_events.apply_gp_event(second, "192.168.1.10")
+    assert len(sessions_of("user1")) == 2
+
+    logout = {"eventid": "gateway-logout", "user": "user1", "machine": "host 1"}
+    assert gp_events.apply_gp_event(logout, "192.168.1.10") == "disconnected"
+    assert [s["Client-Hostname"] for s in sessions_of("user1")] == ["HOST2"]
+
+    # A logout without device details ends all sessions of the user
+    assert gp_events.apply_gp_event({"eventid": "gateway-logout", "user": "user1"}) == "disconnected"
+    assert sessions_of("user1") == []
+
+
+def test_failed_login_is_ignored(fw_cache):
+    event = dict(gp_events.parse_syslog_message(LOGIN), status="failure")
+    assert gp_events.apply_gp_event(event) == "ignored"
+    assert sessions_of("user1") == []
+
+
+def test_ingest_records_counts(fw_cache):
+    counts = gp_events.ingest_records([
+        {"eventid": "gateway-connected", "user": "user1", "machine": "HOST1"},
+        {"eventid": "gateway-logout", "user": "user2"},
+        {"eventid": "portal-auth", "user": "user3"},
+        "not a record",
+    ])
+    assert counts == {"connected": 1, "disconnected": 1, "ignored": 2}
+
+
+class Writer:
+    def __init__(self):
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ("192.168.1.10", 6514)
+
+    def close(self):
+        self.closed = True
+
+
+def receive_tcp(monkeypatch, data: bytes) -> list:
+    received = []
+    monkeypatch.setattr(gp_events, "queue_syslog_line",
+                        lambda line, source_ip: received.append(line))
+
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        writer = Writer()
+        await gp_events.handle_syslog_tcp(reader, writer)
+        assert writer.closed
+
+    asyncio.run(scenario())
+    return received
+
+
+def test_tcp_octet_counted_frames(monkeypatch):
+    first = LOGIN.encode()
+    # Octet counted messages may contain newlines
+    second = b"<14>1 eventid=gateway-logout\nuser=user2"
+    data = b"%d %s%d %s" % (len(first), first, len(second), second)
+
+    received = receive_tcp(monkeypatch, data)
+    assert received == [LOGIN, second.decode()]
+    assert gp_events.parse_syslog_message(received[1])["user"] == "user2"
+
+
+def test_tcp_newline_frames(monkeypatch):
+    data = b"<14>1 eventid=gateway-logout user=user1\n\n<14>1 eventid=gateway-logout user=user2\n"
+    assert [line.strip() for line in receive_tcp(monkeypatch, data)] == [
+        "<14>1 eventid=gateway-logout user=user1", "<14>1 eventid=gateway-logout user=user2"]
+
+
+def test_tcp_bad_octet_count_closes_connection(monkeypatch):
+    data = b"%d <14>1 user=user1" % (gp_events.SYSLOG_MAX_FRAME + 1)
+    assert receive_tcp(monkeypatch, data) == []
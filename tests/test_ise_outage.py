@@ -0,0 +1,82 @@
+import requests
+
+import apiserver
+import cisco_ise
+import write_queue
+
+USER = {"id": "id1", "name": "user1", "customAttributes": {
+    "PaloAlto-GlobalProtect-Client-Version": "N-A"}}
+ATTRIBUTES = {"PaloAlto-Client-Hostname": "HOST1",
+              "PaloAlto-GlobalProtect-Client-Version": "6.0.1"}
+
+
+def unreachable(*args, **kwargs):
+    raise requests.exceptions.ConnectionError("ISE down")
+
+
+def test_update_is_queued_when_active_pan_lookup_fails(monkeypatch):
+    monkeypatch.setattr(requests, "request", unreachable)
+    monkeypatch.setattr(cisco_ise, "all_users", cisco_ise.StripedDict({"user1": USER}))
+    monkeypatch.setattr(cisco_ise, "all_users_loaded", True)
+    # ISE down for longer than the active PAN cache
+    monkeypatch.setattr(cisco_ise, "ha_device_last_update", 0)
+    monkeypatch.setattr(cisco_ise, "ise_active", "192.168.1.21")
+    monkeypatch.setattr(apiserver, "ise_token", "Basic test")
+
+    result = apiserver.connect_user({"InternalUser": {"name": "user1", "customAttributes": ATTRIBUTES}})
+
+    assert result == {"message": "ISE unreachable. Update queued for replay."}
+    assert write_queue.is_pending("user1")
+
+
+def test_last_known_pan_falls_back_to_config(monkeypatch):
+    monkeypatch.setattr(requests, "request", unreachable)
+    monkeypatch.setattr(cisco_ise, "ha_device_last_update", 0)
+    monkeypatch.setattr(cisco_ise, "ise_active", None)
+
+    assert cisco_ise.ise_get_pan_last_known("Basic test") == "192.168.1.20"
+
+
+class Response:
+    def __init__(self, status_code, body=b"{}"):
+        self.status_code = status_code
+        self.content = body
+        self.text = body.decode()
+
+
+def stale_id_then(lookup):
+    """
+    ISE answers the PUT with 404 (stale cached id), then the by-name lookup with lookup().
+    """
+    def request(method, url, **kwargs):
+        if method == "PUT":
+            return Response(404)
+        return lookup()
+    return request
+
+
+def cache_user1(monkeypatch):
+    monkeypatch.setattr(cisco_ise, "all_users", cisco_ise.StripedDict({"user1": USER}))
+    monkeypatch.setattr(cisco_ise, "all_users_loaded", True)
+    monkeypatch.setattr(cisco_ise, "unknown_users", cisco_ise.TTLCache(maxsize=100, ttl=300))
+
+
+def test_stale_id_refetch_during_outage_queues_update(monkeypatch):
+    cache_user1(monkeypatch)
+    monkeypatch.setattr(requests, "request", stale_id_then(lambda: unreachable()))
+
+    assert cisco_ise.ise_update_user("192.168.1.20", "Basic test", "user1", ATTRIBUTES) is None
+    assert write_queue.is_pending("user1")
+    # The cached record is kept and the user is not marked unknown
+    assert cisco_ise.all_users["user1"] == USER
+    assert not cisco_ise.unknown_users.get("user1")
+
+
+def test_stale_id_of_deleted_user_evicts_it(monkeypatch):
+    cache_user1(monkeypatch)
+    monkeypatch.setattr(requests, "request", stale_id_then(lambda: Response(404)))
+
+    assert cisco_ise.ise_update_user("192.168.1.20", "Basic test", "user1", ATTRIBUTES) is False
+    assert not write_queue.is_pending("user1")
+    assert "user1" not in cisco_ise.all_users
+    assert cisco_ise.unknown_users.get("user1")
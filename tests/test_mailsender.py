@@ -0,0 +1,86 @@
+import pytest
+
+import mailsender
+
+
+@pytest.fixture
+def mails(workdir, monkeypatch):
+    """
+    Records the mails sent instead of talking to an SMTP server.
+    """
+    sent = []
+    clock = [1_800_000_000.0]
+    monkeypatch.setattr(mailsender, "pending_alerts", {})
+    monkeypatch.setattr(mailsender, "last_alerted", {})
+    monkeypatch.setattr(mailsender, "alerts_sent_in_interval", 0)
+    monkeypatch.setattr(mailsender.time, "time", lambda: clock[0])
+    monkeypatch.setattr(mailsender, "send_config_mail",
+                        lambda config, subject, body: sent.append((subject, body)) or True)
+    workdir.update({"mail_suppress_window": 900, "mail_max_per_interval": 3})
+    return workdir, sent, clock
+
+
+def attempt(username, hostname="HOST2", ip="5.6.7.8"):
+    session = {"PaloAlto-Client-Hostname": hostname, "PaloAlto-Client-OS": "Mac",
+               "PaloAlto-Client-Source-IP": ip, "PaloAlto-Client-Region": "AE"}
+    return {"username": username, "date": "Oct.19.2026", "time": "10:00:00",
+            "oldsession": dict(session, **{"PaloAlto-Client-Hostname": "HOST1"}),
+            "newsession": session}
+
+
+def test_repeats_within_window_go_to_the_digest(mails):
+    config, sent, clock = mails
+    assert mailsender.notify_duplicate(config, attempt("user1"))
+    clock[0] += 60
+    assert not mailsender.notify_duplicate(config, attempt("user1", "HOST3", "9.9.9.9"))
+    clock[0] += 60
+    assert not mailsender.notify_duplicate(config, attempt("user1"))
+
+    assert len(sent) == 1
+    alert = mailsender.pending_alerts["user1"]
+    assert alert["count"] == 2
+    assert alert["hostnames"] == {"HOST2", "HOST3"}
+    assert alert["last"] - alert["first"] == 60
+
+    # After the window the user is alerted immediately again
+    clock[0] += 900
+    assert mailsender.notify_duplicate(config, attempt("user1"))
+
+
+def test_cap_per_interval(mails):
+    config, sent, clock = mails
+    results = [mailsender.notify_duplicate(config, attempt(f"user{i}")) for i in range(5)]
+
+    assert results == [True, True, True, False, False]
+    assert sorted(mailsender.pending_alerts) == ["user3", "user4"]
+
+
+def test_flush_digest_sends_one_mail_and_resets(mails):
+    config, sent, clock = mails
+    start = clock[0]
+    for i in range(5):
+        mailsender.notify_duplicate(config, attempt(f"user{i}"))
+    mailsender.notify_duplicate(config, attempt("user0"))
+    clock[0] += 3600
+
+    assert mailsender.flush_digest(config, start)
+    subject, body = sent[-1]
+    assert subject == "GP Duplicate Login Attempts Digest - 3 Users"
+    assert "3 further duplicate login attempts by 3 users" in body
+    assert mailsender.pending_alerts == {}
+    # Cap reset and expired suppression windows forgotten
+    assert mailsender.alerts_sent_in_interval == 0
+    assert mailsender.last_alerted == {}
+    assert mailsender.notify_duplicate(config, attempt("user0"))
+
+    # Nothing suppressed since, no digest
+    assert not mailsender.flush_digest(config, clock[0])
+
+
+def test_digest_escapes_user_input(mails):
+    config, sent, clock = mails
+    mailsender.notify_duplicate(config, attempt("user1"))
+    mailsender.notify_duplicate(config, attempt("user1", "<script>"))
+    mailsender.flush_digest(config, clock[0])
+
+    assert "<script>" not in sent[-1][1] and "&lt;script&gt;" in sent[-1][1]
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+import cisco_ise
+import prewarm
+
+
+def local(day, hour, minute):
+    return time.mktime((2026, 10, day, hour, minute, 0, 0, 0, -1))
+
+
+@pytest.fixture
+def windows(workdir, monkeypatch):
+    for name in ("login_counts", "top_slot", "last_login", "prewarmed_on"):
+        monkeypatch.setattr(prewarm, name, {})
+    workdir.update({"prewarm_min_logins": 3, "prewarm_lead": 600,
+                    "prewarm_rate": 5, "prewarm_max_per_run": 1000})
+    return workdir
+
+
+def test_usual_login_slot(windows):
+    for day in range(1, 5):
+        prewarm.record_login("User1", local(day, 8, 5 + day))
+    prewarm.record_login("user1", local(5, 13, 0))
+    # The same session reported again is not counted twice
+    prewarm.record_login("user1", local(5, 13, 0))
+
+    assert prewarm.login_window("user1") == prewarm.slot_of(local(1, 8, 0)) == 32
+    assert prewarm.login_counts["user1"][prewarm.slot_of(local(5, 13, 0))] == 1
+
+
+def test_no_window_without_enough_logins(windows):
+    prewarm.record_login("user1", local(1, 8, 0))
+    prewarm.record_login("user1", local(2, 8, 0))
+    assert prewarm.login_window("user1") is None
+    assert prewarm.due_users(local(3, 7, 55)) == []
+
+
+def test_due_users_lead_and_cap(windows):
+    for i in range(3):
+        for day in range(1, 4):
+            prewarm.record_login(f"user{i}", local(day, 8, i))
+    prewarm.record_login("late", local(1, 9, 0))
+
+    # 08:00 is within the 10 minute lead at 07:52, not at 07:45
+    assert prewarm.due_users(local(10, 7, 45)) == []
+    assert sorted(prewarm.due_users(local(10, 7, 52))) == ["user0", "user1", "user2"]
+    windows["prewarm_max_per_run"] = 2
+    assert len(prewarm.due_users(local(10, 7, 52))) == 2
+
+
+def test_run_once_is_rate_limited_and_once_a_day(windows, monkeypatch):
+    for i in range(3):
+        for day in range(1, 4):
+            prewarm.record_login(f"user{i}", local(day, 8, i))
+    refreshed = []
+    sleeps = []
+    monkeypatch.setattr(cisco_ise, "ise_prewarm_user",
+                        lambda ip, auth, username: refreshed.append(username) or username != "user1")
+    monkeypatch.setattr(prewarm.time, "sleep", sleeps.append)
+    now = local(10, 7, 52)
+
+    assert prewarm.run_once("192.168.1.20", "Basic test", now) == 2
+    assert sorted(refreshed) == ["user0", "user1", "user2"]
+    # prewarm_rate 5/s: each fetch is padded to 0.2 s
+    assert len(sleeps) == 3 and all(0.15 < s <= 0.2 for s in sleeps)
+
+    # Already pre-warmed today, also the user whose refresh failed
+    assert prewarm.run_once("192.168.1.20", "Basic test", now + 60) == 0
+    assert len(refreshed) == 3
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+import deadline
+import resilience
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = resilience.CircuitBreaker("ise:test", failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.is_open() and not breaker.allow_request()
+
+    breaker.opened_at = time.time() - 30
+    assert breaker.state == resilience.HALF_OPEN
+    assert breaker.allow_request()
+    # Only one probe at a time
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == resilience.CLOSED and breaker.failures == 0
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = resilience.CircuitBreaker("ise:test", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.opened_at = time.time() - 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert breaker.snapshot()["total_rejected"] == 0
+
+
+def test_retry_call_retries_until_accepted(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    results = iter([None, 503, 200])
+
+    assert resilience.retry_call(lambda: next(results), attempts=3,
+                                 retry_if=lambda r: r is None or r >= 500) == 200
+
+
+def test_retry_call_raises_last_exception(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ConnectionError(f"attempt {len(calls)}")
+
+    with pytest.raises(ConnectionError, match="attempt 3"):
+        resilience.retry_call(fail, attempts=3)
+    assert len(calls) == 3
+
+
+def test_retry_call_stops_when_breaker_opens(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    breaker = resilience.CircuitBreaker("ise:test", failure_threshold=1)
+
+    def fail():
+        breaker.record_failure()
+        return None
+
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.retry_call(fail, attempts=3, retry_if=lambda r: r is None, breaker=breaker)
+    assert breaker.total_failures == 1
+
+
+def test_retry_call_does_not_sleep_past_deadline():
+    with deadline.deadline_scope(0.05):
+        with pytest.raises(deadline.DeadlineExceeded):
+            resilience.retry_call(lambda: None, attempts=5, base_delay=1, max_delay=1,
+                                  retry_if=lambda r: True)
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= resilience.backoff_delay(attempt, base_delay=0.5, max_delay=5) <= 5
@@ -0,0 +1,80 @@
+import pytest
+
+import pan_fw
+import session_log
+
+
+def session(username, ip="1.2.3.4"):
+    return [{"Username": username, "Client-Hostname": "HOST1", "Client-OS": "Windows",
+             "Client-Source-IP": ip, "Gateway": "gw1",
+             "Raw-Data": {"source-region": "US", "login-time-utc": "1700000000"}}]
+
+
+@pytest.fixture
+def fw_cache(monkeypatch):
+    monkeypatch.setattr(pan_fw, "fw_data", {})
+    monkeypatch.setattr(pan_fw, "fw_data_loaded", False)
+    monkeypatch.setattr(session_log, "records", 0)
+    pan_fw.init_fw_cache()
+    pan_fw.fw_data["fw_key"] = "KEY"
+    return pan_fw.fw_data
+
+
+def reload():
+    pan_fw.fw_data_loaded = False
+    pan_fw.init_fw_cache()
+    return pan_fw.fw_data["gateways"]["gw1"]["fw_gp_sessions"].snapshot()
+
+
+def test_unchanged_sessions_are_not_logged(fw_cache):
+    for _ in range(5):
+        pan_fw.set_user_sessions("gw1", "user1", session("user1"))
+    pan_fw.set_user_sessions("gw1", "user2", [])
+
+    assert session_log.records == 1
+
+
+def test_compaction_keeps_changes_logged_after_the_mark(fw_cache):
+    pan_fw.set_user_sessions("gw1", "user1", session("user1"))
+    with pan_fw.fw_data_lock:
+        data = pan_fw.snapshot_fw_cache()
+        mark = session_log.mark()
+    # Logged while the snapshot is being written
+    pan_fw.set_user_sessions("gw1", "user2", session("user2"))
+    assert pan_fw.save_fw_cache(data)
+    session_log.truncate(mark)
+
+    assert session_log.records == 1
+    assert reload() == {"user1": session("user1"), "user2": session("user2")}
+
+
+def test_compact_sessions_writes_due_snapshot(fw_cache):
+    pan_fw.set_user_sessions("gw1", "user1", session("user1"))
+
+    # No snapshot yet, so one is due
+    assert pan_fw.compact_sessions()
+    assert session_log.records == 0
+    assert not pan_fw.compact_sessions()
+    assert reload() == {"user1": session("user1")}
+
+
+def test_replay_cuts_torn_tail():
+    session_log.records = 0
+    session_log.append("gw1", {"user1": session("user1")}, 100.0)
+    session_log.append("gw1", {"user2": session("user2"), "user1": None}, 200.0)
+    good = session_log.mark()[0]
+    session_log.append("gw1", {"user3": session("user3")}, 300.0)
+    # Crash while appending the last record
+    with open(session_log.LOG_PATH, "r+b") as fd:
+        fd.truncate(good + (session_log.mark()[0] - good) // 2)
+    fw_data = {"gateways": {"gw1": {"fw_gp_sessions": {"user0": session("user0")},
+                                    "fw_gp_sessions_timestamp": 50.0}}}
+
+    assert session_log.replay(fw_data) == 2
+    gw_cache = fw_data["gateways"]["gw1"]
+    assert gw_cache["fw_gp_sessions"] == {"user0": session("user0"), "user2": session("user2")}
+    assert gw_cache["fw_gp_sessions_timestamp"] == 200.0
+    assert session_log.mark() == (good, 2)
+    # New records continue after the last good one
+    session_log.append("gw1", {"user4": session("user4")})
+    assert session_log.replay({}) == 3
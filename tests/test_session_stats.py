@@ -0,0 +1,15 @@
+import session_stats
+
+
+def test_last_hour_counts_with_short_history(workdir, monkeypatch):
+    monkeypatch.setitem(workdir, "stats_history_minutes", 10)
+    monkeypatch.setattr(session_stats, "history", {})
+    monkeypatch.setattr(session_stats, "duplicate_attempts_hour", session_stats.MinuteRing(60))
+    now = 1_800_000_000.0
+    for minutes_ago in (61, 59, 30, 0):
+        session_stats.record_duplicate_attempt(now - minutes_ago * 60)
+
+    stats = session_stats.snapshot(now)
+    assert stats["duplicate_attempts_last_hour"] == 3
+    assert stats["history_minutes"] == 10
+    assert sum(stats["history"]["duplicate_attempts"]) == 1
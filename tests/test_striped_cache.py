@@ -0,0 +1,61 @@
+import pickle
+import threading
+
+from striped_cache import StripedDict
+
+
+def test_mapping_operations():
+    d = StripedDict({"a": 1}, stripes=4)
+    d["b"] = 2
+    assert d["a"] == 1 and d.get("c") is None and "b" in d
+    assert d.setdefault("b", 3) == 2 and d.setdefault("c", 3) == 3
+    assert d.pop("c") == 3 and d.pop("c", None) is None
+    del d["a"]
+    assert dict(d) == {"b": 2} and len(d) == 1
+    d.clear()
+    assert len(d) == 0 and list(d) == []
+
+
+def test_update_entry_is_atomic():
+    d = StripedDict(stripes=2)
+
+    def increment():
+        for _ in range(2000):
+            d.update_entry("counter", lambda value: (value or 0) + 1)
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert d["counter"] == 16000
+
+
+def test_iteration_while_writers_change_the_keys():
+    d = StripedDict({i: i for i in range(1000)})
+    stop = threading.Event()
+
+    def writer():
+        i = 1000
+        while not stop.is_set():
+            d[i] = i
+            d.pop(i - 1000, None)
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(200):
+            # Snapshot iteration never raises "dictionary changed size during iteration"
+            assert sum(1 for _ in d.items()) > 0
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_pickle_round_trip():
+    d = StripedDict({"user1": {"id": "1"}}, stripes=8)
+    copy = pickle.loads(pickle.dumps(d))
+    assert isinstance(copy, StripedDict)
+    assert copy.snapshot() == {"user1": {"id": "1"}}
+    assert len(copy._stripes) == 8
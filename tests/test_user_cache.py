@@ -0,0 +1,129 @@
+import os
+import time
+
+import requests
+
+import cisco_ise
+import fastjson
+import ttl_cache
+
+
+def fresh_user(name):
+    return {"id": f"id-{name}", "name": name, "timestamp": time.time(),
+            "customAttributes": {"PaloAlto-GlobalProtect-Client-Version": "N-A"}}
+
+
+def cache_users(monkeypatch, users):
+    monkeypatch.setattr(cisco_ise, "all_users", cisco_ise.StripedDict(users))
+    monkeypatch.setattr(cisco_ise, "all_users_loaded", True)
+    monkeypatch.setattr(cisco_ise, "unknown_users", cisco_ise.TTLCache(maxsize=100, ttl=300))
+    monkeypatch.setattr(cisco_ise, "users_dirty", False)
+
+
+def test_enrich_marks_cache_dirty_instead_of_saving(monkeypatch):
+    cache_users(monkeypatch, {"user1": fresh_user("user1")})
+
+    assert cisco_ise.ise_enrich_user("192.168.1.20", "Basic test", "User1")["id"] == "id-user1"
+    assert not os.path.exists("data/users.pickle")
+    assert cisco_ise.users_dirty
+
+    assert cisco_ise.flush_user_data()
+    assert cisco_ise.load_user_data().keys() == {"user1"}
+    # Nothing changed since
+    assert not cisco_ise.flush_user_data()
+
+
+def test_unknown_user_expires_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: clock[0])
+    unknown = cisco_ise.TTLCache(maxsize=10, ttl=300)
+    unknown.set("ghost", True)
+
+    clock[0] += 299
+    assert unknown.get("ghost")
+    clock[0] += 2
+    assert unknown.get("ghost") is None
+    assert "ghost" not in unknown and len(unknown) == 0
+
+
+def test_unknown_users_evict_least_recently_used():
+    unknown = cisco_ise.TTLCache(maxsize=2, ttl=300)
+    unknown.set("ghost1", True)
+    unknown.set("ghost2", True)
+    # Using ghost1 makes ghost2 the eviction candidate
+    assert unknown.get("ghost1")
+    unknown.set("ghost3", True)
+
+    assert "ghost1" in unknown and "ghost3" in unknown and "ghost2" not in unknown
+    assert unknown.stats()["evictions"] == 1
+
+
+def test_known_unknown_user_is_not_looked_up(monkeypatch):
+    cache_users(monkeypatch, {})
+    cisco_ise.unknown_users.set("ghost", True)
+
+    def no_call(*args, **kwargs):
+        raise AssertionError("ISE must not be called")
+
+    monkeypatch.setattr(cisco_ise, "ise_api_call", no_call)
+    assert cisco_ise.ise_enrich_user("192.168.1.20", "Basic test", "Ghost") is None
+
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.content = fastjson.dumpb(body or {})
+        self.text = self.content.decode()
+
+
+def ise_answers(monkeypatch, response):
+    urls = []
+
+    def request(method, url, **kwargs):
+        urls.append(url)
+        return response
+    monkeypatch.setattr(requests, "request", request)
+    return urls
+
+
+def test_get_user_by_name_found(monkeypatch):
+    cache_users(monkeypatch, {})
+    cisco_ise.unknown_users.set("user1", True)
+    urls = ise_answers(monkeypatch, Response(200, {"InternalUser": {"id": "id1", "name": "User1"}}))
+
+    user = cisco_ise.ise_get_user_by_name("192.168.1.20", "Basic test", "User1")
+
+    assert urls == ["https://192.168.1.20:9060/ers/config/internaluser/name/user1"]
+    assert user["name"] == "user1" and "timestamp" in user
+    assert cisco_ise.all_users["user1"] is user
+    assert not cisco_ise.unknown_users.get("user1")
+
+
+def test_get_user_by_name_not_found(monkeypatch):
+    cache_users(monkeypatch, {})
+    ise_answers(monkeypatch, Response(404))
+
+    assert cisco_ise.ise_get_user_by_name("192.168.1.20", "Basic test", "ghost") is None
+    assert cisco_ise.unknown_users.get("ghost")
+    assert "ghost" not in cisco_ise.all_users
+
+
+def test_get_user_by_name_ise_error_is_not_a_miss(monkeypatch):
+    cache_users(monkeypatch, {})
+    ise_answers(monkeypatch, Response(503))
+
+    assert cisco_ise.ise_get_user_by_name("192.168.1.20", "Basic test", "user1") is None
+    assert not cisco_ise.unknown_users.get("user1")
+
+
+def test_enrich_looks_up_cache_miss_by_name(monkeypatch):
+    cache_users(monkeypatch, {})
+    record = {"id": "id1", "name": "user1",
+              "customAttributes": {"PaloAlto-GlobalProtect-Client-Version": "N-A"}}
+    urls = ise_answers(monkeypatch, Response(200, {"InternalUser": record}))
+
+    user = cisco_ise.ise_enrich_user("192.168.1.20", "Basic test", "user1")
+
+    assert user["id"] == "id1"
+    # The by-name record is complete and fresh: one call, no full list walk
+    assert [url.rsplit("/ers/config/", 1)[1] for url in urls] == ["internaluser/name/user1"]
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import webhook_dedup
+from ttl_cache import TTLCache
+
+DATA = {"InternalUser": {"name": "User1", "customAttributes": {"PaloAlto-Client-Hostname": "HOST1"}}}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(webhook_dedup, "cache", TTLCache(maxsize=100, ttl=30))
+
+
+def test_repeat_in_flight_waits_for_first_delivery():
+    key = webhook_dedup.delivery_key("connected", DATA)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": len(calls)}
+
+    async def scenario():
+        return await asyncio.gather(*(webhook_dedup.deduplicate(key, process) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == [{"ok": 1}] * 3
+    assert calls == [1]
+    assert webhook_dedup.lookup(key) == {"ok": 1}
+
+
+def test_repeat_reprocesses_after_failed_delivery():
+    key = webhook_dedup.delivery_key("connected", DATA)
+    calls = []
+
+    async def process():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("ISE error")
+        return {"ok": len(calls)}
+
+    async def scenario():
+        return await asyncio.gather(
+            webhook_dedup.deduplicate(key, process), webhook_dedup.deduplicate(key, process),
+            return_exceptions=True)
+
+    first, repeat = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert repeat == {"ok": 2}
+    assert not webhook_dedup.in_flight
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import event_processor
+import write_queue
+from config import get_config
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def pending_rows():
+    return write_queue.get_db().execute(
+        "SELECT username, attributes, attempts FROM pending ORDER BY seq").fetchall()
+
+
+def test_queue_keeps_latest_update_per_user():
+    write_queue.enqueue("User1", {"version": "1"})
+    write_queue.enqueue("user1", {"version": "2"})
+    write_queue.enqueue("user2", {"version": "1"})
+
+    assert [(u, a) for u, a, _ in pending_rows()] == [
+        ("user1", '{"version":"2"}'), ("user2", '{"version":"1"}')]
+    assert write_queue.stats()["pending"] == 2
+
+
+def test_discard_after_direct_write():
+    write_queue.enqueue("user1", {"version": "1"})
+    write_queue.discard("USER1")
+    write_queue.discard("user2")
+
+    assert not write_queue.is_pending("user1")
+    assert not write_queue.has_pending()
+    assert pending_rows() == []
+
+
+def test_replay_outcomes():
+    for user in ("ok", "rejected", "missing"):
+        write_queue.enqueue(user, {"user": user})
+    responses = {"ok": Response(200), "rejected": Response(400), "missing": False}
+
+    counts = asyncio.run(write_queue.replay(lambda username, attributes: responses[username]))
+
+    assert counts == {"replayed": 1, "dropped": 2, "failed": 0, "superseded": 0, "deferred": 0}
+    assert not write_queue.has_pending()
+
+
+def test_failed_replay_is_retried_then_dropped():
+    get_config()["write_queue_max_attempts"] = 2
+    write_queue.enqueue("user1", {"version": "1"})
+
+    def unreachable(username, attributes):
+        return None
+
+    assert asyncio.run(write_queue.replay(unreachable))["failed"] == 1
+    assert pending_rows() == [("user1", '{"version":"1"}', 1)]
+    assert asyncio.run(write_queue.replay(unreachable))["dropped"] == 1
+    assert not write_queue.is_pending("user1")
+
+
+def test_replay_stops_after_a_failed_batch():
+    get_config()["write_queue_batch"] = 1
+    write_queue.enqueue("user1", {})
+    write_queue.enqueue("user2", {})
+    calls = []
+
+    def server_error(username, attributes):
+        calls.append(username)
+        return Response(503)
+
+    counts = asyncio.run(write_queue.replay(server_error))
+
+    assert calls == ["user1"]
+    assert counts["failed"] == 1
+    assert write_queue.is_pending("user2")
+
+
+def test_replay_waits_for_newer_event_of_user():
+    write_queue.enqueue("user1", {"version": "old"})
+    written = []
+    webhook_running = threading.Event()
+    release = threading.Event()
+
+    def webhook():
+        # A newer update of the user, written directly while the replay runs
+        webhook_running.set()
+        release.wait(5)
+        written.append("new")
+        write_queue.discard("user1")
+
+    def update(username, attributes):
+        written.append(attributes["version"])
+        return Response(200)
+
+    async def scenario():
+        newer = asyncio.ensure_future(event_processor.submit("user1", webhook))
+        await asyncio.to_thread(webhook_running.wait, 5)
+        replay = asyncio.ensure_future(write_queue.replay(update))
+        await asyncio.sleep(0.05)
+        release.set()
+        await newer
+        return await replay
+
+    counts = asyncio.run(scenario())
+
+    assert written == ["new"]
+    assert counts["superseded"] == 1
+    assert not write_queue.is_pending("user1")
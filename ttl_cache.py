@@ -0,0 +1,75 @@
+"""
+Bounded, thread-safe LRU cache with per-entry time to live.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU cache holding at most maxsize entries, each expiring ttl seconds after it was set.
+
+    Parameters:
+    - maxsize (int): Maximum number of entries, the least recently used is evicted first.
+    - ttl (float): Entry lifetime in seconds.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the live value for key (and marks it recently used), or default.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() +
+                               (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[1] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
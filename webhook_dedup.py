@@ -0,0 +1,118 @@
+"""
+Short-TTL de-duplication of repeated webhook deliveries.
+
+ISE retries /connected and /disconnected deliveries on timeout, so the same body
+often arrives several times within seconds. Each delivery is hashed (endpoint,
+username, attribute payload and the delivery ID if one is sent) and the result
+of the first delivery is returned for repeats without any upstream calls. A
+repeat arriving while the first delivery is still processed waits for its result.
+
+Only the latest delivery per user is remembered, so a different event for the
+user (e.g. a disconnect between two identical connects) is never de-duplicated
+and memory is bounded by webhook_dedup_size users.
+"""
+import asyncio
+import hashlib
+import json
+
+import metrics
+from config import get_config
+from logger import logger
+from ttl_cache import TTLCache
+
+# Request headers / body fields carrying a delivery ID
+DELIVERY_ID_HEADERS = ("x-delivery-id", "x-request-id", "x-idempotency-key")
+DELIVERY_ID_FIELDS = ("deliveryId", "delivery_id")
+
+# Sized and timed by webhook_dedup_size / webhook_dedup_ttl when a result is remembered
+cache = TTLCache()
+metrics.register_gauge("webhook_dedup.size", lambda: len(cache))
+# Deliveries being processed, by key. The future's result is (processed, result).
+in_flight = {}
+
+
+def delivery_key(endpoint: str, data: dict, headers=None) -> tuple:
+    """
+    Returns (username, digest) identifying a webhook delivery.
+    """
+    delivery_id = None
+    for header in DELIVERY_ID_HEADERS:
+        if headers is not None and headers.get(header):
+            delivery_id = headers.get(header)
+            break
+    for field in DELIVERY_ID_FIELDS:
+        if delivery_id is None and data.get(field):
+            delivery_id = data[field]
+    username = data['InternalUser']['name'].lower()
+    payload = json.dumps({
+        "endpoint": endpoint,
+        "username": username,
+        "attributes": data['InternalUser'].get('customAttributes'),
+        "delivery_id": delivery_id,
+    }, sort_keys=True, default=str)
+    return username, hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(key: tuple):
+    """
+    Returns the stored result if key is a repeat of the user's last delivery, else None.
+    """
+    username, digest = key
+    entry = cache.get(username)
+    if entry is not None and entry[0] == digest:
+        metrics.incr("webhook_dedup.hits")
+        return entry[1]
+    metrics.incr("webhook_dedup.misses")
+    return None
+
+
+def remember(key: tuple, result):
+    """
+    Stores the result of a processed delivery (replacing the user's previous one).
+    """
+    username, digest = key
+    if result is not None:
+        config = get_config()
+        cache.maxsize = config['webhook_dedup_size']
+        cache.set(username, (digest, result), ttl=config['webhook_dedup_ttl'])
+    else:
+        cache.pop(username)
+
+
+async def deduplicate(key: tuple, process):
+    """
+    Processes a delivery once: returns the stored result of a repeat, waits for the
+    first delivery if it is still being processed, else awaits process() and
+    remembers its result. Must only be used from the event loop thread.
+
+    Parameters:
+    - key (tuple): The delivery key (see delivery_key).
+    - process: Coroutine function processing the delivery.
+
+    Returns:
+    - The result of the (first) delivery.
+    """
+    result = lookup(key)
+    if result is not None:
+        logger.info(f"Repeated delivery for user {key[0]}. Returning original result.")
+        return result
+    while key in in_flight:
+        metrics.incr("webhook_dedup.in_flight_hits")
+        logger.info(f"Repeated delivery for user {key[0]} while in progress. Waiting for its result.")
+        processed, result = await asyncio.shield(in_flight[key])
+        if processed:
+            return result
+        # The first delivery failed, process this one instead
+    future = asyncio.get_running_loop().create_future()
+    in_flight[key] = future
+    try:
+        result = await process()
+    except BaseException:
+        future.set_result((False, None))
+        raise
+    else:
+        remember(key, result)
+        future.set_result((True, result))
+    finally:
+        del in_flight[key]
+    return result
@@ -0,0 +1,195 @@
+"""
+Durable queue of ISE user attribute updates that could not be written (SQLite, data/write_queue.db).
+
+When ISE is unreachable, ise_update_user stores the update here instead of
+dropping it. The queue holds only the latest update per user: a newer update
+replaces the queued one, and a successful direct write removes it. Once ISE is
+reachable again the replay worker drains the queue oldest first with
+write_queue_concurrency parallel writers, rate controlled by the ERS write
+budget (see ers_budget). Each replayed update runs in the user's event chain
+(see event_processor), so it can't overtake or overwrite a newer webhook.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import event_processor
+import fastjson
+import metrics
+from config import get_config
+from logger import logger
+
+DB_PATH = "data/write_queue.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    attributes TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_db = None
+_db_lock = threading.Lock()
+# Usernames with a queued update, so writes for other users don't touch the database
+_queued = set()
+
+
+def get_db() -> sqlite3.Connection:
+    """
+    Opens (and creates) the queue database once per process.
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+            _db = sqlite3.connect(DB_PATH, check_same_thread=False)
+            _db.execute("PRAGMA journal_mode=WAL")
+            # An acknowledged webhook must survive a crash
+            _db.execute("PRAGMA synchronous=FULL")
+            _db.executescript(SCHEMA)
+            _queued.update(row[0] for row in _db.execute("SELECT username FROM pending"))
+        return _db
+
+
+def enqueue(username: str, custom_attributes: dict):
+    """
+    Queues an update, replacing any update already queued for the user.
+    """
+    db = get_db()
+    with _db_lock, db:
+        db.execute(
+            "INSERT OR REPLACE INTO pending (username, attributes, queued_at) VALUES (?, ?, ?)",
+            (username.lower(), fastjson.dumps(custom_attributes), time.time()))
+        _queued.add(username.lower())
+    metrics.incr("ise.write_queue.queued")
+    logger.warning(f"ISE write queue: Update of user {username} queued for replay")
+
+
+def discard(username: str):
+    """
+    Removes the queued update of a user (a newer update has been written).
+    """
+    username = username.lower()
+    db = get_db()
+    if username not in _queued:
+        return
+    with _db_lock, db:
+        db.execute("DELETE FROM pending WHERE username = ?", (username,))
+        _queued.discard(username)
+
+
+def is_pending(username: str) -> bool:
+    get_db()
+    return username.lower() in _queued
+
+
+def has_pending() -> bool:
+    get_db()
+    return bool(_queued)
+
+
+def stats() -> dict:
+    db = get_db()
+    with _db_lock:
+        pending, oldest = db.execute("SELECT COUNT(*), MIN(queued_at) FROM pending").fetchone()
+    return {"pending": pending,
+            "oldest_age": round(time.time() - oldest, 1) if oldest else None}
+
+
+metrics.register_gauge("ise.write_queue", stats)
+
+
+def _is_current(seq: int) -> bool:
+    db = get_db()
+    with _db_lock:
+        return db.execute("SELECT 1 FROM pending WHERE seq = ?", (seq,)).fetchone() is not None
+
+
+def _next_rows(last_seq: int) -> list:
+    db = get_db()
+    with _db_lock:
+        return db.execute(
+            "SELECT seq, username, attributes FROM pending WHERE seq > ? ORDER BY seq LIMIT ?",
+            (last_seq, get_config()["write_queue_batch"])).fetchall()
+
+
+def _finish(seq: int, username: str, outcome: str) -> str:
+    db = get_db()
+    with _db_lock, db:
+        if outcome == "failed":
+            db.execute("UPDATE pending SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+            attempts = db.execute("SELECT attempts FROM pending WHERE seq = ?", (seq,)).fetchone()
+            if attempts is None or attempts[0] < get_config()["write_queue_max_attempts"]:
+                return outcome
+            logger.error(f"ISE write queue: Dropping update of user {username} after {attempts[0]} attempts")
+            outcome = "dropped"
+        # Only the replayed update, a newer one queued meanwhile stays
+        db.execute("DELETE FROM pending WHERE seq = ?", (seq,))
+        if db.execute("SELECT 1 FROM pending WHERE username = ?", (username,)).fetchone() is None:
+            _queued.discard(username)
+    return outcome
+
+
+async def replay(update_func) -> dict:
+    """
+    Replays queued updates until the queue is empty or ISE fails again.
+
+    Parameters:
+    - update_func: Called as update_func(username, custom_attributes). Returns the
+      ISE response, None if ISE is unreachable, or False if the user doesn't exist.
+
+    Returns:
+    - dict: Counts of replayed, dropped, failed and superseded updates, and of
+      updates deferred to the next run because their user's event chain is full.
+    """
+    counts = {"replayed": 0, "dropped": 0, "failed": 0, "superseded": 0, "deferred": 0}
+    limit = asyncio.Semaphore(get_config()["write_queue_concurrency"])
+
+    def apply(row):
+        seq, username, attributes = row
+        if not _is_current(seq):
+            # Written directly or replaced by a newer update while waiting in the user's chain
+            return "superseded"
+        try:
+            res = update_func(username, fastjson.loads(attributes))
+        except Exception as e:
+            logger.error(f"ISE write queue: Replaying update of user {username} failed. Error {e}")
+            res = None
+        if res is None or (res is not False and res.status_code >= 500):
+            outcome = "failed"
+        elif res is False or res.status_code >= 300:
+            logger.error(f"ISE write queue: Update of user {username} rejected, dropping it")
+            outcome = "dropped"
+        else:
+            outcome = "replayed"
+        return _finish(seq, username, outcome)
+
+    async def submit(row):
+        async with limit:
+            try:
+                return await event_processor.submit(row[1], apply, row)
+            except event_processor.Overloaded:
+                return "deferred"
+
+    last_seq = 0
+    while True:
+        rows = await asyncio.to_thread(_next_rows, last_seq)
+        if not rows:
+            break
+        last_seq = rows[-1][0]
+        for outcome in await asyncio.gather(*(submit(row) for row in rows)):
+            counts[outcome] += 1
+        if counts["failed"]:
+            # ISE is (still) failing, leave the rest for the next run
+            break
+    for outcome, count in counts.items():
+        if count:
+            metrics.incr(f"ise.write_queue.{outcome}", count)
+    if any(counts.values()):
+        logger.info(f"ISE write queue: Replay finished {counts}")
+    return counts